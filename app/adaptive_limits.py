@@ -0,0 +1,187 @@
+# app/adaptive_limits.py
+"""基于处理延迟与错误率的自适应限额（AIMD）
+
+各节点统计本地请求延迟和错误率，每个调整周期向集群共享的倍率 key
+发出“增加”或“减少”信号：过载时乘性减小，空闲时加性增大。
+倍率保存在一个 Redis hash 中（m=倍率, ts=上次调整时间, dts=上次减少时间, pre=上次增加前的倍率），
+调整由 Lua 脚本原子完成。同一周期内多个节点的信号取最坏的一个：最多减少一次、最多增加一次，
+已减少过的周期不再增加；先到的“增加”不会挡住同一周期内过载节点的“减少”（减少以增加前的值为基准）。
+节点在本地缓存倍率，限流热路径只读取内存中的值。
+"""
+import asyncio
+import time
+
+ADJUST_SCRIPT = """
+local key = KEYS[1]
+local now_ms = tonumber(ARGV[1])
+local min_interval_ms = tonumber(ARGV[2])
+local signal = ARGV[3]
+local step = tonumber(ARGV[4])
+local factor = tonumber(ARGV[5])
+local min_m = tonumber(ARGV[6])
+local max_m = tonumber(ARGV[7])
+
+local current = tonumber(redis.call('HGET', key, 'm') or max_m)
+local last = tonumber(redis.call('HGET', key, 'ts') or 0)
+
+if signal == 'dec' then
+    -- 每个周期最多减少一次，不受本周期内其他节点的“增加”影响
+    local last_dec = tonumber(redis.call('HGET', key, 'dts') or 0)
+    if now_ms - last_dec >= min_interval_ms then
+        if now_ms - last < min_interval_ms then
+            -- 本周期已有节点增加过：撤销该次增加，再按减少调整
+            current = tonumber(redis.call('HGET', key, 'pre') or current)
+        end
+        current = math.max(min_m, current * factor)
+        redis.call('HSET', key, 'm', tostring(current), 'ts', now_ms, 'dts', now_ms)
+    end
+elseif signal == 'inc' then
+    if now_ms - last >= min_interval_ms then
+        redis.call('HSET', key, 'pre', tostring(current))
+        current = math.min(max_m, current + step)
+        redis.call('HSET', key, 'm', tostring(current), 'ts', now_ms)
+    end
+end
+
+return tostring(current)
+"""
+
+
+class AIMDPolicy:
+    """AIMD 调整规则（与 ADJUST_SCRIPT 保持一致）"""
+
+    def __init__(self, increase_step: float, decrease_factor: float,
+                 min_multiplier: float, max_multiplier: float):
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.min_multiplier = min_multiplier
+        self.max_multiplier = max_multiplier
+
+    def apply(self, current: float, signal: str) -> float:
+        if signal == "dec":
+            return max(self.min_multiplier, current * self.decrease_factor)
+        if signal == "inc":
+            return min(self.max_multiplier, current + self.increase_step)
+        return current
+
+
+class RedisMultiplierStore:
+    """集群共享的倍率，存放在单个 Redis hash 中
+
+    reader 可选（如 ReplicaRouter），用于只读的周期刷新；调整倍率的脚本始终在 client 上执行。
+    clock 返回当前时间（秒），模拟时可传入虚拟时钟。
+    """
+
+    def __init__(self, client, key: str, policy: AIMDPolicy, min_interval: float, reader=None, clock=time.time):
+        self._client = client
+        self._clock = clock
+        self._reader = reader if reader is not None else client
+        self._key = key
+        self._policy = policy
+        self._min_interval_ms = int(min_interval * 1000)
+        self._script = client.register_script(ADJUST_SCRIPT)
+
+    async def adjust(self, signal: str) -> float:
+        policy = self._policy
+        result = await self._script(
+            keys=[self._key],
+            args=[
+                int(self._clock() * 1000),
+                self._min_interval_ms,
+                signal,
+                policy.increase_step,
+                policy.decrease_factor,
+                policy.min_multiplier,
+                policy.max_multiplier,
+            ],
+        )
+        return float(result)
+
+    async def read(self) -> float:
+        value = await self._reader.hget(self._key, "m")
+        return float(value) if value is not None else self._policy.max_multiplier
+
+
+class LocalMultiplierStore:
+    """进程内倍率存储，用于单机部署和离线模拟"""
+
+    def __init__(self, policy: AIMDPolicy):
+        self._policy = policy
+        self.value = policy.max_multiplier
+
+    async def adjust(self, signal: str) -> float:
+        self.value = self._policy.apply(self.value, signal)
+        return self.value
+
+    async def read(self) -> float:
+        return self.value
+
+
+class AdaptiveLimitController:
+    """统计一个周期内的慢请求与错误比例，决定发出的 AIMD 信号"""
+
+    def __init__(self, store, target_latency: float, slow_ratio: float,
+                 max_error_rate: float, min_samples: int, interval: float):
+        self._store = store
+        self._target_latency = target_latency
+        self._slow_ratio = slow_ratio
+        self._max_error_rate = max_error_rate
+        self._min_samples = min_samples
+        self._interval = interval
+        self._task = None
+        self._total = 0
+        self._slow = 0
+        self._errors = 0
+        self.multiplier = 1.0
+        self.last_signal = None
+
+    def observe(self, latency: float, error: bool = False):
+        """热路径：只做计数"""
+        self._total += 1
+        if latency > self._target_latency:
+            self._slow += 1
+        if error:
+            self._errors += 1
+
+    def evaluate(self):
+        """根据本周期统计返回 'dec' / 'inc'，样本不足时返回 None，并重置统计"""
+        total, slow, errors = self._total, self._slow, self._errors
+        self._total = self._slow = self._errors = 0
+        if total < self._min_samples:
+            return None
+        if slow / total > self._slow_ratio or errors / total > self._max_error_rate:
+            return "dec"
+        return "inc"
+
+    async def tick(self):
+        signal = self.evaluate()
+        self.last_signal = signal
+        if signal is None:
+            self.multiplier = await self._store.read()
+        else:
+            self.multiplier = await self._store.adjust(signal)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                # 读不到共享倍率时保留本地缓存值
+                print(f"Adaptive limit update error: {e}")
+
+    def stats(self) -> dict:
+        return {"multiplier": round(self.multiplier, 4), "last_signal": self.last_signal}
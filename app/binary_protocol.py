@@ -0,0 +1,247 @@
+# app/binary_protocol.py
+"""同机服务使用的紧凑二进制决策协议
+
+帧格式: 4 字节大端长度前缀 + 负载
+  请求负载: seq(u32) input_tokens(u32) output_tokens(u32) key_len(u16) + api_key
+  响应负载: seq(u32) blocked(u8) reason_code(u8)
+
+同一连接上可以连续发送多个请求（流水线），响应按完成顺序返回，
+客户端通过 seq 匹配对应请求。
+"""
+import asyncio
+import os
+import struct
+import sys
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+LENGTH_PREFIX = struct.Struct("!I")
+REQUEST_HEADER = struct.Struct("!IIIH")
+RESPONSE_PAYLOAD = struct.Struct("!IBB")
+
+# 单帧最大长度，防止异常客户端撑爆缓冲区
+MAX_FRAME_SIZE = 4096
+
+# reason 编码表，新增原因只能追加到末尾以保持兼容
+REASONS = (
+    "ALLOWED",
+    "RPM_EXCEEDED",
+    "INPUT_TPM_EXCEEDED",
+    "OUTPUT_TPM_EXCEEDED",
+    "INVALID_API_KEY",
+    "SYSTEM_ERROR",
+    "UNKNOWN",
+    "USER_RPM_EXCEEDED",
+    "DAILY_TOKENS_EXCEEDED",
+    "MONTHLY_TOKENS_EXCEEDED",
+    "DAILY_SPEND_EXCEEDED",
+    "MONTHLY_SPEND_EXCEEDED",
+    "IDEMPOTENT_REPLAY",
+    "TENANT_QUEUE_FULL",
+)
+REASON_CODES = {reason: code for code, reason in enumerate(REASONS)}
+UNKNOWN_CODE = REASON_CODES["UNKNOWN"]
+
+CheckFunc = Callable[[str, int, int], Awaitable[Tuple[bool, str]]]
+
+
+def encode_request(seq: int, api_key: str, input_tokens: int, output_tokens: int) -> bytes:
+    """编码一个带长度前缀的请求帧"""
+    key_bytes = api_key.encode()
+    payload_len = REQUEST_HEADER.size + len(key_bytes)
+    return (
+        LENGTH_PREFIX.pack(payload_len)
+        + REQUEST_HEADER.pack(seq, input_tokens, output_tokens, len(key_bytes))
+        + key_bytes
+    )
+
+
+def encode_response(seq: int, is_blocked: bool, reason) -> bytes:
+    """编码一个带长度前缀的响应帧"""
+    if isinstance(reason, bytes):
+        reason = reason.decode()
+    code = REASON_CODES.get(reason, UNKNOWN_CODE)
+    return LENGTH_PREFIX.pack(RESPONSE_PAYLOAD.size) + RESPONSE_PAYLOAD.pack(seq, 1 if is_blocked else 0, code)
+
+
+class DecisionProtocol(asyncio.Protocol):
+    """服务端协议处理器，每个请求帧对应一次限流检查"""
+
+    def __init__(self, check: CheckFunc, max_in_flight: int = 1024):
+        self._check = check
+        self._max_in_flight = max_in_flight
+        self._buffer = bytearray()
+        self._transport = None
+        self._in_flight = 0
+        self._paused = False
+        self._tasks = set()     # 持有在途任务的引用，避免执行中被垃圾回收
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        self._transport = None
+
+    def data_received(self, data):
+        buffer = self._buffer
+        buffer += data
+        offset = 0
+        buffer_len = len(buffer)
+
+        while buffer_len - offset >= LENGTH_PREFIX.size:
+            (frame_len,) = LENGTH_PREFIX.unpack_from(buffer, offset)
+            if frame_len < REQUEST_HEADER.size or frame_len > MAX_FRAME_SIZE:
+                # 非法帧，直接断开连接
+                self._transport.close()
+                buffer.clear()
+                return
+            frame_end = offset + LENGTH_PREFIX.size + frame_len
+            if frame_end > buffer_len:
+                break
+
+            header_start = offset + LENGTH_PREFIX.size
+            seq, input_tokens, output_tokens, key_len = REQUEST_HEADER.unpack_from(buffer, header_start)
+            if key_len != frame_len - REQUEST_HEADER.size:
+                # key 长度与帧长度不一致，后续帧边界不可信，直接断开连接
+                self._transport.close()
+                buffer.clear()
+                return
+            key_start = header_start + REQUEST_HEADER.size
+            api_key = bytes(buffer[key_start:key_start + key_len]).decode(errors="replace")
+            offset = frame_end
+
+            self._in_flight += 1
+            task = asyncio.ensure_future(self._handle(seq, api_key, input_tokens, output_tokens))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        if offset:
+            del buffer[:offset]
+
+        # 背压：在途请求过多时暂停读取
+        if self._in_flight >= self._max_in_flight and not self._paused and self._transport:
+            self._paused = True
+            self._transport.pause_reading()
+
+    async def _handle(self, seq: int, api_key: str, input_tokens: int, output_tokens: int):
+        try:
+            is_blocked, reason = await self._check(api_key, input_tokens, output_tokens)
+        except Exception as e:
+            print(f"Binary protocol check error: {e}")
+            is_blocked, reason = True, "SYSTEM_ERROR"
+
+        self._in_flight -= 1
+        transport = self._transport
+        if transport is None or transport.is_closing():
+            return
+        transport.write(encode_response(seq, is_blocked, reason))
+
+        if self._paused and self._in_flight < self._max_in_flight // 2:
+            self._paused = False
+            transport.resume_reading()
+
+
+async def start_binary_servers(
+    check: CheckFunc,
+    unix_path: Optional[str] = None,
+    tcp_host: str = "127.0.0.1",
+    tcp_port: Optional[int] = None,
+    max_in_flight: int = 1024,
+) -> list:
+    """按配置启动 Unix socket / TCP 监听，返回已启动的 server 列表"""
+    loop = asyncio.get_running_loop()
+    servers = []
+
+    def factory():
+        return DecisionProtocol(check, max_in_flight)
+
+    if unix_path:
+        if sys.platform == "win32":
+            print("⚠️ Windows不支持Unix socket，跳过二进制协议Unix监听")
+        else:
+            server = await loop.create_unix_server(factory, path=unix_path.format(pid=os.getpid()))
+            servers.append(server)
+
+    if tcp_port:
+        server = await loop.create_server(
+            factory,
+            host=tcp_host,
+            port=tcp_port,
+            reuse_port=sys.platform.startswith("linux"),  # 多 worker 共享端口
+        )
+        servers.append(server)
+
+    return servers
+
+
+class BinaryLimiterClient:
+    """二进制决策协议的异步客户端
+
+    check() 可以被大量协程并发调用，请求会在同一连接上流水线发送。
+
+        client = await BinaryLimiterClient.connect_unix("/tmp/rate_limiter.sock")
+        is_blocked, reason = await client.check("test-key-1", 120, 50)
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._seq = 0
+        self._closed = False
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    @classmethod
+    async def connect_unix(cls, path: str) -> "BinaryLimiterClient":
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(reader, writer)
+
+    @classmethod
+    async def connect_tcp(cls, host: str, port: int) -> "BinaryLimiterClient":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def check(self, api_key: str, input_tokens: int, output_tokens: int) -> Tuple[bool, str]:
+        """返回 (is_blocked, reason)，语义与 check_rate_limit_fast 一致"""
+        if self._closed:
+            raise ConnectionError("binary limiter connection closed")
+
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        seq = self._seq
+        future = asyncio.get_running_loop().create_future()
+        self._pending[seq] = future
+        self._writer.write(encode_request(seq, api_key, input_tokens, output_tokens))
+        return await future
+
+    async def _read_loop(self):
+        reader = self._reader
+        try:
+            while True:
+                header = await reader.readexactly(LENGTH_PREFIX.size)
+                (frame_len,) = LENGTH_PREFIX.unpack(header)
+                payload = await reader.readexactly(frame_len)
+                seq, blocked, code = RESPONSE_PAYLOAD.unpack_from(payload)
+                future = self._pending.pop(seq, None)
+                if future is not None and not future.done():
+                    reason = REASONS[code] if code < len(REASONS) else "UNKNOWN"
+                    future.set_result((blocked == 1, reason))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            self._fail_pending(ConnectionError(f"binary limiter connection lost: {e}"))
+        except asyncio.CancelledError:
+            self._fail_pending(ConnectionError("binary limiter client closed"))
+            raise
+
+    def _fail_pending(self, exc: Exception):
+        self._closed = True
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    async def close(self):
+        self._closed = True
+        self._writer.close()
+        self._read_task.cancel()
+        try:
+            await self._read_task
+        except (asyncio.CancelledError, ConnectionError):
+            pass
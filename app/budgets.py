@@ -0,0 +1,27 @@
+# app/budgets.py
+"""长周期预算（滚动 24 小时 / 30 天的 token 与花费上限）的参数换算
+
+预算在限流脚本中以小时桶、天桶累计，这里只负责把套餐配置与模型价格
+换算成脚本参数。花费统一使用整数微美元（1e-6 USD），避免浮点累计误差。
+"""
+from typing import Tuple
+
+from app.config import DEFAULT_MODEL_PRICE, MODEL_PRICES
+
+NO_BUDGETS = (0, 0, 0, 0)
+
+
+def budget_limits(config: dict) -> Tuple[int, int, int, int]:
+    """(日 token, 月 token, 日花费, 月花费)，花费单位为微美元，0 表示不限制"""
+    return (
+        int(config.get("daily_tokens", 0)),
+        int(config.get("monthly_tokens", 0)),
+        int(config.get("daily_spend_usd", 0) * 1_000_000),
+        int(config.get("monthly_spend_usd", 0) * 1_000_000),
+    )
+
+
+def request_spend(model: str, input_tokens: int, output_tokens: int) -> int:
+    """按模型价格估算本次请求花费（微美元）；价格以 USD / 百万 token 配置，恰好等于微美元 / token"""
+    input_price, output_price = MODEL_PRICES.get(model, DEFAULT_MODEL_PRICE)
+    return round(input_tokens * input_price + output_tokens * output_price)
@@ -1,13 +1,40 @@
 # app/config.py
+import os
+import socket
 
 # Redis 连接配置
 # 建议在生产环境中使用环境变量来获取这些值
-REDIS_HOST = "localhost"
-REDIS_PORT = 6379
+REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", "6379"))
+
+# Redis 无响应（网络分区、主节点卡死）时单次调用的延迟上界（秒），超时按 SYSTEM_ERROR 处理
+# 连接池模式对应 socket_timeout / socket_connect_timeout；多路复用模式为连接上没有任何回复的最长时间
+REDIS_SOCKET_TIMEOUT = 0.5
+REDIS_CONNECT_TIMEOUT = 0.5
+LIMITER_ERROR_LOG_INTERVAL = 5.0        # 判定失败的日志最多每 N 秒一行，次数见 /health 的 limiter_failures
+
+# 限流脚本使用的 Redis 客户端
+# "pool": redis-py 连接池，每个并发请求占用一条连接，最多 REDIS_POOL_MAX_CONNECTIONS 条
+# "multiplexed": 少量共享长连接 + 自动流水线（app/redis_mux.py），连接数与并发量无关
+REDIS_CLIENT_MODE = os.environ.get("REDIS_CLIENT_MODE", "pool")
+REDIS_POOL_MAX_CONNECTIONS = 500
+REDIS_MUX_CONNECTIONS = os.cpu_count() or 4    # 多路复用模式的连接数，默认与 CPU 核数相同
+
+# 只读副本：用量查询、自适应倍率读取走滞后在界内的副本，限流脚本与写入始终在主节点
+# 空列表表示全部走主节点；所有副本超界或不可达时自动回退到主节点（app/redis_replicas.py）
+REDIS_REPLICAS = []                     # 例如 [("10.0.0.2", 6379), ("10.0.0.3", 6379)]
+REPLICA_MAX_STALENESS = 1.0             # 允许的最大复制滞后（秒）
+REPLICA_PROBE_INTERVAL = 0.1            # 心跳写入与滞后探测间隔（秒）
+REPLICA_HEARTBEAT_KEY = "replica:heartbeat"   # 实际 key 为 replica:heartbeat:{NODE_ID}
 
 # 滑动窗口的持续时间（秒）
 WINDOW_SECONDS = 60
 
+# 限流脚本的时钟来源
+# "local": 各节点的 time.time()，节点间时钟偏差会平移窗口边界
+# "redis": 脚本内调用 Redis TIME，所有节点共用同一个时钟（每次调用多一次 TIME 命令）
+LIMITER_CLOCK = "local"
+
 # API Key 的速率限制配置
 # 在真实应用中，这些信息通常存储在数据库或专门的配置服务中
 # Key: API Key
@@ -24,6 +51,7 @@ API_KEYS_CONFIG = {
         "rpm": 1000,
         "input_tpm": 200000,
         "output_tpm": 80000,
+        "shed_weight": 8,
     },
     # 你可以在这里添加更多的 API Key
     "unlimited-key": {
@@ -38,5 +66,184 @@ API_KEYS_CONFIG = {
         "rpm": 20,
         "input_tpm": 4000,
         "output_tpm": 1000,
-    }
+        "shed_weight": 1,           # 节点过载时的容量权重，越小越先被拒绝（默认 LOAD_SHED_DEFAULT_WEIGHT）
+    },
+
+    # 以下为各可选功能的示例套餐，上面的基础套餐只配置 rpm / tpm（以及过载保护的 shed_weight）
+    "burst-tier-key": {
+        "name": "Burst Tier",
+        "rpm": 1000,
+        "input_tpm": 200000,
+        "output_tpm": 80000,
+        "burst_ratio": 0.5,  # 空闲时累积未用额度，最多可在稳态限额之上再突发 50%
+    },
+    "per-user-key": {
+        "name": "Per-User Tier",
+        "rpm": 500,
+        "input_tpm": 60000,
+        "output_tpm": 20000,
+        "user_rpm": 100,     # 单个终端用户（请求中的 user 字段）每分钟请求数限制，近似统计
+    },
+    "budget-tier-key": {
+        "name": "Budget Tier",
+        "rpm": 500,
+        "input_tpm": 60000,
+        "output_tpm": 20000,
+        "daily_tokens": 100000,     # 滚动 24 小时 token 上限（输入 + 输出）
+        "monthly_tokens": 1000000,  # 滚动 30 天 token 上限
+        "monthly_spend_usd": 500,   # 滚动 30 天花费上限（按 MODEL_PRICES 估算）
+    },
+    "shadow-tier-key": {
+        "name": "Shadow Tier",
+        "rpm": 500,
+        "input_tpm": 60000,
+        "output_tpm": 20000,
+        # 影子策略：与正式限额在同一次脚本调用中评估，只统计（/health 的 shadow）不拒绝
+        "shadow": {"rpm": 300, "input_tpm": 40000, "output_tpm": 15000},
+    },
+    "approximate-key": {
+        "name": "Approximate High-Volume Tier",
+        "rpm": 100000,
+        "input_tpm": 10000000,
+        "output_tpm": 5000000,
+        "approximate": True, # 开启 GOSSIP_ENABLED 时走节点间近似限流，不访问 Redis（适合高配额套餐）
+    },
+}
+
+# 二进制决策协议（同机服务直连，None 表示关闭）
+# Unix socket 路径可包含 {pid}，多 worker 时每个进程各自监听
+BINARY_UNIX_SOCKET = None      # 例如 "/tmp/rate_limiter_{pid}.sock"
+BINARY_TCP_HOST = "127.0.0.1"
+BINARY_TCP_PORT = None         # 例如 9003，Linux 下多 worker 通过 SO_REUSEPORT 共享
+BINARY_MAX_IN_FLIGHT = 1024    # 单连接最大在途请求数，超过后暂停读取
+
+# 节点标识，用于用量事件等需要区分来源的场景
+NODE_ID = os.environ.get("NODE_ID", f"{socket.gethostname()}:{os.getpid()}")
+
+# 节点内按 key 保存的本地状态（用量缓存、Idempotency 记录）的淘汰策略：
+# "clock" 命中时只置访问位，"lru" 为精确 LRU（每条多一个链表节点）
+KEY_STATE_POLICY = "clock"
+
+# 用量事件流（每次限流决策记录一条事件，后台批量写出）
+USAGE_EVENTS_ENABLED = False
+USAGE_EVENTS_SINK = "redis"             # "redis" 写入 Redis Stream，"file" 写入本地滚动文件
+USAGE_EVENTS_BUFFER_SIZE = 100000       # 进程内缓冲区上限，满了直接丢弃
+USAGE_EVENTS_BATCH_SIZE = 500
+USAGE_EVENTS_FLUSH_INTERVAL = 0.2       # 秒
+USAGE_EVENTS_STREAM_KEY = "usage:events"
+USAGE_EVENTS_STREAM_MAXLEN = 1000000    # 近似裁剪 (MAXLEN ~)
+USAGE_EVENTS_FILE = "usage_events.log"
+USAGE_EVENTS_FILE_MAX_BYTES = 100 * 1024 * 1024
+USAGE_EVENTS_FILE_BACKUPS = 5
+
+# 用量查询 (/v1/usage)
+USAGE_CACHE_TTL = 1.0                   # 节点内缓存时间（秒），仪表盘每秒轮询时最多一次 MGET
+USAGE_CACHE_MAX_KEYS = 100000
+USAGE_CACHE_MEMORY_BUDGET = 32 * 1024 * 1024    # 字节，与 USAGE_CACHE_MAX_KEYS 取较小者
+USAGE_REDIS_MAX_CONNECTIONS = 20        # 独立的小连接池，避免查询流量挤占限流连接
+
+# 自适应限额（AIMD）：根据处理延迟与错误率在集群范围内缩放所有套餐的限额
+ADAPTIVE_LIMITS_ENABLED = False
+ADAPTIVE_MULTIPLIER_KEY = "adaptive:multiplier"  # 集群共享倍率（hash: m, ts）
+ADAPTIVE_TARGET_LATENCY = 0.05          # 目标处理延迟（秒）
+ADAPTIVE_SLOW_RATIO = 0.05              # 超过目标延迟的请求比例上限（约等于 P95）
+ADAPTIVE_MAX_ERROR_RATE = 0.01
+ADAPTIVE_INCREASE_STEP = 0.05           # 加性增加
+ADAPTIVE_DECREASE_FACTOR = 0.7          # 乘性减少
+ADAPTIVE_MIN_MULTIPLIER = 0.1
+ADAPTIVE_MAX_MULTIPLIER = 1.0
+ADAPTIVE_INTERVAL = 1.0                 # 调整/刷新周期（秒），同一周期内集群只调整一次
+ADAPTIVE_MIN_SAMPLES = 20               # 样本不足时只刷新本地缓存，不发出信号
+
+# 节点级过载保护：在途请求数或事件循环延迟超过阈值时，按套餐权重（"shed_weight"）分配容量，
+# 超出份额的请求在读取请求体之前直接返回 503；过载期间 /health 返回 503
+# 默认关闭：开启前先用实际负载压测，确认正常峰值下事件循环延迟不会超过 LOAD_SHED_MAX_LOOP_LAG，
+# 否则节点会拒绝原本能处理的流量，并因 /health 返回 503 被前置代理摘除
+LOAD_SHEDDING_ENABLED = False
+LOAD_SHED_MAX_IN_FLIGHT = 1000          # 单进程在途请求数上限
+LOAD_SHED_MAX_LOOP_LAG = 0.1            # 事件循环延迟上限（秒）
+LOAD_SHED_LAG_INTERVAL = 0.05           # 延迟探测周期（秒）
+LOAD_SHED_DEFAULT_WEIGHT = 4            # 未配置 shed_weight 的套餐权重（无效 key 权重为 1）
+
+# 租户公平调度：同时访问 Redis 的限流调用数有上限，超出时按 API Key 分队列，按 DRR 轮流放行（app/fair_scheduler.py）
+# 每个 key 的权重同样取 "shed_weight"；有其他 key 在排队时，某个 key 的排队位置满直接返回 429（Retry-After: 1），
+# 积压只影响它自己；只有一个 key 在排队时不限排队长度
+FAIR_SCHEDULING_ENABLED = False
+FAIR_MAX_CONCURRENCY = 128              # 单进程同时进行的 Redis 限流调用上限
+FAIR_MAX_QUEUE_PER_TENANT = 64          # 有多个 API Key 排队时每个 key 的排队位置
+FAIR_QUANTUM = 1.0                      # 每轮每单位权重放行的请求数
+
+# Idempotency-Key：首次放行的请求在脚本中记录 TTL 秒，期间相同 key 的重试不再计费
+IDEMPOTENCY_ENABLED = True
+IDEMPOTENCY_TTL_SECONDS = 300
+IDEMPOTENCY_LOCAL_MAX_ENTRIES = 100000  # 进程内缓存容量，本节点的重复重试不访问 Redis
+IDEMPOTENCY_LOCAL_MEMORY_BUDGET = 16 * 1024 * 1024
+
+# 启动预热：SCRIPT LOAD + 预建连接 + 合成请求，完成前 /health 返回 503
+WARMUP_ENABLED = True
+WARMUP_POOL_CONNECTIONS = 50            # 预先建立的 Redis 连接数
+WARMUP_RETRY_INTERVAL = 1.0             # Redis 不可用时的重试间隔（秒）
+
+# 响应缓存：仅缓存 temperature=0 的确定性请求，并合并相同的并发请求
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_MAX_ENTRIES = 10000      # 进程内 LRU 容量
+RESPONSE_CACHE_TTL = 60.0               # 进程内缓存时间（秒）
+RESPONSE_CACHE_REDIS_ENABLED = False    # 是否启用 Redis 共享缓存层
+RESPONSE_CACHE_REDIS_TTL = 300          # Redis 共享层过期时间（秒）
+RESPONSE_CACHE_HIT_CHARGE_RATIO = 0.1   # 命中缓存时 token 按该比例计入限流（请求数照常计 1）
+
+# 前置负载均衡代理 (python -m app.front_proxy)
+FRONT_PROXY_PORT = 8000
+FRONT_PROXY_NODES = [
+    "http://127.0.0.1:8003",
+    "http://127.0.0.1:8004",
+    "http://127.0.0.1:8005",
+]
+FRONT_PROXY_STRATEGY = "least_outstanding"  # least_outstanding / p2c / key_hash
+FRONT_PROXY_HEALTH_INTERVAL = 1.0           # 主动健康检查间隔（秒）
+FRONT_PROXY_FAILURE_THRESHOLD = 3           # 连续失败多少次后剔除
+FRONT_PROXY_EJECT_SECONDS = 10.0            # 剔除时长（秒）
+FRONT_PROXY_UPSTREAM_TIMEOUT = 10.0
+
+# 近似全局限流（节点间 UDP 交换计数，不经过 Redis）
+# 仅对 API_KEYS_CONFIG 中标记 "approximate": True 的套餐生效
+# 每个进程需要独立的 UDP 端口，启用时请以 --workers 1 启动各节点
+GOSSIP_ENABLED = False
+GOSSIP_HOST = "127.0.0.1"
+GOSSIP_PORT = int(os.environ.get("GOSSIP_PORT", "9103"))
+# 逗号分隔的其他节点地址，例如 "127.0.0.1:9104,127.0.0.1:9105"
+GOSSIP_PEERS = [
+    (host, int(port))
+    for host, port in (
+        peer.rsplit(":", 1) for peer in os.environ.get("GOSSIP_PEERS", "").split(",") if peer
+    )
+]
+GOSSIP_INTERVAL = 0.1                   # 广播周期（秒）
+GOSSIP_SLICE_SECONDS = 5                # 窗口时间片粒度（秒）
+GOSSIP_OVERSHOOT = 0.05                 # 允许的最大超发比例
+
+# 终端用户（user 字段）限流：每个 API Key 每个时间片一个 count-min sketch
+# 内存固定为 depth * width * 4 字节 * 时间片数，与终端用户数量无关
+USER_SKETCH_DEPTH = 4                   # 行数（哈希函数个数），越大误判概率越低
+USER_SKETCH_WIDTH = 1024                # 每行计数器个数，高估上界约为 e / width * 该 Key 窗口内总请求数
+USER_SKETCH_SLICE_SECONDS = 10          # 时间片粒度（秒），窗口由 WINDOW_SECONDS / 该值个时间片组成
+
+# 性能诊断（默认关闭，关闭时热路径没有额外开销）
+PHASE_TIMING_ENABLED = False            # 按阶段计时：Server-Timing 响应头 + /debug/timings 直方图
+PROFILER_ENABLED = False                # 允许通过 POST /debug/profile?seconds=N 启动采样分析
+PROFILER_INTERVAL = 0.005               # 采样间隔（秒）
+PROFILER_MAX_SECONDS = 60               # 单次采样最长时间
+PROFILER_OUTPUT_DIR = "profiles"        # collapsed stack 输出目录（flamegraph.pl / speedscope 可读取）
+
+# 流量捕获（紧凑二进制日志，python -m app.replay 回放）
+TRAFFIC_CAPTURE_ENABLED = False
+TRAFFIC_CAPTURE_FILE = "traffic_{pid}.rltc"  # 可包含 {pid}，多 worker 时各自写一个文件
+TRAFFIC_CAPTURE_MAX_BYTES = 1024 * 1024 * 1024  # 达到上限后停止捕获
+
+# 模型价格（USD / 百万 token：输入, 输出），用于长周期花费预算 daily_spend_usd / monthly_spend_usd
+MODEL_PRICES = {
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
 }
+DEFAULT_MODEL_PRICE = (10.0, 30.0)      # 未列出的模型按此价格估算
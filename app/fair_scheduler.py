@@ -0,0 +1,144 @@
+# app/fair_scheduler.py
+"""按租户（API Key）公平调度 Redis 限流调用：并发闸门 + 加权差额轮询（DRR）
+
+节点饱和时，限流调用在连接池、事件循环里按到达顺序（FIFO）排队。一个租户在自己的配额内压测，
+就能让所有租户都排在它的几百个请求后面，按 key 的限额拦不住它。
+
+这里在限流调用前加一道闸门，同时最多 max_concurrency 个调用访问 Redis：
+
+- 闸门有空位且没有人排队时直接通过（常规负载下只多一次比较和计数）
+- 否则进入该租户自己的队列；有其他租户在排队时每个租户最多 max_queue_per_tenant 个排队位置，
+  排满时立即拒绝（TenantQueueFull），重度租户的积压只会拖慢它自己。
+  只有一个租户在排队时不设上限，空闲容量全部给它，与不经过调度时一样排队
+- 空位按 DRR 在有排队的租户之间分配：每轮给租户 quantum × weight 的额度，每个请求消耗 1，
+  权重相同的租户轮流获得空位，轻量租户的请求最多等一轮，而不是等重度租户的整个队列
+"""
+import asyncio
+import math
+from collections import deque
+from typing import Deque, Dict
+
+QUEUE_FULL_REASON = "TENANT_QUEUE_FULL"
+
+# 每轮最少补充的额度：权重为 0（"shed_weight": 0，过载时最先拒绝）的租户也能在有限轮数内得到空位
+MIN_ROUND_CREDIT = 1e-3
+
+
+class TenantQueueFull(Exception):
+    """该租户的排队位置已满"""
+
+
+class FairScheduler:
+    """acquire(tenant, weight) 获得一个调用名额，调用结束后必须 release()"""
+
+    def __init__(self, max_concurrency: int = 128, max_queue_per_tenant: int = 64, quantum: float = 1.0):
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue_per_tenant
+        self._quantum = quantum
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        self._active: Deque[str] = deque()      # 有请求在排队的租户，按轮询顺序
+        self._deficit: Dict[str, float] = {}
+        self._weights: Dict[str, float] = {}
+        self.in_flight = 0
+        self.immediate = 0
+        self.queued = 0
+        self.rejected: Dict[str, int] = {}
+
+    async def acquire(self, tenant: str, weight: float = 1.0):
+        if self.in_flight < self._max_concurrency and not self._active:
+            self.in_flight += 1
+            self.immediate += 1
+            return
+
+        queue = self._queues.get(tenant)
+        queued = len(queue) if queue is not None else 0
+        others = len(self._active) - (queue is not None)
+        if others and queued >= self._max_queue:
+            self.rejected[tenant] = self.rejected.get(tenant, 0) + 1
+            raise TenantQueueFull(tenant)
+        if queue is None:
+            queue = self._queues[tenant] = deque()
+            self._active.append(tenant)
+            self._deficit[tenant] = 0.0
+        # 非正权重按最小额度处理：排在所有租户之后，但不会让轮询空转
+        self._weights[tenant] = weight if weight > 0 else 0.0
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        self.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分到名额但调用方在唤醒前被取消：名额交给下一个
+                self.release()
+            else:
+                self._discard(tenant, future)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        active = self._active
+        idle = 0     # 连续补充额度而没有放行的次数
+        while self.in_flight < self._max_concurrency and active:
+            tenant = active[0]
+            deficit = self._deficit[tenant]
+            if deficit < 1:
+                if idle >= len(active):
+                    # 整整一轮没有租户够额度（权重都很小）：一次补上所需的轮数，不逐轮空转
+                    self._skip_rounds()
+                    idle = 0
+                    continue
+                # 本轮额度用完：补充额度后移到队尾
+                self._deficit[tenant] = deficit + self._credit(tenant)
+                active.rotate(-1)
+                idle += 1
+                continue
+            idle = 0
+            queue = self._queues[tenant]
+            future = queue.popleft()
+            if not future.done():
+                self._deficit[tenant] = deficit - 1
+                self.in_flight += 1
+                future.set_result(None)
+            if not queue:
+                # 队列清空的租户退出轮询，未用完的额度不保留（DRR）
+                active.popleft()
+                del self._queues[tenant]
+                del self._deficit[tenant]
+
+    def _credit(self, tenant: str) -> float:
+        return max(self._quantum * self._weights[tenant], MIN_ROUND_CREDIT)
+
+    def _skip_rounds(self):
+        """按各自额度一次补上若干整轮，轮数取最快够额度的租户所需的轮数，保证至少一个租户可以放行"""
+        active = self._active
+        rounds = min(math.ceil((1 - self._deficit[t]) / self._credit(t)) for t in active)
+        for t in active:
+            self._deficit[t] += rounds * self._credit(t)
+
+    def _discard(self, tenant: str, future: asyncio.Future):
+        queue = self._queues.get(tenant)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            return
+        if not queue:
+            self._active.remove(tenant)
+            del self._queues[tenant]
+            del self._deficit[tenant]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self._max_concurrency,
+            "max_queue_per_tenant": self._max_queue,
+            "queued_now": {tenant: len(queue) for tenant, queue in self._queues.items()},
+            "immediate": self.immediate,
+            "queued": self.queued,
+            "rejected": dict(self.rejected),
+        }
@@ -0,0 +1,246 @@
+# app/fault_proxy.py
+"""注入故障的 asyncio TCP 代理，放在服务节点与 Redis 之间做混沌测试
+
+    python -m app.fault_proxy --port 6479 --upstream localhost:6379 --latency-ms 20 --jitter-ms 10
+
+运行中通过 set_fault / reset_connections 切换故障（tests/chaos_suite_benchmark.py）：
+
+- latency / jitter：发往上游的每段数据延迟 latency ± jitter 秒后转发（每次往返增加这么多），保持先后顺序
+- "refuse"：新连接立即以 RST 断开（Redis 宕机、端口不可达）
+- "blackhole"：已建立的连接两个方向都停止转发、新连接不接通上游（网络分区）；
+  数据按 TCP 重传的效果暂存，恢复后按原顺序送达，由客户端自己的超时决定何时放弃
+- reset_connections()：以 RST 断开当前所有连接（主从切换、中间设备重置连接）
+"""
+import argparse
+import asyncio
+import random
+import socket
+import struct
+from typing import List, Optional, Set
+
+MODES = ("pass", "refuse", "blackhole")
+
+
+def _abort(transport):
+    """SO_LINGER=0 后关闭，对端收到 RST 而不是 FIN"""
+    if transport is None or transport.is_closing():
+        return
+    sock = transport.get_extra_info("socket")
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        except OSError:
+            pass
+    transport.abort()
+
+
+class _Direction:
+    """一个方向上的转发：按故障设置延迟或暂存，送达时刻单调递增以保持顺序"""
+
+    __slots__ = ("proxy", "delayed", "transport", "held", "last_at")
+
+    def __init__(self, proxy: "FaultProxy", delayed: bool):
+        self.proxy = proxy
+        self.delayed = delayed
+        self.transport = None
+        self.held: List[bytes] = []
+        self.last_at = 0.0
+
+    def forward(self, data: bytes):
+        proxy = self.proxy
+        proxy.bytes_forwarded += len(data)
+        if proxy.mode == "blackhole" or self.held:
+            self.held.append(data)
+            return
+        self._deliver(data)
+
+    def _deliver(self, data: bytes):
+        proxy = self.proxy
+        if not self.delayed or (not proxy.latency and not proxy.jitter and self.last_at <= proxy.loop.time()):
+            self._write(data)
+            return
+        delay = max(0.0, proxy.latency + random.uniform(-proxy.jitter, proxy.jitter))
+        self.last_at = max(proxy.loop.time() + delay, self.last_at)
+        proxy.loop.call_at(self.last_at, self._write, data)
+
+    def _write(self, data: bytes):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def release(self):
+        if self.proxy.mode == "blackhole" or self.transport is None:
+            return
+        held, self.held = self.held, []
+        for data in held:
+            self._deliver(data)
+
+
+class _Link:
+    """一条被代理的连接：客户端一侧与上游一侧"""
+
+    def __init__(self, proxy: "FaultProxy"):
+        self.proxy = proxy
+        self.to_upstream = _Direction(proxy, delayed=True)
+        self.to_client = _Direction(proxy, delayed=False)
+        self.client = None
+        self.upstream = None
+
+    def abort(self):
+        _abort(self.client)
+        _abort(self.upstream)
+        self.proxy._links.discard(self)
+
+
+class _UpstreamSide(asyncio.Protocol):
+    def __init__(self, link: _Link):
+        self._link = link
+
+    def data_received(self, data):
+        self._link.to_client.forward(data)
+
+    def connection_lost(self, exc):
+        self._link.abort()
+
+
+class _ClientSide(asyncio.Protocol):
+    def __init__(self, proxy: "FaultProxy"):
+        self._proxy = proxy
+        self._link = _Link(proxy)
+
+    def connection_made(self, transport):
+        proxy = self._proxy
+        link = self._link
+        link.client = link.to_client.transport = transport
+        if proxy.mode == "refuse":
+            proxy.refused += 1
+            _abort(transport)
+            return
+        proxy._links.add(link)
+        proxy.connections += 1
+        asyncio.ensure_future(self._connect_upstream())
+
+    async def _connect_upstream(self):
+        proxy = self._proxy
+        link = self._link
+        # 分区期间上游不可达：连接停在握手阶段，直到恢复或客户端放弃
+        await proxy._reachable.wait()
+        if link.client.is_closing():
+            return
+        try:
+            transport, _ = await proxy.loop.create_connection(
+                lambda: _UpstreamSide(link), proxy.upstream_host, proxy.upstream_port
+            )
+        except OSError:
+            link.abort()
+            return
+        link.upstream = link.to_upstream.transport = transport
+        link.to_upstream.release()
+
+    def data_received(self, data):
+        link = self._link
+        if link.upstream is None:
+            link.to_upstream.held.append(data)
+        else:
+            link.to_upstream.forward(data)
+
+    def connection_lost(self, exc):
+        self._link.abort()
+
+
+class FaultProxy:
+    """host:port -> upstream_host:upstream_port；port=0 时由系统分配，start 后读取 self.port"""
+
+    def __init__(self, upstream_host: str, upstream_port: int, host: str = "127.0.0.1", port: int = 0):
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.host = host
+        self.port = port
+        self.mode = "pass"
+        self.latency = 0.0
+        self.jitter = 0.0
+        self.loop = None
+        self._server = None
+        self._links: Set[_Link] = set()
+        self._reachable: Optional[asyncio.Event] = None
+        self.connections = 0
+        self.refused = 0
+        self.resets = 0
+        self.bytes_forwarded = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._reachable = asyncio.Event()
+        self._reachable.set()
+        self._server = await self.loop.create_server(lambda: _ClientSide(self), self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.reset_connections()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def set_fault(self, mode: str = "pass", latency: float = 0.0, jitter: float = 0.0):
+        """切换故障；从 blackhole 恢复时按顺序送出暂存的数据"""
+        if mode not in MODES:
+            raise ValueError(f"unknown fault mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+        if mode == "blackhole":
+            self._reachable.clear()
+            return
+        self._reachable.set()
+        for link in list(self._links):
+            link.to_upstream.release()
+            link.to_client.release()
+
+    def reset_connections(self) -> int:
+        """以 RST 断开当前所有连接，返回断开的连接数"""
+        links = list(self._links)
+        for link in links:
+            link.abort()
+        self.resets += len(links)
+        return len(links)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "latency_ms": self.latency * 1000,
+            "jitter_ms": self.jitter * 1000,
+            "open_connections": len(self._links),
+            "connections": self.connections,
+            "refused": self.refused,
+            "resets": self.resets,
+            "bytes_forwarded": self.bytes_forwarded,
+        }
+
+
+async def serve(args):
+    host, _, port = args.upstream.rpartition(":")
+    proxy = FaultProxy(host or "localhost", int(port), args.host, args.port)
+    await proxy.start()
+    proxy.set_fault(args.mode, args.latency_ms / 1000, args.jitter_ms / 1000)
+    print(f"🌪️ 故障注入代理启动: {args.host}:{proxy.port} -> {args.upstream}, "
+          f"模式 {args.mode}, 延迟 {args.latency_ms}±{args.jitter_ms}ms")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在节点与 Redis 之间注入延迟、抖动、连接重置和网络分区")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6479)
+    parser.add_argument("--upstream", default="localhost:6379", help="host:port")
+    parser.add_argument("--mode", choices=MODES, default="pass")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# app/front_proxy.py
+"""轻量级 asyncio 前置负载均衡代理
+
+    python -m app.front_proxy --port 8000 --strategy least_outstanding
+
+- 通过各节点的 /health 做主动健康检查（预热中/过载的节点返回 503，会被摘除）
+- 路由策略: least_outstanding（最少在途请求）、p2c（随机两选一）、
+  key_hash（按 API Key 做 rendezvous 哈希，让节点本地缓存保持有效）
+- 上游使用 keep-alive 连接池；连续失败（连接错误、超时、502/504）的节点被快速剔除一段时间，
+  节点主动返回的 503（负载削减，带 Retry-After）不算失败
+- 仅在连接建立失败时重试到其他节点，避免同一请求被限流器重复计费
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from typing import List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from app.config import (
+    FRONT_PROXY_PORT,
+    FRONT_PROXY_NODES,
+    FRONT_PROXY_STRATEGY,
+    FRONT_PROXY_HEALTH_INTERVAL,
+    FRONT_PROXY_FAILURE_THRESHOLD,
+    FRONT_PROXY_EJECT_SECONDS,
+    FRONT_PROXY_UPSTREAM_TIMEOUT,
+)
+
+STRATEGIES = ("least_outstanding", "p2c", "key_hash")
+
+# 逐跳头部不转发
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+
+class Backend:
+    """单个上游节点的状态"""
+
+    __slots__ = ("url", "outstanding", "healthy", "consecutive_failures", "ejected_until", "requests", "failures")
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = False          # 首次健康检查通过前不接流量
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        return self.healthy and self.ejected_until <= now
+
+
+class FrontProxy:
+    def __init__(self, nodes: List[str], strategy: str = "least_outstanding",
+                 health_interval: float = 1.0, failure_threshold: int = 3,
+                 eject_seconds: float = 10.0, upstream_timeout: float = 10.0):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"unknown strategy: {strategy}")
+        self.backends = [Backend(url) for url in nodes]
+        self.strategy = strategy
+        self._health_interval = health_interval
+        self._failure_threshold = failure_threshold
+        self._eject_seconds = eject_seconds
+        self._upstream_timeout = upstream_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._health_task = None
+
+    async def start(self, app=None):
+        connector = aiohttp.TCPConnector(
+            limit=0,                      # 由各节点自身的过载保护限制并发
+            keepalive_timeout=60,
+            enable_cleanup_closed=True,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self._upstream_timeout),
+            auto_decompress=False,
+        )
+        await self.check_health()
+        self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def stop(self, app=None):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+        if self._session is not None:
+            await self._session.close()
+
+    # ---------- 健康检查与剔除 ----------
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self._health_interval)
+            await self.check_health()
+
+    async def check_health(self):
+        await asyncio.gather(*(self._probe(backend) for backend in self.backends))
+
+    async def _probe(self, backend: Backend):
+        try:
+            async with self._session.get(
+                f"{backend.url}/health",
+                timeout=aiohttp.ClientTimeout(total=max(0.5, self._health_interval)),
+            ) as response:
+                await response.read()
+                healthy = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+
+        if healthy and not backend.healthy:
+            print(f"✅ 节点恢复: {backend.url}")
+        elif not healthy and backend.healthy:
+            print(f"❌ 节点不健康: {backend.url}")
+        backend.healthy = healthy
+        if healthy:
+            backend.consecutive_failures = 0
+
+    def _record_failure(self, backend: Backend):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self._failure_threshold:
+            backend.ejected_until = time.monotonic() + self._eject_seconds
+            backend.consecutive_failures = 0
+            print(f"⚠️ 节点连续失败，剔除 {self._eject_seconds}s: {backend.url}")
+
+    # ---------- 路由 ----------
+
+    def pick(self, api_key: str, exclude=()) -> Optional[Backend]:
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+
+        if self.strategy == "key_hash" and api_key:
+            # rendezvous 哈希：节点增减时只有该节点上的 key 会迁移
+            return max(candidates, key=lambda b: _hrw_score(api_key, b.url))
+        if self.strategy == "p2c":
+            first, second = random.sample(candidates, 2)
+            return first if first.outstanding <= second.outstanding else second
+
+        least = min(b.outstanding for b in candidates)
+        return random.choice([b for b in candidates if b.outstanding == least])
+
+    # ---------- 转发 ----------
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.read()
+        auth = request.headers.get("Authorization", "")
+        api_key = auth[7:] if auth.startswith("Bearer ") else ""
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+        tried = []
+        while True:
+            backend = self.pick(api_key, tried)
+            if backend is None:
+                return web.json_response({"detail": "No healthy upstream node"}, status=503)
+
+            backend.outstanding += 1
+            backend.requests += 1
+            try:
+                async with self._session.request(
+                    request.method,
+                    backend.url + request.path_qs,
+                    headers=headers,
+                    data=body,
+                    allow_redirects=False,
+                ) as upstream:
+                    payload = await upstream.read()
+                    if _is_node_failure(upstream.status, upstream.headers, payload):
+                        self._record_failure(backend)
+                    else:
+                        backend.consecutive_failures = 0
+                    response_headers = {
+                        k: v for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS
+                    }
+                    return web.Response(status=upstream.status, body=payload, headers=response_headers)
+            except aiohttp.ClientConnectorError:
+                # 连接都没建立，请求未到达节点，可以安全地换一个节点重试
+                self._record_failure(backend)
+                tried.append(backend)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._record_failure(backend)
+                return web.json_response({"detail": f"Upstream error: {type(e).__name__}"}, status=502)
+            finally:
+                backend.outstanding -= 1
+
+    async def status(self, request: web.Request) -> web.Response:
+        now = time.monotonic()
+        return web.json_response({
+            "strategy": self.strategy,
+            "backends": [
+                {
+                    "url": b.url,
+                    "healthy": b.healthy,
+                    "ejected": b.ejected_until > now,
+                    "outstanding": b.outstanding,
+                    "requests": b.requests,
+                    "failures": b.failures,
+                }
+                for b in self.backends
+            ],
+        })
+
+
+def _is_node_failure(status: int, headers, payload: bytes) -> bool:
+    """只有网关类错误算节点故障，计入连续失败
+
+    节点主动拒绝的 503（负载削减、预热中，带 Retry-After 或 overloaded 响应体）说明节点活着、
+    只是让客户端稍后重试：计入失败会把整个节点剔除，剩余节点分到更多流量后跟着过载。
+    500 是单个请求的错误，同样不剔除节点；节点是否可用交给 /health 探测决定
+    """
+    if status == 503:
+        return "Retry-After" not in headers and b"overloaded" not in payload
+    return status in (502, 504)
+
+
+def _hrw_score(api_key: str, url: str) -> int:
+    return int.from_bytes(hashlib.md5(f"{api_key}|{url}".encode()).digest()[:8], "big")
+
+
+def create_app(proxy: FrontProxy) -> web.Application:
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.on_startup.append(proxy.start)
+    app.on_cleanup.append(proxy.stop)
+    app.router.add_get("/proxy/status", proxy.status)
+    app.router.add_route("*", "/{tail:.*}", proxy.handle)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate Limiter 前置负载均衡代理")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=FRONT_PROXY_PORT)
+    parser.add_argument("--nodes", default=",".join(FRONT_PROXY_NODES), help="逗号分隔的节点地址")
+    parser.add_argument("--strategy", choices=STRATEGIES, default=FRONT_PROXY_STRATEGY)
+    args = parser.parse_args()
+
+    proxy = FrontProxy(
+        [node for node in args.nodes.split(",") if node],
+        strategy=args.strategy,
+        health_interval=FRONT_PROXY_HEALTH_INTERVAL,
+        failure_threshold=FRONT_PROXY_FAILURE_THRESHOLD,
+        eject_seconds=FRONT_PROXY_EJECT_SECONDS,
+        upstream_timeout=FRONT_PROXY_UPSTREAM_TIMEOUT,
+    )
+    print(f"🔀 前置代理启动: 端口 {args.port}, 策略 {args.strategy}, 节点 {args.nodes}")
+    web.run_app(create_app(proxy), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# app/gossip_limiter.py
+"""不依赖 Redis 的近似全局限流：节点间通过 UDP 交换计数（G-counter）
+
+每个节点只递增自己名下的计数，按时间片（slice）分桶：
+    state[api_key][slice_id][node_id] = [requests, input_tokens, output_tokens]
+节点定期把本地有变化的计数广播给其他节点，收到后按分量取最大值合并，
+因此消息重复、乱序、丢失都不会导致重复计数（丢失由定期全量重发修复）。
+
+准入时用合并后的窗口估计值与限额比较。为限制节点间信息延迟带来的超发，
+每个节点在一个广播周期内最多准入 limit * overshoot / 节点数 的额度（请求数与输入/输出 token 分别计算），
+总超发大致不超过 limit * overshoot。滑出窗口的时间片在合并时直接忽略，每次广播前统一清理。适用于高配额套餐，低配额套餐仍应走 Lua 精确路径。
+"""
+import asyncio
+import struct
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+MAGIC = 0x6753  # "gS"
+HEADER = struct.Struct("!HB")            # magic, node_id_len
+ENTRY = struct.Struct("!HIIQQ")          # key_len, slice_id, requests, input_tokens, output_tokens
+MAX_DATAGRAM = 8192
+
+# 每 N 个广播周期做一次全量重发，修复 UDP 丢包
+FULL_SYNC_EVERY = 20
+
+
+class GossipLimiter(asyncio.DatagramProtocol):
+    """基于时间片 G-counter 的近似滑动窗口限流"""
+
+    def __init__(self, node_id: str, peers: List[Tuple[str, int]], window_seconds: int = 60,
+                 slice_seconds: int = 5, overshoot: float = 0.05, interval: float = 0.1):
+        self.node_id = node_id
+        self._node_bytes = node_id.encode()
+        self._peers = peers
+        self._cluster_size = len(peers) + 1
+        self._window_seconds = window_seconds
+        self._slice_seconds = slice_seconds
+        self._overshoot = overshoot
+        self._interval = interval
+        self._state: Dict[str, Dict[int, Dict[str, List[int]]]] = defaultdict(dict)
+        self._dirty = set()                    # 自上次广播后有变化的 (api_key, slice_id)
+        self._pending: Dict[str, List[int]] = {}   # 本周期内本节点已准入但尚未广播的 [请求数, 输入, 输出]
+        self._transport = None
+        self._task = None
+        self._rounds = 0
+        self.known_nodes = {node_id}
+        self.messages_sent = 0
+        self.messages_received = 0
+
+    # ---------- 准入 ----------
+
+    def admit(self, api_key: str, rpm: int, input_tpm: int, output_tpm: int,
+              input_tokens: int, output_tokens: int, now: Optional[float] = None) -> Tuple[bool, str]:
+        """返回 (is_allowed, reason)，reason 与 Lua 脚本保持一致；now 可传入虚拟时钟"""
+        if now is None:
+            now = time.time()
+        current_slice = int(now // self._slice_seconds)
+        first_slice = self._first_slice(now)
+
+        slices = self._state[api_key]
+        used_requests = used_input = used_output = 0
+        for slice_id, per_node in list(slices.items()):
+            if slice_id < first_slice:
+                # 已滑出窗口的时间片直接丢弃（其余 key 的过期时间片在 broadcast 时清理）
+                del slices[slice_id]
+                continue
+            for counts in per_node.values():
+                used_requests += counts[0]
+                used_input += counts[1]
+                used_output += counts[2]
+
+        if used_requests + 1 > rpm:
+            return False, "RPM_EXCEEDED"
+        if used_input + input_tokens > input_tpm:
+            return False, "INPUT_TPM_EXCEEDED"
+        if used_output + output_tokens > output_tpm:
+            return False, "OUTPUT_TPM_EXCEEDED"
+
+        # 每个广播周期内本节点的“未同步”准入额度，限制整体超发；
+        # token 额度小于单个请求时，每个周期仍放行第一个请求，大请求不会被永久拒绝
+        pending = self._pending.get(api_key)
+        if pending is None:
+            pending = self._pending[api_key] = [0, 0, 0]
+        if self._cluster_size > 1:
+            share = self._overshoot / self._cluster_size
+            if pending[0] + 1 > max(1, int(rpm * share)):
+                return False, "RPM_EXCEEDED"
+            if pending[1] and pending[1] + input_tokens > input_tpm * share:
+                return False, "INPUT_TPM_EXCEEDED"
+            if pending[2] and pending[2] + output_tokens > output_tpm * share:
+                return False, "OUTPUT_TPM_EXCEEDED"
+
+        counts = slices.setdefault(current_slice, {}).setdefault(self.node_id, [0, 0, 0])
+        counts[0] += 1
+        counts[1] += input_tokens
+        counts[2] += output_tokens
+        pending[0] += 1
+        pending[1] += input_tokens
+        pending[2] += output_tokens
+        self._dirty.add((api_key, current_slice))
+        return True, "ALLOWED"
+
+    def estimate(self, api_key: str, now: Optional[float] = None) -> Tuple[int, int, int]:
+        """合并后的窗口用量估计 (requests, input_tokens, output_tokens)"""
+        if now is None:
+            now = time.time()
+        first_slice = self._first_slice(now)
+        totals = [0, 0, 0]
+        for slice_id, per_node in self._state.get(api_key, {}).items():
+            if slice_id >= first_slice:
+                for counts in per_node.values():
+                    totals[0] += counts[0]
+                    totals[1] += counts[1]
+                    totals[2] += counts[2]
+        return totals[0], totals[1], totals[2]
+
+    def _first_slice(self, now: float) -> int:
+        """窗口内最早的时间片编号"""
+        return int(now // self._slice_seconds) - self._window_seconds // self._slice_seconds + 1
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """丢弃所有 key 已滑出窗口的时间片，以及不再有时间片的 key；返回丢弃的时间片数"""
+        if now is None:
+            now = time.time()
+        first_slice = self._first_slice(now)
+        removed = 0
+        for api_key, slices in list(self._state.items()):
+            for slice_id in [s for s in slices if s < first_slice]:
+                del slices[slice_id]
+                removed += 1
+            if not slices:
+                del self._state[api_key]
+        return removed
+
+    # ---------- 合并 ----------
+
+    def merge(self, node_id: str, api_key: str, slice_id: int, counts: List[int], now: Optional[float] = None):
+        """G-counter 合并：按分量取最大值，幂等且与顺序无关；已滑出窗口的时间片直接忽略"""
+        if node_id == self.node_id:
+            return
+        self.known_nodes.add(node_id)
+        if now is None:
+            now = time.time()
+        if slice_id < self._first_slice(now):
+            return
+        current = self._state[api_key].setdefault(slice_id, {}).get(node_id)
+        if current is None:
+            self._state[api_key][slice_id][node_id] = list(counts)
+        else:
+            for i in range(3):
+                if counts[i] > current[i]:
+                    current[i] = counts[i]
+
+    # ---------- 编解码 ----------
+
+    def encode_deltas(self, full: bool = False) -> List[bytes]:
+        """把本节点名下（有变化的）计数编码为若干个数据报"""
+        if full:
+            items = [
+                (api_key, slice_id)
+                for api_key, slices in self._state.items()
+                for slice_id, per_node in slices.items()
+                if self.node_id in per_node
+            ]
+        else:
+            items = list(self._dirty)
+        self._dirty.clear()
+
+        header = HEADER.pack(MAGIC, len(self._node_bytes)) + self._node_bytes
+        datagrams = []
+        chunk = bytearray(header)
+        for api_key, slice_id in items:
+            counts = self._state.get(api_key, {}).get(slice_id, {}).get(self.node_id)
+            if counts is None:
+                continue
+            key_bytes = api_key.encode()
+            entry = ENTRY.pack(len(key_bytes), slice_id, counts[0], counts[1], counts[2]) + key_bytes
+            if len(chunk) + len(entry) > MAX_DATAGRAM:
+                datagrams.append(bytes(chunk))
+                chunk = bytearray(header)
+            chunk += entry
+        if len(chunk) > len(header):
+            datagrams.append(bytes(chunk))
+        return datagrams
+
+    def decode_and_merge(self, data: bytes, now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        magic, node_len = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            return
+        offset = HEADER.size
+        node_id = data[offset:offset + node_len].decode()
+        offset += node_len
+        while offset + ENTRY.size <= len(data):
+            key_len, slice_id, requests, input_tokens, output_tokens = ENTRY.unpack_from(data, offset)
+            offset += ENTRY.size
+            api_key = data[offset:offset + key_len].decode()
+            offset += key_len
+            self.merge(node_id, api_key, slice_id, [requests, input_tokens, output_tokens], now)
+
+    # ---------- 网络 ----------
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        self.messages_received += 1
+        try:
+            self.decode_and_merge(data)
+        except (struct.error, UnicodeDecodeError):
+            pass
+
+    async def start(self, host: str, port: int):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        self._task = asyncio.ensure_future(self._gossip_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._transport is not None:
+            self._transport.close()
+
+    def broadcast(self, now: Optional[float] = None):
+        # 先清理过期时间片：只通过合并到达的 key、不再活跃的 key 也不会无限增长，全量重发不再带上过期计数
+        self.prune(now)
+        self._rounds += 1
+        datagrams = self.encode_deltas(full=self._rounds % FULL_SYNC_EVERY == 0)
+        self._pending.clear()
+        if self._transport is None:
+            return
+        for data in datagrams:
+            for peer in self._peers:
+                self._transport.sendto(data, peer)
+                self.messages_sent += 1
+
+    async def _gossip_loop(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            self.broadcast()
+
+    def stats(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "known_nodes": len(self.known_nodes),
+            "tracked_keys": len(self._state),
+            "messages_sent": self.messages_sent,
+            "messages_received": self.messages_received,
+        }
@@ -0,0 +1,64 @@
+# app/idempotency.py
+"""Idempotency-Key：客户端超时重试不重复计费
+
+首次请求被放行时，限流脚本在同一次调用中写入 rl:{api_key}:idem:{key}（短 TTL）；
+TTL 内带相同 Idempotency-Key 的重试在脚本开头直接返回 IDEMPOTENT_REPLAY，不再计数。
+被拒绝的请求没有计费，不记录，重试照常判定。
+
+同一节点上的重复重试由进程内有界存储（app/key_state.py）直接应答，不访问 Redis。
+"""
+import hashlib
+import time
+from typing import Optional
+
+from app.key_state import KeyStateStore
+
+REPLAY_REASON = "IDEMPOTENT_REPLAY"
+MAX_IDEMPOTENCY_KEY_LENGTH = 255   # 请求头允许的最大长度
+MAX_RAW_KEY_LENGTH = 64            # 超过该长度时以摘要作为 Redis key 的一部分
+
+
+def idempotency_suffix(idempotency_key: str) -> str:
+    """Redis key 中使用的后缀：短 key 原样使用，长 key 取摘要，保持 key 名长度有界"""
+    if len(idempotency_key) <= MAX_RAW_KEY_LENGTH:
+        return idempotency_key
+    return hashlib.blake2b(idempotency_key.encode(), digest_size=16).hexdigest()
+
+
+class IdempotencyCache:
+    """进程内有界存储：api_key + idempotency_key -> 过期时间，只记录已放行（已计费）的请求"""
+
+    def __init__(self, max_entries: int = 100000, ttl: float = 300.0,
+                 memory_budget: Optional[int] = None, policy: str = "clock"):
+        self._ttl = ttl
+        self._entries = KeyStateStore(max_entries, memory_budget, policy)
+        self.hits = 0
+        self.misses = 0
+        self.redis_replays = 0
+
+    def seen(self, api_key: str, idempotency_key: str, now: Optional[float] = None) -> bool:
+        # 拼成一个字符串作为 key，比 (api_key, idempotency_key) 元组少一个对象
+        key = f"{api_key}\0{idempotency_key}"
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            self.misses += 1
+            return False
+        if expires_at <= (now if now is not None else time.monotonic()):
+            self._entries.pop(key)
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def remember(self, api_key: str, idempotency_key: str, now: Optional[float] = None):
+        expires_at = (now if now is not None else time.monotonic()) + self._ttl
+        self._entries.put(f"{api_key}\0{idempotency_key}", expires_at)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "local_hits": self.hits,
+            "misses": self.misses,
+            "redis_replays": self.redis_replays,
+            "evictions": self._entries.evictions,
+        }
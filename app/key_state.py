@@ -0,0 +1,188 @@
+# app/key_state.py
+"""节点内按 key 保存的本地状态（用量缓存、Idempotency 记录等）的公共存储
+
+10 万以上的 key 时，每个 key 一个 dict / tuple（以及 OrderedDict 的链表节点）的开销远大于数据本身。
+这里把 key 驻留为整数槽位，状态按槽位存放在并列的数组中（struct-of-arrays）：
+
+    _slots:   key -> 槽位
+    _keys:    槽位 -> key
+    _records: 槽位 -> 记录（调用方定义的 __slots__ 类，或单个数值）
+
+容量取 max_entries 与 memory_budget（字节，按首条记录估算单条占用）中较小者，
+满了之后由淘汰策略选出槽位复用：
+
+- "clock"（默认）：每个槽位 1 字节访问位，命中只置位、不移动任何结构，淘汰时时针扫过清零
+- "lru"：精确 LRU，命中时 move_to_end，每个槽位多一个链表节点
+
+也可以传入实现了 insert / touch / remove / victim 的策略对象。
+"""
+import sys
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Union
+
+# 每条记录在 _slots（dict 表项与索引，按约 2/3 装载率）、_keys / _records（两个指针）与策略中的固定开销
+ENTRY_OVERHEAD_BYTES = 72
+
+
+class ClockPolicy:
+    """CLOCK（second chance）：近似 LRU，命中路径只写一个字节"""
+
+    def __init__(self):
+        self.ref = bytearray()     # KeyStateStore.get 直接置位，省去一次方法调用
+        self._hand = 0
+
+    def insert(self, slot: int):
+        # 新记录不带访问位，只有被再次命中才获得第二次机会；只访问一次的 key 最先被淘汰
+        if slot == len(self.ref):
+            self.ref.append(0)
+        else:
+            self.ref[slot] = 0
+
+    def touch(self, slot: int):
+        self.ref[slot] = 1
+
+    def remove(self, slot: int):
+        self.ref[slot] = 0
+
+    def victim(self) -> int:
+        """只在所有槽位都被占用时调用；被选中的槽位随后由 insert 复用"""
+        ref = self.ref
+        size = len(ref)
+        hand = self._hand
+        while ref[hand]:
+            ref[hand] = 0
+            hand = hand + 1 if hand + 1 < size else 0
+        self._hand = hand + 1 if hand + 1 < size else 0
+        return hand
+
+
+class LRUPolicy:
+    """精确 LRU：按槽位维护访问顺序"""
+
+    def __init__(self):
+        self._order: "OrderedDict[int, None]" = OrderedDict()
+
+    def insert(self, slot: int):
+        self._order[slot] = None
+
+    def touch(self, slot: int):
+        self._order.move_to_end(slot)
+
+    def remove(self, slot: int):
+        del self._order[slot]
+
+    def victim(self) -> int:
+        return self._order.popitem(last=False)[0]
+
+
+POLICIES = {"clock": ClockPolicy, "lru": LRUPolicy}
+
+
+def deep_size(obj: Any) -> int:
+    """记录占用的字节数估算：递归计入 __slots__ 属性与 dict / list / tuple 的内容"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k) + deep_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_size(getattr(obj, name)) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+class KeyStateStore:
+    """有界的 key -> 记录存储，带命中 / 未命中 / 淘汰计数"""
+
+    def __init__(self, max_entries: int = 100000, memory_budget: Optional[int] = None,
+                 policy: Union[str, Any] = "clock"):
+        self._max_entries = max_entries
+        self._memory_budget = memory_budget
+        self._policy = POLICIES[policy]() if isinstance(policy, str) else policy
+        self._policy_name = policy if isinstance(policy, str) else type(policy).__name__
+        self._clock_ref = self._policy.ref if isinstance(self._policy, ClockPolicy) else None
+        self._slots: dict = {}
+        self._keys: list = []
+        self._records: list = []
+        self._free: list = []
+        self.capacity = max_entries
+        self.entry_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slots
+
+    def get(self, key: Hashable) -> Any:
+        """返回记录并标记为最近使用，不存在时返回 None"""
+        slot = self._slots.get(key)
+        if slot is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self._clock_ref is not None:
+            self._clock_ref[slot] = 1
+        else:
+            self._policy.touch(slot)
+        return self._records[slot]
+
+    def put(self, key: Hashable, record: Any):
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._records[slot] = record
+            self._policy.touch(slot)
+            return
+        if self.entry_bytes is None:
+            self._size_for_budget(key, record)
+
+        if self._free:
+            slot = self._free.pop()
+        elif len(self._keys) < self.capacity:
+            slot = len(self._keys)
+            self._keys.append(None)
+            self._records.append(None)
+        else:
+            slot = self._policy.victim()
+            del self._slots[self._keys[slot]]
+            self.evictions += 1
+        self._keys[slot] = key
+        self._records[slot] = record
+        self._slots[key] = slot
+        self._policy.insert(slot)
+
+    def pop(self, key: Hashable) -> Any:
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return None
+        record = self._records[slot]
+        self._keys[slot] = None
+        self._records[slot] = None
+        self._policy.remove(slot)
+        self._free.append(slot)
+        return record
+
+    def clear(self):
+        for key in list(self._slots):
+            self.pop(key)
+
+    def _size_for_budget(self, key: Hashable, record: Any):
+        """按首条记录估算单条占用，确定 memory_budget 对应的容量"""
+        self.entry_bytes = deep_size(key) + deep_size(record) + ENTRY_OVERHEAD_BYTES
+        if self._memory_budget is not None:
+            self.capacity = max(1, min(self._max_entries, self._memory_budget // self.entry_bytes))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._slots),
+            "capacity": self.capacity,
+            "policy": self._policy_name,
+            "entry_bytes": self.entry_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,239 @@
+# app/keyspace_maintenance.py
+"""rl:* 键空间占用报告与窗口外成员裁剪工具
+
+用法:
+    python -m app.keyspace_maintenance report [--sample 10000] [--top 20] [--replica-url redis://replica:6379]
+    python -m app.keyspace_maintenance trim [--batch 100] [--dry-run]
+
+所有命令都经过 --max-ops 限速（每秒发往 Redis 的命令数上限），
+SCAN 与流水线中的每条命令都计入预算，可以在生产环境安全运行。
+report 只读，指定 --replica-url 时在滞后不超过 REPLICA_MAX_STALENESS 的副本上采样，否则回到主节点。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+import redis.asyncio as redis
+
+from app.config import (
+    API_KEYS_CONFIG,
+    REDIS_HOST,
+    REDIS_PORT,
+    REPLICA_HEARTBEAT_KEY,
+    REPLICA_MAX_STALENESS,
+    REPLICA_PROBE_INTERVAL,
+    WINDOW_SECONDS,
+)
+from app.redis_replicas import ReplicaRouter
+
+# 限流脚本中以有序集合保存的维度
+ZSET_KINDS = ("req", "input", "output")
+
+
+class OpsBudget:
+    """简单的每秒命令数预算，超出时休眠"""
+
+    def __init__(self, max_ops_per_sec: int):
+        self._max_ops = max_ops_per_sec
+        self._window_start = time.monotonic()
+        self._used = 0
+        self.total = 0
+
+    async def acquire(self, ops: int):
+        self.total += ops
+        if self._max_ops <= 0:
+            return
+        self._used += ops
+        if self._used >= self._max_ops:
+            elapsed = time.monotonic() - self._window_start
+            if elapsed < 1.0:
+                await asyncio.sleep(1.0 - elapsed)
+            self._window_start = time.monotonic()
+            self._used = 0
+
+
+def parse_key(key: str):
+    """rl:{api_key}:{kind} -> (api_key, kind)，kind 例如 req / req:counter / req:last_sync / users / idem"""
+    parts = key.split(":")
+    if len(parts) < 3 or parts[0] != "rl":
+        return None, key
+    if parts[1] == "limits":
+        # rl:limits:{limit_id} 为套餐共享的静态限额 hash，不属于某个 API Key
+        return None, "limits"
+    if parts[2] == "users":
+        # 终端用户 sketch 按时间片分 key，统一归为一类
+        return parts[1], "users"
+    if parts[2] == "idem":
+        # 幂等记录按 Idempotency-Key 分 key，统一归为一类
+        return parts[1], "idem"
+    return parts[1], ":".join(parts[2:])
+
+
+async def scan_keys(client, budget: OpsBudget, pattern: str, scan_count: int, limit: int = 0):
+    """按批次产出匹配的 key，limit 为 0 表示全量扫描"""
+    cursor = 0
+    seen = 0
+    while True:
+        await budget.acquire(1)
+        cursor, keys = await client.scan(cursor=cursor, match=pattern, count=scan_count)
+        if keys:
+            if limit:
+                keys = keys[:max(0, limit - seen)]
+            seen += len(keys)
+            yield [k.decode() if isinstance(k, bytes) else k for k in keys]
+        if cursor == 0 or (limit and seen >= limit):
+            break
+
+
+async def build_report(client, budget: OpsBudget, pattern: str, scan_count: int,
+                       batch_size: int, sample: int) -> dict:
+    """SCAN + 流水线 MEMORY USAGE / ZCARD，按 API Key 与套餐汇总"""
+    per_key = defaultdict(lambda: {"bytes": 0, "keys": 0, "zset_members": 0, "kinds": defaultdict(int)})
+
+    async for keys in scan_keys(client, budget, pattern, scan_count, sample):
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            pipe = client.pipeline(transaction=False)
+            ops = 0
+            for key in batch:
+                pipe.memory_usage(key)
+                ops += 1
+                if parse_key(key)[1] in ZSET_KINDS:
+                    pipe.zcard(key)
+                    ops += 1
+            await budget.acquire(ops)
+            results = iter(await pipe.execute())
+
+            for key in batch:
+                api_key, kind = parse_key(key)
+                size = next(results) or 0
+                stats = per_key[api_key or "(other)"]
+                stats["bytes"] += size
+                stats["keys"] += 1
+                stats["kinds"][kind] += size
+                if kind in ZSET_KINDS:
+                    stats["zset_members"] += next(results) or 0
+
+    per_tier = defaultdict(lambda: {"bytes": 0, "api_keys": 0, "keys": 0})
+    for api_key, stats in per_key.items():
+        tier = API_KEYS_CONFIG.get(api_key, {}).get("name", "unknown")
+        per_tier[tier]["bytes"] += stats["bytes"]
+        per_tier[tier]["api_keys"] += 1
+        per_tier[tier]["keys"] += stats["keys"]
+
+    await budget.acquire(1)
+    return {
+        "dbsize": await client.dbsize(),
+        "sampled_keys": sum(s["keys"] for s in per_key.values()),
+        "total_bytes": sum(s["bytes"] for s in per_key.values()),
+        "per_key": {k: {**v, "kinds": dict(v["kinds"])} for k, v in per_key.items()},
+        "per_tier": dict(per_tier),
+        "redis_ops": budget.total,
+    }
+
+
+async def trim_out_of_window(client, budget: OpsBudget, pattern: str, scan_count: int,
+                             batch_size: int, dry_run: bool = False) -> dict:
+    """删除有序集合中已离开滑动窗口的成员（与脚本校准逻辑一致，不影响计数器）"""
+    window_start_us = int(time.time() * 1_000_000) - WINDOW_SECONDS * 1_000_000
+    trimmed_keys = 0
+    removed_members = 0
+
+    async for keys in scan_keys(client, budget, pattern, scan_count):
+        zset_keys = [k for k in keys if parse_key(k)[1] in ZSET_KINDS]
+        for start in range(0, len(zset_keys), batch_size):
+            batch = zset_keys[start:start + batch_size]
+            pipe = client.pipeline(transaction=False)
+            for key in batch:
+                if dry_run:
+                    pipe.zcount(key, "-inf", window_start_us)
+                else:
+                    pipe.zremrangebyscore(key, "-inf", window_start_us)
+            await budget.acquire(len(batch))
+            counts = await pipe.execute()
+            trimmed_keys += sum(1 for c in counts if c)
+            removed_members += sum(counts)
+
+    return {
+        "window_start_us": window_start_us,
+        "trimmed_keys": trimmed_keys,
+        "removed_members": removed_members,
+        "dry_run": dry_run,
+        "redis_ops": budget.total,
+    }
+
+
+def print_report(report: dict, top: int):
+    print(f"📦 DBSIZE: {report['dbsize']}, 采样 key 数: {report['sampled_keys']}, "
+          f"总占用: {report['total_bytes'] / 1024:.1f} KB, Redis 命令数: {report['redis_ops']}")
+
+    print(f"\n{'套餐':<24}{'API Keys':>10}{'Redis Keys':>12}{'字节':>14}")
+    for tier, stats in sorted(report["per_tier"].items(), key=lambda x: -x[1]["bytes"]):
+        print(f"{tier:<24}{stats['api_keys']:>10}{stats['keys']:>12}{stats['bytes']:>14}")
+
+    print(f"\n占用最高的 {top} 个 API Key:")
+    print(f"{'API Key':<32}{'Redis Keys':>12}{'ZSET成员':>12}{'字节':>14}")
+    ranked = sorted(report["per_key"].items(), key=lambda x: -x[1]["bytes"])[:top]
+    for api_key, stats in ranked:
+        print(f"{api_key:<32}{stats['keys']:>12}{stats['zset_members']:>12}{stats['bytes']:>14}")
+
+
+async def pick_report_client(client, replicas):
+    """探测两次心跳（第一次写入的心跳需要时间复制），返回滞后在界内的副本，否则返回主节点"""
+    router = ReplicaRouter(client, replicas, f"{REPLICA_HEARTBEAT_KEY}:maintenance-{os.getpid()}",
+                           max_staleness=REPLICA_MAX_STALENESS)
+    await router.probe()
+    await asyncio.sleep(REPLICA_PROBE_INTERVAL)
+    await router.probe()
+    chosen = router.reader()
+    lags = ", ".join("不可用" if lag == float("inf") else f"{lag * 1000:.0f}ms" for lag in router.staleness)
+    print(f"🔁 副本滞后: {lags} -> {'主节点' if chosen is client else '副本'}上采样", file=sys.stderr)
+    return chosen
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="rl:* 键空间占用报告与裁剪")
+    parser.add_argument("command", choices=["report", "trim"])
+    parser.add_argument("--url", default=f"redis://{REDIS_HOST}:{REDIS_PORT}")
+    parser.add_argument("--replica-url", action="append", default=[], help="report 优先使用的只读副本，可重复指定")
+    parser.add_argument("--pattern", default="rl:*")
+    parser.add_argument("--max-ops", type=int, default=1000, help="每秒最多发送的 Redis 命令数，0 表示不限")
+    parser.add_argument("--scan-count", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=100, help="每个流水线包含的 key 数")
+    parser.add_argument("--sample", type=int, default=0, help="report 最多采样的 key 数，0 表示全量")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--dry-run", action="store_true", help="trim 只统计不删除")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(args.url)
+    replicas = [redis.Redis.from_url(url) for url in args.replica_url]
+    budget = OpsBudget(args.max_ops)
+    try:
+        if args.command == "report":
+            report_client = client
+            if replicas:
+                report_client = await pick_report_client(client, replicas)
+            result = await build_report(report_client, budget, args.pattern, args.scan_count, args.batch, args.sample)
+            if not args.json:
+                print_report(result, args.top)
+        else:
+            result = await trim_out_of_window(client, budget, args.pattern, args.scan_count, args.batch, args.dry_run)
+            if not args.json:
+                action = "可裁剪" if args.dry_run else "已裁剪"
+                print(f"✂️ {action} {result['removed_members']} 个窗口外成员，涉及 {result['trimmed_keys']} 个有序集合，"
+                      f"Redis 命令数: {result['redis_ops']}")
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        for replica in replicas:
+            await replica.aclose()
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
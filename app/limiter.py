@@ -0,0 +1,745 @@
+# app/limiter.py
+"""端点无关的限流核心
+
+- LIMITER_SCRIPT / build_limiter_call: 限流 Lua 脚本及其 KEYS/ARGV 构造（回放、基准测试直接复用）
+- CompiledKey / build_compiled_call: 服务内使用的预编译调用，静态限额存放在 Redis 的限额 hash 中，每次只传动态值
+- RateLimitGuard: 鉴权 + 限流判定 + 429，任何端点在算出 token 数之后调用 enforce()
+- LimiterFailures: 判定失败（Redis 超时、断连等）的计数与限频日志
+- body_limited(): FastAPI 依赖，读取原始请求体、一次解析算出整批输入的 token 数后判定，
+  处理函数拿到的是 LimitedRequest，不再经过 Pydantic 逐元素构造模型
+- count_embedding_tokens / count_completion_tokens: 批量输入的 token 估算
+
+判定函数（check）与二进制协议一样由调用方注入，签名同 check_rate_limit_fast。
+"""
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, NamedTuple, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, Request
+
+from app.budgets import NO_BUDGETS, budget_limits
+from app.config import USER_SKETCH_DEPTH, USER_SKETCH_SLICE_SECONDS, USER_SKETCH_WIDTH, WINDOW_SECONDS
+from app.fair_scheduler import QUEUE_FULL_REASON
+from app.idempotency import MAX_IDEMPOTENCY_KEY_LENGTH, idempotency_suffix
+from app.shadow_policy import NO_SHADOW, shadow_limits
+from app.user_sketch import sketch_offsets
+
+WINDOW_US = WINDOW_SECONDS * 1_000_000
+SKETCH_SLICE_US = USER_SKETCH_SLICE_SECONDS * 1_000_000
+SKETCH_SLICES = WINDOW_SECONDS // USER_SKETCH_SLICE_SECONDS
+
+# 限流 Lua 脚本：计数器 + 定期校准的三维滑动窗口，可选的突发额度与终端用户 sketch 限流
+# KEYS[4] 为突发额度 hash，KEYS[5] 为长周期预算 hash，之后依次为（可选的）限额 hash、幂等记录，
+# 最后为窗口内各时间片的用户 sketch（最后一个是当前时间片）
+# ARGV[1] 为 0 时使用 Redis TIME 作为当前时间，ARGV[2] 改为窗口长度
+# 限额有两种传法：
+#   内联（build_limiter_call）: ARGV[3..8] 为 rpm、输入/输出 tpm、输入/输出 token、请求 ID，ARGV[9] 为突发额度上限，
+#     ARGV[10..14] 为日/月 token 与花费预算及本次花费，ARGV[15..17] 为影子策略限额，
+#     ARGV[18] 为幂等记录 TTL（秒，> 0 时带幂等记录 key），ARGV[19..] 为用户限额、sketch TTL 与计数器下标
+#   预编译（build_compiled_call）: ARGV[3] 为 '@'，静态限额在 KEYS[6] 的限额 hash 中；ARGV[4] 为自适应倍率，
+#     ARGV[5..8] 为输入/输出 token、请求 ID 与本次花费，ARGV[9] 为 1 时带幂等记录 key，ARGV[10..] 为计数器下标
+#     限额 hash 不存在时返回 NO_LIMITS，调用方写入后重试
+# 返回 {是否放行, 原因, 影子策略结论（未配置时为空串）}
+LIMITER_SCRIPT = """
+    local request_key = KEYS[1]
+    local input_key = KEYS[2] 
+    local output_key = KEYS[3]
+    local next_key = 6
+
+    local current_time = tonumber(ARGV[1])
+    local window_start = tonumber(ARGV[2])
+    if current_time == 0 then
+        -- 使用 Redis 服务器时钟（各节点时钟偏差不影响窗口边界），此时 ARGV[2] 为窗口长度（微秒）
+        if redis.replicate_commands then
+            redis.replicate_commands()
+        end
+        local now = redis.call('TIME')
+        current_time = tonumber(now[1]) * 1000000 + tonumber(now[2])
+        window_start = current_time - window_start
+    end
+
+    local rpm_limit, input_tpm_limit, output_tpm_limit, burst_ratio
+    local daily_tokens_limit, monthly_tokens_limit, daily_spend_limit, monthly_spend_limit
+    local shadow_rpm, shadow_input_limit, shadow_output_limit
+    local input_tokens, output_tokens, request_id, spend
+    local idem_key, idem_ttl, user_rpm, sketch_ttl, offset_first
+    if ARGV[3] == '@' then
+        -- 预编译：静态限额只在套餐配置变化时写入一次，每次调用只传动态值
+        local limits = redis.call('HMGET', KEYS[6], 'r', 'i', 'o', 'b', 'dt', 'mt', 'ds', 'ms', 'sr', 'si', 'so', 'u', 'it', 'st')
+        if not limits[1] then
+            return {0, 'NO_LIMITS', ''}
+        end
+        next_key = 7
+        local multiplier = tonumber(ARGV[4])
+        rpm_limit = math.floor(tonumber(limits[1]) * multiplier)
+        input_tpm_limit = math.floor(tonumber(limits[2]) * multiplier)
+        output_tpm_limit = math.floor(tonumber(limits[3]) * multiplier)
+        burst_ratio = tonumber(limits[4])
+        daily_tokens_limit = tonumber(limits[5])
+        monthly_tokens_limit = tonumber(limits[6])
+        daily_spend_limit = tonumber(limits[7])
+        monthly_spend_limit = tonumber(limits[8])
+        shadow_rpm = tonumber(limits[9])
+        if shadow_rpm > 0 then
+            shadow_rpm = math.max(1, math.floor(shadow_rpm * multiplier))
+        end
+        shadow_input_limit = math.floor(tonumber(limits[10]) * multiplier)
+        shadow_output_limit = math.floor(tonumber(limits[11]) * multiplier)
+        user_rpm = math.floor(tonumber(limits[12]) * multiplier)
+        sketch_ttl = tonumber(limits[14])
+        input_tokens = tonumber(ARGV[5])
+        output_tokens = tonumber(ARGV[6])
+        request_id = ARGV[7]
+        spend = tonumber(ARGV[8])
+        idem_ttl = 0
+        if ARGV[9] == '1' then
+            idem_key = KEYS[next_key]
+            idem_ttl = tonumber(limits[13])
+            next_key = next_key + 1
+        end
+        offset_first = 10
+    else
+        rpm_limit = tonumber(ARGV[3])
+        input_tpm_limit = tonumber(ARGV[4])
+        output_tpm_limit = tonumber(ARGV[5])
+        input_tokens = tonumber(ARGV[6])
+        output_tokens = tonumber(ARGV[7])
+        request_id = ARGV[8]
+        burst_ratio = tonumber(ARGV[9] or 0)
+        daily_tokens_limit = tonumber(ARGV[10] or 0)
+        monthly_tokens_limit = tonumber(ARGV[11] or 0)
+        daily_spend_limit = tonumber(ARGV[12] or 0)
+        monthly_spend_limit = tonumber(ARGV[13] or 0)
+        spend = tonumber(ARGV[14] or 0)
+        shadow_rpm = tonumber(ARGV[15] or 0)
+        shadow_input_limit = tonumber(ARGV[16] or 0)
+        shadow_output_limit = tonumber(ARGV[17] or 0)
+        idem_ttl = tonumber(ARGV[18] or 0)
+        if idem_ttl > 0 then
+            idem_key = KEYS[next_key]
+            next_key = next_key + 1
+        end
+        user_rpm = tonumber(ARGV[19] or 0)
+        sketch_ttl = tonumber(ARGV[20] or 0)
+        offset_first = 21
+    end
+
+    -- 幂等重试：首次请求已放行并计费时直接返回，不再计数
+    if idem_key and redis.call('EXISTS', idem_key) == 1 then
+        return {1, 'IDEMPOTENT_REPLAY', ''}
+    end
+    local sketch_first = next_key
+
+    -- 🚀 使用计数器 + 定期校准的混合策略
+    local req_counter = request_key .. ':counter'
+    local input_counter = input_key .. ':counter'
+    local output_counter = output_key .. ':counter'
+    local last_sync = request_key .. ':last_sync'
+
+    -- 检查是否需要同步校准（每30秒一次，时间单位为微秒）
+    local sync_time = tonumber(redis.call('GET', last_sync) or 0)
+    local need_sync = (current_time - sync_time) > 30000000
+
+    if need_sync then
+        -- 🚀 定期校准：重新计算精确值
+        redis.call('ZREMRANGEBYSCORE', request_key, '-inf', window_start)
+        redis.call('ZREMRANGEBYSCORE', input_key, '-inf', window_start)
+        redis.call('ZREMRANGEBYSCORE', output_key, '-inf', window_start)
+        
+        -- 重新统计精确计数
+        local exact_requests = redis.call('ZCARD', request_key)
+        local exact_input = 0
+        local exact_output = 0
+        
+        -- 重新计算token数量
+        local input_members = redis.call('ZRANGEBYSCORE', input_key, window_start, '+inf')
+        for _, member in ipairs(input_members) do
+            local tokens = tonumber(string.match(member, ':(%d+)$'))
+            exact_input = exact_input + (tokens or 1)
+        end
+        
+        local output_members = redis.call('ZRANGEBYSCORE', output_key, window_start, '+inf')
+        for _, member in ipairs(output_members) do
+            local tokens = tonumber(string.match(member, ':(%d+)$'))
+            exact_output = exact_output + (tokens or 1)
+        end
+        
+        -- 重置计数器为精确值
+        redis.call('SET', req_counter, exact_requests)
+        redis.call('SET', input_counter, exact_input)
+        redis.call('SET', output_counter, exact_output)
+        redis.call('SET', last_sync, current_time)
+        
+        -- 设置过期时间
+        redis.call('EXPIRE', req_counter, 90)
+        redis.call('EXPIRE', input_counter, 90)
+        redis.call('EXPIRE', output_counter, 90)
+        redis.call('EXPIRE', last_sync, 90)
+    end
+
+    -- 🚀 高速模式：使用计数器（校准后同样需要检查并记录本次请求）
+    -- 获取当前计数
+    local current_requests = tonumber(redis.call('GET', req_counter) or 0)
+    local current_input_tokens = tonumber(redis.call('GET', input_counter) or 0)
+    local current_output_tokens = tonumber(redis.call('GET', output_counter) or 0)
+    
+    -- 影子策略：用同一组计数器评估待上线的限额，结论只用于统计，不影响放行
+    local shadow = ''
+    if shadow_rpm > 0 then
+        if current_requests + 1 > shadow_rpm then
+            shadow = 'RPM_EXCEEDED'
+        elseif current_input_tokens + input_tokens > shadow_input_limit then
+            shadow = 'INPUT_TPM_EXCEEDED'
+        elseif current_output_tokens + output_tokens > shadow_output_limit then
+            shadow = 'OUTPUT_TPM_EXCEEDED'
+        else
+            shadow = 'ALLOWED'
+        end
+    end
+
+    -- 突发额度（以窗口容量的比例计）：低于限额时按未使用的比例累积，上限为 burst_ratio，
+    -- 超出稳态限额的部分从额度中扣除；持续超用时额度不会恢复，请求照常被拒绝
+    local burst_key = KEYS[4]
+    local credits = 0
+    local stored_credits = nil
+    if burst_ratio > 0 then
+        local state = redis.call('HMGET', burst_key, 'c', 't')
+        stored_credits = tonumber(state[1])
+        if stored_credits == nil then
+            -- 新 key 或已空闲到过期：视为额度已满
+            credits = burst_ratio
+        else
+            credits = stored_credits
+            local usage = math.max(
+                current_requests / rpm_limit,
+                current_input_tokens / input_tpm_limit,
+                current_output_tokens / output_tpm_limit
+            )
+            local elapsed = current_time - tonumber(state[2])
+            if usage < 1 and elapsed > 0 then
+                credits = math.min(burst_ratio, credits + elapsed / (current_time - window_start) * (1 - usage))
+            end
+        end
+    end
+
+    local function reject(reason)
+        if stored_credits ~= nil then
+            -- 被拒绝说明此刻没有空闲容量，推进累积起点，避免把超用时段算作空闲
+            redis.call('HSET', burst_key, 'c', tostring(credits), 't', current_time)
+        end
+        return {0, reason, shadow}
+    end
+
+    -- 检查限制：本次请求超出稳态限额的增量（占限额的比例）不能超过剩余突发额度，
+    -- 没有突发额度时等价于直接与限额比较
+    local request_excess = (math.max(0, current_requests + 1 - rpm_limit)
+        - math.max(0, current_requests - rpm_limit)) / rpm_limit
+    if request_excess > credits then
+        return reject('RPM_EXCEEDED')
+    end
+    
+    local input_excess = (math.max(0, current_input_tokens + input_tokens - input_tpm_limit)
+        - math.max(0, current_input_tokens - input_tpm_limit)) / input_tpm_limit
+    if input_excess > credits then
+        return reject('INPUT_TPM_EXCEEDED')
+    end
+    
+    local output_excess = (math.max(0, current_output_tokens + output_tokens - output_tpm_limit)
+        - math.max(0, current_output_tokens - output_tpm_limit)) / output_tpm_limit
+    if output_excess > credits then
+        return reject('OUTPUT_TPM_EXCEEDED')
+    end
+
+    -- 长周期预算：小时桶（滚动 24 小时）与天桶（滚动 30 天）放在同一个 hash 中并维护窗口累计值，
+    -- 桶滑出窗口时从累计值中减去并删除，每个 key 最多约 110 个字段（保持 listpack 紧凑编码）
+    local budget_key = KEYS[5]
+    local budget_enabled = daily_tokens_limit > 0 or monthly_tokens_limit > 0
+        or daily_spend_limit > 0 or monthly_spend_limit > 0
+    local hour_id = math.floor(current_time / 3600000000)
+    local day_id = math.floor(current_time / 86400000000)
+    local request_tokens = input_tokens + output_tokens
+    local budget_new = false
+
+    if budget_enabled then
+        -- 删除 [last_id - span + 1, min(last_id, current_id - span)] 范围内的桶，返回其中的 token 与花费
+        local function expire_buckets(prefix, last_id, current_id, span)
+            local fields = {}
+            for id = last_id - span + 1, math.min(last_id, current_id - span) do
+                table.insert(fields, prefix .. id .. ':t')
+                table.insert(fields, prefix .. id .. ':s')
+            end
+            if #fields == 0 then
+                return 0, 0
+            end
+            local values = redis.call('HMGET', budget_key, unpack(fields))
+            local tokens, cost = 0, 0
+            for i = 1, #values, 2 do
+                tokens = tokens + tonumber(values[i] or 0)
+                cost = cost + tonumber(values[i + 1] or 0)
+            end
+            redis.call('HDEL', budget_key, unpack(fields))
+            return tokens, cost
+        end
+
+        local state = redis.call('HMGET', budget_key, 'lh', 'ld', 't24', 's24', 't30', 's30')
+        local day_tokens = tonumber(state[3] or 0)
+        local day_spend = tonumber(state[4] or 0)
+        local month_tokens = tonumber(state[5] or 0)
+        local month_spend = tonumber(state[6] or 0)
+        budget_new = state[1] == false
+
+        -- 跨小时/跨天时滚动窗口并立即写回，拒绝路径也保持累计值与桶一致
+        if not budget_new and hour_id > tonumber(state[1]) then
+            local tokens, cost = expire_buckets('h', tonumber(state[1]), hour_id, 24)
+            day_tokens = day_tokens - tokens
+            day_spend = day_spend - cost
+            redis.call('HSET', budget_key, 'lh', hour_id, 't24', day_tokens, 's24', day_spend)
+        end
+        if not budget_new and day_id > tonumber(state[2]) then
+            local tokens, cost = expire_buckets('d', tonumber(state[2]), day_id, 30)
+            month_tokens = month_tokens - tokens
+            month_spend = month_spend - cost
+            redis.call('HSET', budget_key, 'ld', day_id, 't30', month_tokens, 's30', month_spend)
+        end
+
+        if daily_tokens_limit > 0 and day_tokens + request_tokens > daily_tokens_limit then
+            return {0, 'DAILY_TOKENS_EXCEEDED', shadow}
+        end
+        if monthly_tokens_limit > 0 and month_tokens + request_tokens > monthly_tokens_limit then
+            return {0, 'MONTHLY_TOKENS_EXCEEDED', shadow}
+        end
+        if daily_spend_limit > 0 and day_spend + spend > daily_spend_limit then
+            return {0, 'DAILY_SPEND_EXCEEDED', shadow}
+        end
+        if monthly_spend_limit > 0 and month_spend + spend > monthly_spend_limit then
+            return {0, 'MONTHLY_SPEND_EXCEEDED', shadow}
+        end
+    end
+
+    -- 终端用户限流：各时间片对应计数器求和，再在各行之间取最小值（count-min）
+    local sketch_incr = nil
+    if user_rpm > 0 and #KEYS >= sketch_first then
+        local sketch_get = {}
+        sketch_incr = {'OVERFLOW', 'SAT'}
+        for i = offset_first, #ARGV do
+            table.insert(sketch_get, 'GET')
+            table.insert(sketch_get, 'u32')
+            table.insert(sketch_get, '#' .. ARGV[i])
+            table.insert(sketch_incr, 'INCRBY')
+            table.insert(sketch_incr, 'u32')
+            table.insert(sketch_incr, '#' .. ARGV[i])
+            table.insert(sketch_incr, 1)
+        end
+
+        local row_sums = {}
+        for k = sketch_first, #KEYS do
+            local values = redis.call('BITFIELD', KEYS[k], unpack(sketch_get))
+            for row = 1, #values do
+                row_sums[row] = (row_sums[row] or 0) + values[row]
+            end
+        end
+        local user_requests = math.huge
+        for row = 1, #row_sums do
+            if row_sums[row] < user_requests then
+                user_requests = row_sums[row]
+            end
+        end
+
+        if user_requests >= user_rpm then
+            return {0, 'USER_RPM_EXCEEDED', shadow}
+        end
+    end
+    
+    -- 快速更新计数器
+    redis.call('INCR', req_counter)
+    if input_tokens > 0 then
+        redis.call('INCRBY', input_counter, input_tokens)
+    end
+    if output_tokens > 0 then
+        redis.call('INCRBY', output_counter, output_tokens)
+    end
+    
+    -- 同时维护精确记录（用于校准）
+    redis.call('ZADD', request_key, current_time, request_id)
+    if input_tokens > 0 then
+        redis.call('ZADD', input_key, current_time, request_id .. ':in:' .. input_tokens)
+    end
+    if output_tokens > 0 then
+        redis.call('ZADD', output_key, current_time, request_id .. ':out:' .. output_tokens)
+    end
+
+    -- 设置基础数据过期时间
+    redis.call('EXPIRE', request_key, 3600)
+    redis.call('EXPIRE', input_key, 3600)
+    redis.call('EXPIRE', output_key, 3600)
+
+    if sketch_incr then
+        redis.call('BITFIELD', KEYS[#KEYS], unpack(sketch_incr))
+        redis.call('EXPIRE', KEYS[#KEYS], sketch_ttl)
+    end
+
+    if budget_enabled then
+        local hour_prefix = 'h' .. hour_id
+        local day_prefix = 'd' .. day_id
+        redis.call('HINCRBY', budget_key, hour_prefix .. ':t', request_tokens)
+        redis.call('HINCRBY', budget_key, day_prefix .. ':t', request_tokens)
+        redis.call('HINCRBY', budget_key, 't24', request_tokens)
+        redis.call('HINCRBY', budget_key, 't30', request_tokens)
+        if spend > 0 then
+            redis.call('HINCRBY', budget_key, hour_prefix .. ':s', spend)
+            redis.call('HINCRBY', budget_key, day_prefix .. ':s', spend)
+            redis.call('HINCRBY', budget_key, 's24', spend)
+            redis.call('HINCRBY', budget_key, 's30', spend)
+        end
+        if budget_new then
+            redis.call('HSET', budget_key, 'lh', hour_id, 'ld', day_id)
+        end
+        redis.call('EXPIRE', budget_key, 2678400)
+    end
+
+    if burst_ratio > 0 then
+        credits = math.max(0, credits - math.max(request_excess, input_excess, output_excess))
+        -- 额度已满且未消耗时不写入，安静的 key 不产生额外写操作
+        if credits ~= stored_credits then
+            redis.call('HSET', burst_key, 'c', tostring(credits), 't', current_time)
+            -- 空闲到额度必然回满后过期，过期等价于额度已满
+            redis.call('EXPIRE', burst_key, math.ceil((current_time - window_start) / 1000000 * (1 + burst_ratio)))
+        end
+    end
+
+    if idem_key and idem_ttl > 0 then
+        redis.call('SET', idem_key, 1, 'EX', idem_ttl)
+    end
+
+    return {1, 'ALLOWED', shadow}
+    """
+
+def build_limiter_call(api_key: str, current_time_us: int, rpm_limit: int, input_tpm_limit: int,
+                       output_tpm_limit: int, input_tokens: int, output_tokens: int, request_id: str,
+                       user: str = None, user_rpm_limit: int = 0, burst_ratio: float = 0.0,
+                       budgets: tuple = NO_BUDGETS, spend: int = 0, shadow: tuple = NO_SHADOW,
+                       idempotency_key: str = None, idempotency_ttl: int = 0,
+                       server_clock: bool = False, key_prefix: str = "rl") -> tuple[list, list]:
+    """构造限流脚本的 KEYS 与 ARGV（回放工具以不同的 key_prefix 复用）
+
+    server_clock 为 True 时脚本以 Redis TIME 为当前时间；current_time_us 仍用于选择用户 sketch 的时间片
+    """
+    keys = [
+        f"{key_prefix}:{api_key}:req",
+        f"{key_prefix}:{api_key}:input",
+        f"{key_prefix}:{api_key}:output",
+        f"{key_prefix}:{api_key}:burst",
+        f"{key_prefix}:{api_key}:budget"
+    ]
+    
+    if server_clock:
+        script_time_us, window_arg = 0, WINDOW_SECONDS * 1_000_000
+    else:
+        script_time_us, window_arg = current_time_us, current_time_us - (WINDOW_SECONDS * 1_000_000)
+
+    args = [
+        script_time_us,
+        window_arg,
+        rpm_limit,
+        input_tpm_limit,
+        output_tpm_limit,
+        input_tokens,
+        output_tokens,
+        request_id,
+        burst_ratio,
+        *budgets,
+        spend,
+        *shadow,
+        idempotency_ttl if idempotency_key else 0
+    ]
+
+    if idempotency_key:
+        keys.append(f"{key_prefix}:{api_key}:idem:{idempotency_suffix(idempotency_key)}")
+
+    if user:
+        # 终端用户 sketch：窗口内每个时间片一个定长 key，不随用户数量增长
+        slice_us = USER_SKETCH_SLICE_SECONDS * 1_000_000
+        current_slice = current_time_us // slice_us
+        num_slices = WINDOW_SECONDS // USER_SKETCH_SLICE_SECONDS
+        keys.extend(f"{key_prefix}:{api_key}:users:{slice_id}" for slice_id in range(current_slice - num_slices + 1, current_slice + 1))
+        args.append(user_rpm_limit)
+        args.append(WINDOW_SECONDS + USER_SKETCH_SLICE_SECONDS)
+        args.extend(sketch_offsets(user, USER_SKETCH_DEPTH, USER_SKETCH_WIDTH))
+    return keys, args
+
+
+class CompiledKey:
+    """加载套餐配置时为每个 API Key 编译一次的调用参数
+
+    key 名预先编码为 bytes；静态限额按内容生成短 limit_id，写入 {prefix}:limits:{limit_id} hash，
+    相同限额的 API Key 共用一个 hash，配置变化时 limit_id 随之变化，不会读到旧值。
+    """
+    __slots__ = ("api_key", "config", "keys", "limits_key", "limit_id", "limits",
+                 "idem_prefix", "users_prefix", "user_rpm", "users_slice", "users_keys")
+
+    def __init__(self, api_key: str, config: dict, idempotency_ttl: int = 0, key_prefix: str = "rl"):
+        self.api_key = api_key
+        self.config = config
+        budgets = budget_limits(config)
+        shadow = shadow_limits(config)
+        self.limits = {
+            "r": config["rpm"], "i": config["input_tpm"], "o": config["output_tpm"],
+            "b": config.get("burst_ratio", 0.0),
+            "dt": budgets[0], "mt": budgets[1], "ds": budgets[2], "ms": budgets[3],
+            # 影子限额以未缩放的原值保存，脚本中与正式限额一样乘以倍率
+            "sr": shadow[0], "si": shadow[1], "so": shadow[2],
+            "u": config.get("user_rpm", 0),
+            "it": idempotency_ttl,
+            "st": WINDOW_SECONDS + USER_SKETCH_SLICE_SECONDS,
+        }
+        self.limit_id = hashlib.blake2b(orjson.dumps(self.limits), digest_size=6).hexdigest()
+        self.limits_key = f"{key_prefix}:limits:{self.limit_id}".encode()
+        self.keys = tuple(
+            f"{key_prefix}:{api_key}:{kind}".encode() for kind in ("req", "input", "output", "burst", "budget")
+        ) + (self.limits_key,)
+        self.idem_prefix = f"{key_prefix}:{api_key}:idem:"
+        self.users_prefix = f"{key_prefix}:{api_key}:users:"
+        self.user_rpm = self.limits["u"]
+        # 当前时间片对应的用户 sketch key 名，时间片切换（每 USER_SKETCH_SLICE_SECONDS 秒）时重建
+        self.users_slice = None
+        self.users_keys = ()
+
+
+def compile_keys(configs: dict, idempotency_ttl: int = 0, key_prefix: str = "rl") -> dict:
+    """{api_key: CompiledKey}，在加载套餐配置时调用一次"""
+    return {api_key: CompiledKey(api_key, config, idempotency_ttl, key_prefix) for api_key, config in configs.items()}
+
+
+async def publish_limits(client, compiled_keys) -> int:
+    """把静态限额写入各自的限额 hash（相同 limit_id 只写一次），返回写入的 hash 数"""
+    published = {}
+    for compiled in compiled_keys:
+        published.setdefault(compiled.limits_key, compiled.limits)
+    for limits_key, limits in published.items():
+        fields = [item for pair in limits.items() for item in pair]
+        await client.execute_command("HSET", limits_key, *fields)
+    return len(published)
+
+
+def build_compiled_call(compiled: CompiledKey, current_time_us: int, multiplier: float,
+                        input_tokens: int, output_tokens: int, request_id: str, spend: int = 0,
+                        user: str = None, idempotency_key: str = None,
+                        server_clock: bool = False) -> tuple[list, list]:
+    """预编译模式的 KEYS 与 ARGV：只包含本次请求的动态值，静态限额由脚本从限额 hash 读取"""
+    keys = list(compiled.keys)
+    if server_clock:
+        script_time_us, window_arg = 0, WINDOW_US
+    else:
+        script_time_us, window_arg = current_time_us, current_time_us - WINDOW_US
+    args = [
+        script_time_us, window_arg, "@", multiplier,
+        input_tokens, output_tokens, request_id, spend,
+        1 if idempotency_key else 0,
+    ]
+    if idempotency_key:
+        keys.append(compiled.idem_prefix + idempotency_suffix(idempotency_key))
+    if user and compiled.user_rpm:
+        current_slice = current_time_us // SKETCH_SLICE_US
+        if compiled.users_slice != current_slice:
+            users_prefix = compiled.users_prefix
+            compiled.users_keys = tuple(
+                (users_prefix + str(slice_id)).encode()
+                for slice_id in range(current_slice - SKETCH_SLICES + 1, current_slice + 1)
+            )
+            compiled.users_slice = current_slice
+        keys.extend(compiled.users_keys)
+        args.extend(sketch_offsets(user, USER_SKETCH_DEPTH, USER_SKETCH_WIDTH))
+    return keys, args
+
+
+class BatchTokens(NamedTuple):
+    """一次请求（可能含多个输入）的计费信息"""
+    model: str
+    user: Optional[str]
+    input_tokens: int
+    output_tokens: int
+    items: int                # 输入条数（批量 embeddings / completions 的数组长度）
+    payload: dict             # 解析后的请求体，供处理函数使用
+
+
+class LimitedRequest(NamedTuple):
+    """已通过限流的请求"""
+    api_key: str
+    tokens: BatchTokens
+    reason: str
+
+
+def _input_length(value) -> Tuple[int, int]:
+    """(估算 token 数, 条数)：字符串按 4 字符 1 token，token 数组按长度计，每条至少 1 个 token
+
+    OpenAI 的 input / prompt 可以是字符串、字符串数组、token 数组或 token 数组的数组。
+    """
+    if isinstance(value, str):
+        return max(1, len(value) // 4), 1
+    if not isinstance(value, list) or not value:
+        raise HTTPException(status_code=400, detail="Input must be a non-empty string or array")
+    first = value[0]
+    if isinstance(first, int):
+        return len(value), 1
+    try:
+        # join / map 在 C 中完成，不为每个元素执行 Python 代码；''.join 与 list.__len__ 同时校验元素类型，
+        # 字符串与 token 数组混用、混入数字或 null 时抛出 TypeError
+        if isinstance(first, str):
+            return max(len(value), len("".join(value)) // 4), len(value)
+        if isinstance(first, list):
+            return max(len(value), sum(map(list.__len__, value))), len(value)
+    except TypeError:
+        pass
+    raise HTTPException(status_code=400, detail="Input must be a non-empty string or array")
+
+
+def _parse_body(raw: bytes) -> dict:
+    try:
+        payload = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(payload, dict) or not isinstance(payload.get("model"), str):
+        raise HTTPException(status_code=400, detail="Missing model")
+    return payload
+
+
+def count_embedding_tokens(raw: bytes) -> BatchTokens:
+    """/v1/embeddings：整批 input 的 token 数合并计费，没有输出 token"""
+    payload = _parse_body(raw)
+    input_tokens, items = _input_length(payload.get("input"))
+    return BatchTokens(payload["model"], payload.get("user"), input_tokens, 0, items, payload)
+
+
+# /v1/completions 未指定 max_tokens 时的默认值（与 OpenAI 一致）
+COMPLETIONS_DEFAULT_MAX_TOKENS = 16
+
+
+def count_completion_tokens(raw: bytes) -> BatchTokens:
+    """/v1/completions：输出按 max_tokens × 条数 × n 预留"""
+    payload = _parse_body(raw)
+    input_tokens, items = _input_length(payload.get("prompt"))
+    max_tokens = payload.get("max_tokens")
+    if max_tokens is None:
+        max_tokens = COMPLETIONS_DEFAULT_MAX_TOKENS
+    n = payload.get("n")
+    if n is None:
+        n = 1
+    # bool 是 int 的子类，true / false 需要单独排除
+    if (not isinstance(max_tokens, int) or not isinstance(n, int) or isinstance(max_tokens, bool)
+            or isinstance(n, bool) or max_tokens < 0 or n < 1):
+        raise HTTPException(status_code=400, detail="Invalid max_tokens or n")
+    return BatchTokens(payload["model"], payload.get("user"), input_tokens, max_tokens * items * n, items, payload)
+
+
+CheckFunc = Callable[..., Awaitable[Tuple[bool, str]]]
+
+
+class LimiterFailures:
+    """按异常类型计数；日志每 log_interval 秒最多一行，Redis 故障期间不会每个请求打印一次"""
+
+    def __init__(self, log_interval: float = 5.0):
+        self._log_interval = log_interval
+        self._logged_at = float("-inf")
+        self._suppressed = 0
+        self.by_type: dict = {}
+        self.total = 0
+        self.last_error = ""
+        self.last_failure_at = None
+
+    def record(self, error: BaseException):
+        name = type(error).__name__
+        self.by_type[name] = self.by_type.get(name, 0) + 1
+        self.total += 1
+        self.last_error = f"{name}: {error}"
+        now = time.monotonic()
+        self.last_failure_at = time.time()
+        if now - self._logged_at < self._log_interval:
+            self._suppressed += 1
+            return
+        suppressed = f"（期间另有 {self._suppressed} 次未打印）" if self._suppressed else ""
+        print(f"⚠️ 限流判定失败: {self.last_error}{suppressed}")
+        self._logged_at = now
+        self._suppressed = 0
+
+    def stats(self) -> dict:
+        return {
+            "total": self.total,
+            "by_type": dict(self.by_type),
+            "last_error": self.last_error,
+            "last_failure_at": self.last_failure_at,
+        }
+
+
+class RateLimitGuard:
+    """鉴权与限流判定的公共入口，check 为 check_rate_limit_fast
+
+    observe(elapsed, is_error) 可选，用于把请求处理耗时报告给自适应限额：
+    被拒绝的请求在判定后报告；放行的请求默认也在判定后报告，
+    之后还要调用上游的端点传 observe_allowed=False，生成结束后自己调用 observe()，让耗时包含上游部分。
+    """
+
+    def __init__(self, check: CheckFunc, observe: Optional[Callable[[float, bool], Any]] = None):
+        self._check = check
+        self._observe = observe
+
+    @staticmethod
+    def api_key(request: Request) -> str:
+        auth_header = request.headers.get("Authorization", "")
+        if not auth_header.startswith("Bearer "):
+            raise HTTPException(status_code=401, detail="Missing or invalid authorization")
+        return auth_header[7:]
+
+    @staticmethod
+    def idempotency_key(request: Request) -> Optional[str]:
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+        return idempotency_key
+
+    def observe(self, started: Optional[float], is_error: bool = False):
+        """报告从 started 到现在的耗时"""
+        if self._observe is not None and started is not None:
+            self._observe(time.perf_counter() - started, is_error)
+
+    async def enforce(self, api_key: str, input_tokens: int, output_tokens: int, model: str = "",
+                      user: Optional[str] = None, idempotency_key: Optional[str] = None,
+                      started: Optional[float] = None, observe_allowed: bool = True) -> str:
+        """被限流时抛出 429，否则返回判定原因（ALLOWED / IDEMPOTENT_REPLAY）
+
+        该 key 在本节点排队已满（TENANT_QUEUE_FULL）同样是 429，只是 Retry-After 为 1 秒：
+        这是单个租户的状态，不能用 5xx，否则前置代理会把整个节点当作故障摘除
+        """
+        is_blocked, reason = await self._check(api_key, input_tokens, output_tokens, model, user, idempotency_key)
+        if is_blocked or observe_allowed:
+            self.observe(started, reason == "SYSTEM_ERROR")
+        if is_blocked:
+            if reason == QUEUE_FULL_REASON:
+                raise HTTPException(status_code=429, detail=f"Rate limit exceeded: {reason}", headers={"Retry-After": "1"})
+            raise HTTPException(
+                status_code=429,
+                detail=f"Rate limit exceeded: {reason}",
+                headers={"Retry-After": "60"}
+            )
+        return reason
+
+
+def body_limited(guard: RateLimitGuard, counter: Callable[[bytes], BatchTokens]):
+    """FastAPI 依赖：读取原始请求体，用 counter 一次算出整批 token 数并判定
+
+        embeddings_limit = body_limited(guard, count_embedding_tokens)
+
+        @app.post("/v1/embeddings")
+        async def embeddings(limited: LimitedRequest = Depends(embeddings_limit)): ...
+    """
+    async def dependency(request: Request) -> LimitedRequest:
+        started = time.perf_counter()
+        api_key = guard.api_key(request)
+        idempotency_key = guard.idempotency_key(request)
+        tokens = counter(await request.body())
+        user = tokens.user if isinstance(tokens.user, str) else None
+        reason = await guard.enforce(api_key, tokens.input_tokens, tokens.output_tokens, tokens.model,
+                                     user, idempotency_key, started)
+        return LimitedRequest(api_key, tokens, reason)
+
+    return dependency
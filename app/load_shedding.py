@@ -0,0 +1,139 @@
+# app/load_shedding.py
+"""节点级过载保护：按事件循环延迟与在途请求数提前拒绝，按套餐权重分配容量
+
+正常情况下所有请求直接放行。进入过载（在途请求数达到 max_in_flight，或事件循环延迟超过 max_lag）后，
+节点容量按正在使用的套餐的权重（套餐配置 "shed_weight"）分配：
+
+    capacity = max_in_flight * min(1, max_lag / lag)
+    share[tier] = capacity * weight[tier] / sum(weight of tiers with requests in flight)
+
+超出自身份额的套餐的新请求直接返回 503，不读取请求体，因此免费套餐（权重小）最先被拒绝；
+只有一个套餐在跑时它可以用满全部容量。
+"""
+import asyncio
+import json
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Optional
+
+SHED_BODY = json.dumps({"error": {"message": "Server overloaded, retry later", "type": "overloaded"}}).encode()
+
+
+class LoadShedder:
+    """在途请求计数 + 事件循环延迟监测 + 加权份额准入"""
+
+    def __init__(self, max_in_flight: int = 1000, max_lag: float = 0.1, lag_interval: float = 0.05):
+        self._max_in_flight = max_in_flight
+        self._max_lag = max_lag
+        self._lag_interval = lag_interval
+        self._task = None
+        self.in_flight = 0
+        self.lag = 0.0
+        self._tier_in_flight: Dict[str, int] = defaultdict(int)
+        self._tier_weight: Dict[str, float] = {}
+        self.admitted = 0
+        self.shed: Dict[str, int] = defaultdict(int)
+
+    # ---------- 事件循环延迟 ----------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._lag_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _lag_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self._lag_interval)
+            lag = max(0.0, loop.time() - started - self._lag_interval)
+            # 延迟上升立即生效，回落时平滑，避免在阈值附近反复切换
+            self.lag = lag if lag > self.lag else self.lag * 0.8 + lag * 0.2
+
+    # ---------- 准入 ----------
+
+    @property
+    def overloaded(self) -> bool:
+        return self.in_flight >= self._max_in_flight or self.lag >= self._max_lag
+
+    def try_acquire(self, tier: str, weight: float) -> bool:
+        """放行时计入在途请求并返回 True，之后必须调用 release(tier)"""
+        if self.overloaded:
+            capacity = self._max_in_flight
+            if self.lag > self._max_lag:
+                capacity *= self._max_lag / self.lag
+            active_weight = sum(self._tier_weight[t] for t, n in self._tier_in_flight.items() if n > 0 and t != tier)
+            share = capacity * weight / (active_weight + weight)
+            if self._tier_in_flight[tier] >= share:
+                self.shed[tier] += 1
+                return False
+        self._tier_weight[tier] = weight
+        self._tier_in_flight[tier] += 1
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self, tier: str):
+        self.in_flight -= 1
+        self._tier_in_flight[tier] -= 1
+
+    def stats(self) -> dict:
+        return {
+            "overloaded": self.overloaded,
+            "in_flight": self.in_flight,
+            "max_in_flight": self._max_in_flight,
+            "loop_lag_ms": round(self.lag * 1000, 2),
+            "max_loop_lag_ms": self._max_lag * 1000,
+            "tier_in_flight": {t: n for t, n in self._tier_in_flight.items() if n > 0},
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+        }
+
+
+class LoadSheddingMiddleware:
+    """纯 ASGI 中间件：只看 Authorization 头决定套餐，过载时在读取请求体之前返回 503"""
+
+    def __init__(self, app, shedder: LoadShedder, paths: Iterable[str],
+                 classify: Callable[[Optional[str]], tuple]):
+        self.app = app
+        self.shedder = shedder
+        self.paths = frozenset(paths)
+        # classify(api_key) -> (tier, weight)
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        api_key = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                if value.startswith(b"Bearer "):
+                    api_key = value[7:].decode("latin-1")
+                break
+        tier, weight = self.classify(api_key)
+
+        if not self.shedder.try_acquire(tier, weight):
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(SHED_BODY)).encode()),
+                    (b"retry-after", b"1"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": SHED_BODY})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.shedder.release(tier)
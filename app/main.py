@@ -1,17 +1,136 @@
-import winloop
 import asyncio
-from fastapi import FastAPI, Request, HTTPException
+import math
+import os
+import socket
+import sys
+from fastapi import Depends, FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse
 import redis.asyncio as redis
 import time
-import random
 from app.models import ChatCompletionRequest
-from app.config import API_KEYS_CONFIG
+from app.config import (
+    API_KEYS_CONFIG,
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_CLIENT_MODE,
+    REDIS_POOL_MAX_CONNECTIONS,
+    REDIS_MUX_CONNECTIONS,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_CONNECT_TIMEOUT,
+    LIMITER_ERROR_LOG_INTERVAL,
+    REDIS_REPLICAS,
+    REPLICA_MAX_STALENESS,
+    REPLICA_PROBE_INTERVAL,
+    REPLICA_HEARTBEAT_KEY,
+    BINARY_UNIX_SOCKET,
+    BINARY_TCP_HOST,
+    BINARY_TCP_PORT,
+    BINARY_MAX_IN_FLIGHT,
+    NODE_ID,
+    USAGE_EVENTS_ENABLED,
+    USAGE_EVENTS_SINK,
+    USAGE_EVENTS_BUFFER_SIZE,
+    USAGE_EVENTS_BATCH_SIZE,
+    USAGE_EVENTS_FLUSH_INTERVAL,
+    USAGE_EVENTS_STREAM_KEY,
+    USAGE_EVENTS_STREAM_MAXLEN,
+    USAGE_EVENTS_FILE,
+    USAGE_EVENTS_FILE_MAX_BYTES,
+    USAGE_EVENTS_FILE_BACKUPS,
+    USAGE_CACHE_TTL,
+    USAGE_CACHE_MAX_KEYS,
+    USAGE_CACHE_MEMORY_BUDGET,
+    USAGE_REDIS_MAX_CONNECTIONS,
+    ADAPTIVE_LIMITS_ENABLED,
+    ADAPTIVE_MULTIPLIER_KEY,
+    ADAPTIVE_TARGET_LATENCY,
+    ADAPTIVE_SLOW_RATIO,
+    ADAPTIVE_MAX_ERROR_RATE,
+    ADAPTIVE_INCREASE_STEP,
+    ADAPTIVE_DECREASE_FACTOR,
+    ADAPTIVE_MIN_MULTIPLIER,
+    ADAPTIVE_MAX_MULTIPLIER,
+    ADAPTIVE_INTERVAL,
+    ADAPTIVE_MIN_SAMPLES,
+    WARMUP_ENABLED,
+    WARMUP_POOL_CONNECTIONS,
+    WARMUP_RETRY_INTERVAL,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_REDIS_ENABLED,
+    RESPONSE_CACHE_REDIS_TTL,
+    RESPONSE_CACHE_HIT_CHARGE_RATIO,
+    GOSSIP_ENABLED,
+    GOSSIP_HOST,
+    GOSSIP_PORT,
+    GOSSIP_PEERS,
+    GOSSIP_INTERVAL,
+    GOSSIP_SLICE_SECONDS,
+    GOSSIP_OVERSHOOT,
+    PHASE_TIMING_ENABLED,
+    PROFILER_ENABLED,
+    PROFILER_INTERVAL,
+    PROFILER_MAX_SECONDS,
+    PROFILER_OUTPUT_DIR,
+    TRAFFIC_CAPTURE_ENABLED,
+    TRAFFIC_CAPTURE_FILE,
+    TRAFFIC_CAPTURE_MAX_BYTES,
+    LOAD_SHEDDING_ENABLED,
+    LOAD_SHED_MAX_IN_FLIGHT,
+    LOAD_SHED_MAX_LOOP_LAG,
+    LOAD_SHED_LAG_INTERVAL,
+    LOAD_SHED_DEFAULT_WEIGHT,
+    FAIR_SCHEDULING_ENABLED,
+    FAIR_MAX_CONCURRENCY,
+    FAIR_MAX_QUEUE_PER_TENANT,
+    FAIR_QUANTUM,
+    IDEMPOTENCY_ENABLED,
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_LOCAL_MAX_ENTRIES,
+    IDEMPOTENCY_LOCAL_MEMORY_BUDGET,
+    KEY_STATE_POLICY,
+    LIMITER_CLOCK,
+)
+from app.binary_protocol import start_binary_servers
+from app.usage_events import UsageEventRecorder, RedisStreamSink, RotatingFileSink
+from app.usage_query import UsageQuery
+from app.adaptive_limits import AIMDPolicy, RedisMultiplierStore, AdaptiveLimitController
+from app.response_cache import ResponseCache, is_cacheable, request_cache_key
+from app.gossip_limiter import GossipLimiter
+from app.profiling import PhaseHistograms, PhaseTimingMiddleware, SamplingProfiler
+from app.traffic_capture import TrafficCapture
+from app.budgets import request_spend
+from app.shadow_policy import ShadowStats
+from app.redis_mux import MultiplexedRedis
+from app.redis_replicas import ReplicaRouter
+from app.load_shedding import LoadShedder, LoadSheddingMiddleware
+from app.fair_scheduler import QUEUE_FULL_REASON, FairScheduler, TenantQueueFull
+from app.idempotency import REPLAY_REASON, IdempotencyCache
+from app.limiter import (
+    LIMITER_SCRIPT,
+    CompiledKey,
+    LimitedRequest,
+    LimiterFailures,
+    RateLimitGuard,
+    body_limited,
+    build_compiled_call,
+    build_limiter_call,
+    compile_keys,
+    count_completion_tokens,
+    count_embedding_tokens,
+    publish_limits,
+)
+from app.request_ids import RequestIdGenerator
 
 # 🚀 在导入后立即设置事件循环策略
 def setup_winloop():
-    """设置Windows优化的事件循环"""
+    """设置Windows优化的事件循环（仅在Windows上导入winloop）"""
+    if sys.platform != "win32":
+        return
     try:
         # 设置winloop为默认事件循环
+        import winloop
         winloop.install()
         print("✅ Winloop事件循环已安装")
     except Exception as e:
@@ -22,215 +141,565 @@ setup_winloop()
 
 app = FastAPI(title="Windows High Performance Rate Limiter")
 
+# 经过限流的端点（过载保护、按阶段计时只作用于这些路径）
+LIMITED_PATHS = ["/v1/chat/completions", "/v1/completions", "/v1/embeddings"]
+
+# 按阶段计时：中间件只在开启时挂载，关闭时处理函数里只多一次 dict 查找
+phase_histograms = PhaseHistograms() if PHASE_TIMING_ENABLED else None
+if PHASE_TIMING_ENABLED:
+    app.add_middleware(PhaseTimingMiddleware, histograms=phase_histograms, paths=LIMITED_PATHS)
+sampling_profiler = SamplingProfiler(PROFILER_INTERVAL) if PROFILER_ENABLED else None
+
+def shed_class(api_key):
+    """过载保护按套餐分配容量：返回 (套餐名, 权重)，只查配置字典，不做其他工作"""
+    config = API_KEYS_CONFIG.get(api_key)
+    if config is None:
+        return "invalid", 1
+    return config["name"], config.get("shed_weight", LOAD_SHED_DEFAULT_WEIGHT)
+
+# 过载保护最后挂载（最外层），被拒绝的请求不经过其他中间件
+load_shedder = LoadShedder(LOAD_SHED_MAX_IN_FLIGHT, LOAD_SHED_MAX_LOOP_LAG, LOAD_SHED_LAG_INTERVAL) if LOAD_SHEDDING_ENABLED else None
+if LOAD_SHEDDING_ENABLED:
+    app.add_middleware(LoadSheddingMiddleware, shedder=load_shedder, paths=LIMITED_PATHS, classify=shed_class)
+
 # Redis连接池配置
 redis_pool = redis.ConnectionPool.from_url(
-    "redis://localhost:6379",
-    max_connections=500,         # Windows环境保守配置
+    f"redis://{REDIS_HOST}:{REDIS_PORT}",
+    max_connections=REDIS_POOL_MAX_CONNECTIONS,  # Windows环境保守配置
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
     retry_on_timeout=True,
     socket_keepalive=True,
+    # 按平台取常量：直接写 1/2/3 在 Linux 上对应 TCP_NODELAY/TCP_MAXSEG/TCP_CORK，建连时报 EINVAL
     socket_keepalive_options={
-        1: 1,   # TCP_KEEPIDLE
-        2: 3,   # TCP_KEEPINTVL  
-        3: 5,   # TCP_KEEPCNT
+        getattr(socket, name): value
+        for name, value in (("TCP_KEEPIDLE", 1), ("TCP_KEEPINTVL", 3), ("TCP_KEEPCNT", 5))
+        if hasattr(socket, name)
     },
     health_check_interval=30
 )
 
 redis_client = redis.Redis(connection_pool=redis_pool)
 
+# 限流脚本的调用通道：多路复用模式下热路径走少量共享连接，连接池只承担后台任务，连接按需建立
+if REDIS_CLIENT_MODE == "multiplexed":
+    limiter_redis = MultiplexedRedis(REDIS_HOST, REDIS_PORT, REDIS_MUX_CONNECTIONS,
+                                     timeout=REDIS_SOCKET_TIMEOUT, connect_timeout=REDIS_CONNECT_TIMEOUT)
+else:
+    limiter_redis = redis_client
+
+# 用量查询使用独立的小连接池，仪表盘轮询不会占用限流连接
+usage_redis_pool = redis.ConnectionPool.from_url(
+    f"redis://{REDIS_HOST}:{REDIS_PORT}",
+    max_connections=USAGE_REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+)
+usage_redis_client = redis.Redis(connection_pool=usage_redis_pool)
+
+# 只读操作（用量查询、自适应倍率读取）走滞后在界内的副本，副本全部超界时回到主节点
+read_router = ReplicaRouter(
+    usage_redis_client,
+    [
+        redis.Redis(host=host, port=port, max_connections=USAGE_REDIS_MAX_CONNECTIONS,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_CONNECT_TIMEOUT)
+        for host, port in REDIS_REPLICAS
+    ],
+    f"{REPLICA_HEARTBEAT_KEY}:{NODE_ID}",
+    max_staleness=REPLICA_MAX_STALENESS,
+    probe_interval=REPLICA_PROBE_INTERVAL,
+) if REDIS_REPLICAS else None
+
 # 全局变量
 lua_limiter_script = None
+binary_servers = []
+usage_recorder = None
+adaptive_controller = None
+warmup_task = None
+gossip_limiter = None
+traffic_capture = None
+shadow_stats = ShadowStats()
+limiter_failures = LimiterFailures(LIMITER_ERROR_LOG_INTERVAL)
+fair_scheduler = FairScheduler(FAIR_MAX_CONCURRENCY, FAIR_MAX_QUEUE_PER_TENANT, FAIR_QUANTUM) if FAIR_SCHEDULING_ENABLED else None
+request_ids = RequestIdGenerator(NODE_ID)
+# 每个 API Key 的 key 名与限额标识在加载配置时编译一次，静态限额写入 Redis 的限额 hash
+compiled_keys = compile_keys(API_KEYS_CONFIG, IDEMPOTENCY_TTL_SECONDS)
+idempotency_cache = IdempotencyCache(
+    IDEMPOTENCY_LOCAL_MAX_ENTRIES, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCAL_MEMORY_BUDGET, KEY_STATE_POLICY
+) if IDEMPOTENCY_ENABLED else None
+startup_ready = False
 WINDOW_SECONDS = 60
+WARMUP_API_KEY = "__warmup__"
+MOCK_EMBEDDING = [0.0] * 8      # 模拟响应使用的固定向量
+usage_query = UsageQuery(
+    read_router or usage_redis_client, WINDOW_SECONDS, USAGE_CACHE_TTL,
+    USAGE_CACHE_MAX_KEYS, USAGE_CACHE_MEMORY_BUDGET, KEY_STATE_POLICY,
+)
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL,
+    redis_client=redis_client if RESPONSE_CACHE_REDIS_ENABLED else None,
+    redis_ttl=RESPONSE_CACHE_REDIS_TTL,
+) if RESPONSE_CACHE_ENABLED else None
 
 @app.on_event("startup")
 async def startup_event():
-    global lua_limiter_script
+    global lua_limiter_script, binary_servers, usage_recorder, adaptive_controller, warmup_task, startup_ready, gossip_limiter
+    global traffic_capture
     
     print("🚀 启动Windows优化的Rate Limiter...")
-  
-    script_text = """
-    local request_key = KEYS[1]
-    local input_key = KEYS[2] 
-    local output_key = KEYS[3]
-
-    local current_time = tonumber(ARGV[1])
-    local window_start = tonumber(ARGV[2])
-    local rpm_limit = tonumber(ARGV[3])
-    local input_tpm_limit = tonumber(ARGV[4])
-    local output_tpm_limit = tonumber(ARGV[5])
-    local input_tokens = tonumber(ARGV[6])
-    local output_tokens = tonumber(ARGV[7])
-    local request_id = ARGV[8]
-
-    -- 🚀 使用计数器 + 定期校准的混合策略
-    local req_counter = request_key .. ':counter'
-    local input_counter = input_key .. ':counter'
-    local output_counter = output_key .. ':counter'
-    local last_sync = request_key .. ':last_sync'
-
-    -- 检查是否需要同步校准（每30秒一次）
-    local sync_time = tonumber(redis.call('GET', last_sync) or 0)
-    local need_sync = (current_time - sync_time) > 30
-
-    if need_sync then
-        -- 🚀 定期校准：重新计算精确值
-        redis.call('ZREMRANGEBYSCORE', request_key, '-inf', window_start)
-        redis.call('ZREMRANGEBYSCORE', input_key, '-inf', window_start)
-        redis.call('ZREMRANGEBYSCORE', output_key, '-inf', window_start)
-        
-        -- 重新统计精确计数
-        local exact_requests = redis.call('ZCARD', request_key)
-        local exact_input = 0
-        local exact_output = 0
-        
-        -- 重新计算token数量
-        local input_members = redis.call('ZRANGEBYSCORE', input_key, window_start, '+inf')
-        for _, member in ipairs(input_members) do
-            local tokens = tonumber(string.match(member, ':(%d+)$'))
-            exact_input = exact_input + (tokens or 1)
-        end
-        
-        local output_members = redis.call('ZRANGEBYSCORE', output_key, window_start, '+inf')
-        for _, member in ipairs(output_members) do
-            local tokens = tonumber(string.match(member, ':(%d+)$'))
-            exact_output = exact_output + (tokens or 1)
-        end
-        
-        -- 重置计数器为精确值
-        redis.call('SET', req_counter, exact_requests)
-        redis.call('SET', input_counter, exact_input)
-        redis.call('SET', output_counter, exact_output)
-        redis.call('SET', last_sync, current_time)
-        
-        -- 设置过期时间
-        redis.call('EXPIRE', req_counter, 90)
-        redis.call('EXPIRE', input_counter, 90)
-        redis.call('EXPIRE', output_counter, 90)
-        redis.call('EXPIRE', last_sync, 90)
-    else
-        -- 🚀 高速模式：使用计数器
-        -- 获取当前计数
-        local current_requests = tonumber(redis.call('GET', req_counter) or 0)
-        local current_input_tokens = tonumber(redis.call('GET', input_counter) or 0)
-        local current_output_tokens = tonumber(redis.call('GET', output_counter) or 0)
-        
-        -- 检查限制
-        if current_requests >= rpm_limit then
-            return {0, 'RPM_EXCEEDED'}
-        end
-        
-        if current_input_tokens + input_tokens > input_tpm_limit then
-            return {0, 'INPUT_TPM_EXCEEDED'}
-        end
-        
-        if current_output_tokens + output_tokens > output_tpm_limit then
-            return {0, 'OUTPUT_TPM_EXCEEDED'}
-        end
-        
-        -- 快速更新计数器
-        redis.call('INCR', req_counter)
-        if input_tokens > 0 then
-            redis.call('INCRBY', input_counter, input_tokens)
-        end
-        if output_tokens > 0 then
-            redis.call('INCRBY', output_counter, output_tokens)
-        end
-        
-        -- 同时维护精确记录（用于校准）
-        redis.call('ZADD', request_key, current_time, request_id)
-        if input_tokens > 0 then
-            redis.call('ZADD', input_key, current_time, request_id .. ':in:' .. input_tokens)
-        end
-        if output_tokens > 0 then
-            redis.call('ZADD', output_key, current_time, request_id .. ':out:' .. output_tokens)
-        end
-    end
-
-    -- 设置基础数据过期时间
-    redis.call('EXPIRE', request_key, 3600)
-    redis.call('EXPIRE', input_key, 3600)
-    redis.call('EXPIRE', output_key, 3600)
-
-    return {1, 'ALLOWED'}
-    """
     
     try:
-        lua_limiter_script = redis_client.register_script(script_text)
-        print("✅ 高性能Lua脚本已加载")
+        lua_limiter_script = limiter_redis.register_script(LIMITER_SCRIPT)
+        print(f"✅ 高性能Lua脚本已加载 (Redis 客户端: {REDIS_CLIENT_MODE})")
     except Exception as e:
         print(f"❌ Lua脚本加载失败: {e}")
 
+    # 二进制决策协议，与HTTP路径共用 check_rate_limit_fast
+    if BINARY_UNIX_SOCKET or BINARY_TCP_PORT:
+        try:
+            binary_servers = await start_binary_servers(
+                check_rate_limit_fast,
+                unix_path=BINARY_UNIX_SOCKET,
+                tcp_host=BINARY_TCP_HOST,
+                tcp_port=BINARY_TCP_PORT,
+                max_in_flight=BINARY_MAX_IN_FLIGHT,
+            )
+            print(f"✅ 二进制决策协议已启动 ({len(binary_servers)} 个监听)")
+        except OSError as e:
+            print(f"❌ 二进制决策协议启动失败: {e}")
+
+    if read_router is not None:
+        read_router.start()
+        print(f"✅ 只读副本路由已启动 ({len(REDIS_REPLICAS)} 个副本, 最大滞后 {REPLICA_MAX_STALENESS}s)")
+
+    # 用量事件流：热路径只追加到进程内缓冲区，由后台任务批量写出
+    if USAGE_EVENTS_ENABLED:
+        if USAGE_EVENTS_SINK == "file":
+            sink = RotatingFileSink(USAGE_EVENTS_FILE, USAGE_EVENTS_FILE_MAX_BYTES, USAGE_EVENTS_FILE_BACKUPS)
+        else:
+            sink = RedisStreamSink(redis_client, USAGE_EVENTS_STREAM_KEY, USAGE_EVENTS_STREAM_MAXLEN)
+        usage_recorder = UsageEventRecorder(
+            sink,
+            NODE_ID,
+            capacity=USAGE_EVENTS_BUFFER_SIZE,
+            batch_size=USAGE_EVENTS_BATCH_SIZE,
+            flush_interval=USAGE_EVENTS_FLUSH_INTERVAL,
+        )
+        usage_recorder.start()
+        print(f"✅ 用量事件流已启动 (sink={USAGE_EVENTS_SINK})")
+
+    # 自适应限额：共享倍率缓存在本地，热路径只读内存
+    if ADAPTIVE_LIMITS_ENABLED:
+        policy = AIMDPolicy(
+            ADAPTIVE_INCREASE_STEP,
+            ADAPTIVE_DECREASE_FACTOR,
+            ADAPTIVE_MIN_MULTIPLIER,
+            ADAPTIVE_MAX_MULTIPLIER,
+        )
+        store = RedisMultiplierStore(redis_client, ADAPTIVE_MULTIPLIER_KEY, policy, ADAPTIVE_INTERVAL, reader=read_router)
+        adaptive_controller = AdaptiveLimitController(
+            store,
+            target_latency=ADAPTIVE_TARGET_LATENCY,
+            slow_ratio=ADAPTIVE_SLOW_RATIO,
+            max_error_rate=ADAPTIVE_MAX_ERROR_RATE,
+            min_samples=ADAPTIVE_MIN_SAMPLES,
+            interval=ADAPTIVE_INTERVAL,
+        )
+        try:
+            adaptive_controller.multiplier = await store.read()
+        except Exception as e:
+            print(f"⚠️ 读取自适应倍率失败，使用默认值: {e}")
+        adaptive_controller.start()
+        print(f"✅ 自适应限额已启用 (当前倍率 {adaptive_controller.multiplier:.2f})")
+
+    # 近似全局限流：高配额套餐在节点本地判定，节点间交换计数
+    if GOSSIP_ENABLED:
+        gossip_limiter = GossipLimiter(
+            NODE_ID,
+            GOSSIP_PEERS,
+            window_seconds=WINDOW_SECONDS,
+            slice_seconds=GOSSIP_SLICE_SECONDS,
+            overshoot=GOSSIP_OVERSHOOT,
+            interval=GOSSIP_INTERVAL,
+        )
+        try:
+            await gossip_limiter.start(GOSSIP_HOST, GOSSIP_PORT)
+            print(f"✅ 近似限流已启动 (UDP {GOSSIP_HOST}:{GOSSIP_PORT}, {len(GOSSIP_PEERS)} 个对端)")
+        except OSError as e:
+            gossip_limiter = None
+            print(f"❌ 近似限流启动失败，回退到 Lua 精确路径: {e}")
+
+    # 流量捕获：供 python -m app.replay 离线回放，评估限流引擎改动
+    if TRAFFIC_CAPTURE_ENABLED:
+        traffic_capture = TrafficCapture(TRAFFIC_CAPTURE_FILE.format(pid=os.getpid()), TRAFFIC_CAPTURE_MAX_BYTES)
+        traffic_capture.start()
+        print(f"✅ 流量捕获已启动 ({TRAFFIC_CAPTURE_FILE.format(pid=os.getpid())})")
+
+    if load_shedder is not None:
+        load_shedder.start()
+
+    # 预热在后台进行，完成前 /health 返回 503，负载均衡不会把流量导过来
+    if WARMUP_ENABLED:
+        warmup_task = asyncio.ensure_future(warmup())
+    else:
+        startup_ready = True
+
+async def warmup():
+    """启动预热：SCRIPT LOAD、预建连接池连接、用合成请求走一遍处理路径"""
+    global startup_ready
+    started = time.perf_counter()
+
+    while True:
+        try:
+            # 1. 预加载脚本与各套餐的限额 hash，避免首个请求触发 NOSCRIPT + EVAL 或 NO_LIMITS 重试
+            await limiter_redis.script_load(lua_limiter_script.script)
+            await publish_limits(limiter_redis, compiled_keys.values())
+
+            # 2. 建立连接：多路复用模式一次连上全部共享连接，连接池模式用并发 PING 预建指定数量的连接
+            if isinstance(limiter_redis, MultiplexedRedis):
+                await limiter_redis.connect()
+            else:
+                await asyncio.gather(*(redis_client.ping() for _ in range(WARMUP_POOL_CONNECTIONS)))
+
+            # 3. 合成请求：模型解析、token估算和一次真实的脚本调用
+            await warmup_handler_path()
+            break
+        except Exception as e:
+            print(f"⚠️ 预热失败，{WARMUP_RETRY_INTERVAL}秒后重试: {e}")
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+    startup_ready = True
+    print(f"✅ 预热完成，用时 {(time.perf_counter() - started) * 1000:.1f}ms")
+
+async def warmup_handler_path():
+    """使用专用的预热 key 执行一次完整的限流判定，结束后清理"""
+    body = ChatCompletionRequest.model_validate({
+        "model": "warmup",
+        "messages": [{"role": "user", "content": "warmup request"}],
+    })
+    total_chars = sum(len(msg.content) for msg in body.messages)
+    input_tokens = max(1, total_chars // 4)
+
+    current_time_us = int(time.time() * 1_000_000)
+    keys, args = build_limiter_call(
+        WARMUP_API_KEY, current_time_us, 1, input_tokens, 50, input_tokens, 50, f"{current_time_us}warmup"
+    )
+    await lua_limiter_script(keys=keys, args=args)
+    await redis_client.delete(
+        *keys,
+        *(f"{key}:counter" for key in keys),
+        f"{keys[0]}:last_sync",
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    for server in binary_servers:
+        server.close()
+        await server.wait_closed()
+    if usage_recorder is not None:
+        await usage_recorder.stop()
+    if adaptive_controller is not None:
+        await adaptive_controller.stop()
+    if gossip_limiter is not None:
+        await gossip_limiter.stop()
+    if traffic_capture is not None:
+        await traffic_capture.stop()
+    if load_shedder is not None:
+        await load_shedder.stop()
+    if read_router is not None:
+        await read_router.stop()
+    if isinstance(limiter_redis, MultiplexedRedis):
+        await limiter_redis.aclose()
+
 @app.get("/health")
 async def health_check():
-    """健康检查端点"""
-    return {
-        "status": "healthy", 
+    """健康检查端点（预热完成前、过载期间返回 503，负载均衡据此绕开本节点）"""
+    overloaded = load_shedder is not None and load_shedder.overloaded
+    payload = {
+        "status": "starting" if not startup_ready else ("overloaded" if overloaded else "healthy"),
         "timestamp": time.time(),
         "event_loop": str(type(asyncio.get_event_loop())),
-        "redis_pool_size": redis_pool.connection_kwargs.get('max_connections', 'unknown')
+        "redis_pool_size": redis_pool.connection_kwargs.get('max_connections', 'unknown'),
+        "redis_client_mode": REDIS_CLIENT_MODE,
+        "redis_mux": limiter_redis.stats() if isinstance(limiter_redis, MultiplexedRedis) else None,
+        "limiter_failures": limiter_failures.stats(),
+        "redis_replicas": read_router.stats() if read_router is not None else None,
+        "usage_events": usage_recorder.stats() if usage_recorder is not None else None,
+        "adaptive_limits": adaptive_controller.stats() if adaptive_controller is not None else None,
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "gossip": gossip_limiter.stats() if gossip_limiter is not None else None,
+        "traffic_capture": traffic_capture.stats() if traffic_capture is not None else None,
+        "shadow": shadow_stats.stats(),
+        "load_shedding": load_shedder.stats() if load_shedder is not None else None,
+        "fair_scheduler": fair_scheduler.stats() if fair_scheduler is not None else None,
+        "idempotency": idempotency_cache.stats() if idempotency_cache is not None else None,
+        "usage_cache": usage_query.stats()
     }
+    if not startup_ready or overloaded:
+        return JSONResponse(status_code=503, content=payload)
+    return payload
 
-async def check_rate_limit_fast(api_key: str, input_tokens: int, output_tokens: int) -> tuple[bool, str]:
+@app.get("/debug/timings")
+async def debug_timings(reset: bool = False):
+    """各处理阶段的耗时直方图（微秒）"""
+    if phase_histograms is None:
+        raise HTTPException(status_code=404, detail="Phase timing disabled")
+    snapshot = phase_histograms.snapshot()
+    if reset:
+        phase_histograms.reset()
+    return snapshot
+
+@app.post("/debug/profile")
+async def debug_profile(seconds: float = 10.0):
+    """在线上负载下采样事件循环线程 N 秒，输出 collapsed stack 文件"""
+    if sampling_profiler is None:
+        raise HTTPException(status_code=404, detail="Profiler disabled")
+    if sampling_profiler.running:
+        raise HTTPException(status_code=409, detail="Profiler already running")
+    seconds = min(max(seconds, 0.1), PROFILER_MAX_SECONDS)
+    output_path = os.path.join(PROFILER_OUTPUT_DIR, f"profile-{NODE_ID.replace(':', '_')}-{int(time.time())}.folded")
+    # 在事件循环线程中调用，采样目标即处理请求的线程
+    sampling_profiler.start(seconds, output_path)
+    return {"seconds": seconds, "output": output_path}
+
+async def check_rate_limit_fast(api_key: str, input_tokens: int, output_tokens: int, model: str = "",
+                                user: str = None, idempotency_key: str = None) -> tuple[bool, str]:
     """高性能速率限制检查"""
-    config = API_KEYS_CONFIG.get(api_key)
-    if not config:
+    compiled = compiled_keys.get(api_key)
+    if compiled is None:
+        if usage_recorder is not None:
+            usage_recorder.record((int(time.time() * 1_000_000), api_key, model, input_tokens, output_tokens, "INVALID_API_KEY", 0, ""))
         return True, "INVALID_API_KEY"
 
-    keys = [
-        f"rl:{api_key}:req",
-        f"rl:{api_key}:input",
-        f"rl:{api_key}:output"
-    ]
-    
+    if idempotency_cache is None:
+        idempotency_key = None
+    elif idempotency_key and idempotency_cache.seen(api_key, idempotency_key):
+        # 本节点已放行过同一个 Idempotency-Key，不访问 Redis、不再计费
+        if usage_recorder is not None:
+            usage_recorder.record((int(time.time() * 1_000_000), api_key, model, input_tokens, output_tokens, REPLAY_REASON, 0, ""))
+        return False, REPLAY_REASON
+
     current_time_us = int(time.time() * 1_000_000)
-    window_start_us = current_time_us - (WINDOW_SECONDS * 1_000_000)
-    request_id = f"{current_time_us}{random.randint(100, 999)}"
-
-    args = [
-        current_time_us,
-        window_start_us,
-        config["rpm"],
-        config["input_tpm"], 
-        config["output_tpm"],
-        input_tokens,
-        output_tokens,
-        request_id
-    ]
+    if traffic_capture is not None:
+        traffic_capture.record(current_time_us, api_key, input_tokens, output_tokens, user)
+
+    # 自适应倍率在脚本中与限额 hash 中的静态限额相乘，未开启时传 1
+    multiplier = adaptive_controller.multiplier if adaptive_controller is not None else 1
+    config = compiled.config
+
+    start = time.perf_counter()
+    if gossip_limiter is not None and config.get("approximate"):
+        # 近似模式：本地判定，不访问 Redis
+        is_allowed, reason = gossip_limiter.admit(
+            api_key, int(config["rpm"] * multiplier), int(config["input_tpm"] * multiplier),
+            int(config["output_tpm"] * multiplier), input_tokens, output_tokens, current_time_us / 1_000_000,
+        )
+        shadow = ""
+    else:
+        if fair_scheduler is not None:
+            # 饱和时按 API Key 排队、轮流访问 Redis；该 key 的排队位置满时不计费直接拒绝
+            try:
+                await fair_scheduler.acquire(api_key, config.get("shed_weight", LOAD_SHED_DEFAULT_WEIGHT))
+            except TenantQueueFull:
+                if usage_recorder is not None:
+                    usage_recorder.record((current_time_us, api_key, model, input_tokens, output_tokens, QUEUE_FULL_REASON, 0, ""))
+                return True, QUEUE_FULL_REASON
+        try:
+            is_allowed, reason, shadow = await check_rate_limit_lua(
+                compiled, current_time_us, multiplier, input_tokens, output_tokens,
+                user, request_spend(model, input_tokens, output_tokens), idempotency_key,
+            )
+        finally:
+            if fair_scheduler is not None:
+                fair_scheduler.release()
+        if shadow:
+            shadow_stats.observe(config["name"], api_key, reason, shadow)
+
+    if idempotency_key and is_allowed:
+        if reason == REPLAY_REASON:
+            idempotency_cache.redis_replays += 1
+        idempotency_cache.remember(api_key, idempotency_key)
+
+    if usage_recorder is not None:
+        latency_us = int((time.perf_counter() - start) * 1_000_000)
+        usage_recorder.record((current_time_us, api_key, model, input_tokens, output_tokens, reason, latency_us, shadow))
+    return not is_allowed, reason
+
+async def check_rate_limit_lua(compiled: CompiledKey, current_time_us: int, multiplier: float,
+                               input_tokens: int, output_tokens: int, user: str = None,
+                               spend: int = 0, idempotency_key: str = None) -> tuple[bool, str, str]:
+    """通过 Lua 脚本在 Redis 中做精确判定，返回 (is_allowed, reason, shadow_reason)
+
+    shadow_reason 为影子策略的结论，未配置影子策略时为空串
+    """
+    keys, args = build_compiled_call(
+        compiled, current_time_us, multiplier, input_tokens, output_tokens, request_ids.next(),
+        spend, user, idempotency_key, LIMITER_CLOCK == "redis",
+    )
 
     try:
         result = await lua_limiter_script(keys=keys, args=args)
+        if result[1] in (b"NO_LIMITS", "NO_LIMITS"):
+            # 限额 hash 不存在（Redis 重启、被淘汰或预热前的请求）：写入后重试一次
+            await publish_limits(limiter_redis, [compiled])
+            result = await lua_limiter_script(keys=keys, args=args)
+            if result[1] in (b"NO_LIMITS", "NO_LIMITS"):
+                raise RuntimeError(f"limits hash {compiled.limits_key!r} missing after publish")
         is_allowed = result[0] == 1
         reason = result[1] if len(result) > 1 else "UNKNOWN"
-        return not is_allowed, reason
+        if isinstance(reason, bytes):
+            reason = reason.decode()
+        shadow_reason = result[2] if len(result) > 2 else ""
+        if isinstance(shadow_reason, bytes):
+            shadow_reason = shadow_reason.decode()
+    except Exception as e:
+        limiter_failures.record(e)
+        is_allowed, reason, shadow_reason = False, "SYSTEM_ERROR", ""
+    return is_allowed, reason, shadow_reason
+
+def observe_latency(elapsed: float, is_error: bool):
+    """请求处理耗时报告给自适应限额（未开启时忽略）"""
+    if adaptive_controller is not None:
+        adaptive_controller.observe(elapsed, is_error)
+
+# 所有限流端点共用的入口；批量端点通过依赖在一次解析中算出整批 token 数
+limit_guard = RateLimitGuard(check_rate_limit_fast, observe_latency)
+embeddings_limit = body_limited(limit_guard, count_embedding_tokens)
+completions_limit = body_limited(limit_guard, count_completion_tokens)
+
+@app.get("/v1/usage")
+async def get_usage(request: Request):
+    """查询当前 API Key 在窗口内的用量与剩余额度"""
+    auth_header = request.headers.get("Authorization", "")
+    if not auth_header.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization")
+
+    api_key = auth_header[7:]
+    config = API_KEYS_CONFIG.get(api_key)
+    if not config:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+    scale = adaptive_controller.multiplier if adaptive_controller is not None else 1.0
+    if gossip_limiter is not None and config.get("approximate"):
+        # 近似模式的用量只存在于节点间合并的计数中
+        return usage_query.build_payload(config, scale, *gossip_limiter.estimate(api_key))
+    try:
+        return await usage_query.get(api_key, config, scale)
     except Exception as e:
-        print(f"Rate limit check error: {e}")
-        return True, "SYSTEM_ERROR"
+        print(f"Usage query error: {e}")
+        raise HTTPException(status_code=503, detail="Usage temporarily unavailable")
 
 @app.post("/v1/chat/completions")
 async def chat_completions(request: Request, body: ChatCompletionRequest):
     """高性能chat completions端点"""
+    handler_start = time.perf_counter()
+    # 开启按阶段计时时由中间件放入 scope；到这里为止是请求体读取与 Pydantic 解析
+    timer = request.scope.get("phase_timer")
+    if timer is not None:
+        timer.mark("parse")
     
     # 快速认证
-    auth_header = request.headers.get("Authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid authorization")
-    
-    api_key = auth_header[7:]  # 去掉 "Bearer "
+    api_key = limit_guard.api_key(request)
+    idempotency_key = limit_guard.idempotency_key(request)
+    if timer is not None:
+        timer.mark("auth")
 
     # 快速token估算
     total_chars = sum(len(msg.content) for msg in body.messages) if body.messages else 0
     input_tokens = max(1, total_chars // 4)  # 粗略估算：4字符=1token
     output_tokens = 50  # 固定输出避免随机开销
+    if timer is not None:
+        timer.mark("tokens")
 
-    # 速率限制检查
-    is_blocked, reason = await check_rate_limit_fast(api_key, input_tokens, output_tokens)
-    if is_blocked:
-        raise HTTPException(
-            status_code=429, 
-            detail=f"Rate limit exceeded: {reason}",
-            headers={"Retry-After": "60"}
-        )
+    # 确定性请求先查响应缓存，命中（或与在途请求合并）时按折扣计费
+    # 只有折扣计费的请求会等待查缓存时已在途的那次计算，自己触发上游调用的请求总是按全价计费
+    cache_key = None
+    cached = None
+    pending = None
+    charged_input, charged_output = input_tokens, output_tokens
+    if response_cache is not None and is_cacheable(body):
+        cache_key = request_cache_key(body)
+        cached = await response_cache.lookup(cache_key)
+        if cached is None:
+            pending = response_cache.inflight(cache_key)
+        if cached is not None or pending is not None:
+            charged_input = math.ceil(input_tokens * RESPONSE_CACHE_HIT_CHARGE_RATIO)
+            charged_output = math.ceil(output_tokens * RESPONSE_CACHE_HIT_CHARGE_RATIO)
+        if timer is not None:
+            timer.mark("cache")
+
+    # 速率限制检查（带 Idempotency-Key 的重试不重复计费）；放行时耗时在生成结束后再报告给自适应限额
+    await limit_guard.enforce(
+        api_key, charged_input, charged_output, body.model, body.user, idempotency_key, handler_start,
+        observe_allowed=False,
+    )
+    if timer is not None:
+        timer.mark("limiter")
+
+    # 生成结果（以及缓存中的 usage）始终使用未打折的 token 数
+    try:
+        if cache_key is None:
+            result = await generate_completion(body, input_tokens, output_tokens)
+        else:
+            if pending is not None:
+                cached = await response_cache.join(pending)
+            elif cached is None:
+                cached = await response_cache.get_or_compute(
+                    cache_key, lambda: generate_completion(body, input_tokens, output_tokens)
+                )
+            # 缓存内容共享，每次响应使用新的 id 与时间戳
+            timestamp = int(time.time())
+            result = {**cached, "id": f"chatcmpl-{timestamp:x}", "created": timestamp}
+    except Exception:
+        limit_guard.observe(handler_start, True)
+        raise
+    limit_guard.observe(handler_start)
+
+    if timer is not None:
+        timer.mark("generate")
+    return result
+
+@app.post("/v1/embeddings")
+async def embeddings(limited: LimitedRequest = Depends(embeddings_limit)):
+    """embeddings 端点（模拟响应），整批 input 合并计费"""
+    tokens = limited.tokens
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": MOCK_EMBEDDING}
+            for i in range(tokens.items)
+        ],
+        "model": tokens.model,
+        "usage": {"prompt_tokens": tokens.input_tokens, "total_tokens": tokens.input_tokens},
+    }
+
+@app.post("/v1/completions")
+async def completions(limited: LimitedRequest = Depends(completions_limit)):
+    """legacy completions 端点（模拟响应），多个 prompt 合并计费"""
+    tokens = limited.tokens
+    timestamp = int(time.time())
+    choices = tokens.items * (tokens.payload.get("n") or 1)
+    return {
+        "id": f"cmpl-{timestamp:x}",
+        "object": "text_completion",
+        "created": timestamp,
+        "model": tokens.model,
+        "choices": [
+            {"index": i, "text": "High-performance Windows mock response!", "logprobs": None, "finish_reason": "stop"}
+            for i in range(choices)
+        ],
+        "usage": {
+            "prompt_tokens": tokens.input_tokens,
+            "completion_tokens": tokens.output_tokens,
+            "total_tokens": tokens.input_tokens + tokens.output_tokens
+        }
+    }
 
+async def generate_completion(body: ChatCompletionRequest, input_tokens: int, output_tokens: int) -> dict:
+    """上游生成（当前为模拟响应）"""
     # 快速响应生成
     timestamp = int(time.time())
     response_id = f"chatcmpl-{timestamp:x}"
@@ -0,0 +1,227 @@
+# app/profiling.py
+"""按阶段计时、Server-Timing 响应头与采样分析器（均为可选功能）
+
+- PhaseTimingMiddleware: 纯 ASGI 中间件，为指定路径创建 PhaseTimer 放入 scope，
+  处理函数在各阶段结束时调用 mark()，响应头发出前补记 serialize 阶段，
+  写入 Server-Timing 头并汇总到 PhaseHistograms
+- SamplingProfiler: 定期采样事件循环线程的调用栈，输出 collapsed stack
+  格式（flamegraph.pl / speedscope 可直接读取）；未启动时没有任何开销
+"""
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+# 直方图桶上界（微秒），按 2 的幂增长，覆盖 1us ~ 约 4s
+BUCKET_BOUNDS_US = [2 ** i for i in range(23)]
+
+
+class PhaseTimer:
+    """单个请求的阶段计时，mark(name) 记录距上一个 mark 的耗时"""
+
+    __slots__ = ("_start", "_last", "phases")
+
+    def __init__(self):
+        self._start = self._last = time.perf_counter()
+        self.phases: List[tuple] = []
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return self._last - self._start
+
+    def server_timing(self) -> str:
+        """Server-Timing 头的值，单位毫秒"""
+        parts = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.phases]
+        parts.append(f"total;dur={self.total * 1000:.3f}")
+        return ", ".join(parts)
+
+
+class PhaseHistograms:
+    """各阶段耗时的固定桶直方图，observe 为 O(log 桶数)"""
+
+    def __init__(self):
+        self._counts: Dict[str, List[int]] = defaultdict(lambda: [0] * (len(BUCKET_BOUNDS_US) + 1))
+        self._sums: Dict[str, float] = defaultdict(float)
+        self._max: Dict[str, float] = defaultdict(float)
+
+    def observe(self, phase: str, seconds: float):
+        us = seconds * 1_000_000
+        lo, hi = 0, len(BUCKET_BOUNDS_US)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if us <= BUCKET_BOUNDS_US[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        self._counts[phase][lo] += 1
+        self._sums[phase] += us
+        if us > self._max[phase]:
+            self._max[phase] = us
+
+    def observe_timer(self, timer: PhaseTimer):
+        for name, seconds in timer.phases:
+            self.observe(name, seconds)
+        self.observe("total", timer.total)
+
+    def _quantile(self, counts: List[int], q: float) -> float:
+        """返回分位数所在桶的上界（微秒）"""
+        target = sum(counts) * q
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if seen >= target and count:
+                return BUCKET_BOUNDS_US[i] if i < len(BUCKET_BOUNDS_US) else float("inf")
+        return 0.0
+
+    def snapshot(self) -> dict:
+        result = {}
+        for phase, counts in self._counts.items():
+            total = sum(counts)
+            result[phase] = {
+                "count": total,
+                "avg_us": self._sums[phase] / total if total else 0.0,
+                "p50_us": self._quantile(counts, 0.5),
+                "p90_us": self._quantile(counts, 0.9),
+                "p99_us": self._quantile(counts, 0.99),
+                "max_us": self._max[phase],
+            }
+        return result
+
+    def reset(self):
+        self._counts.clear()
+        self._sums.clear()
+        self._max.clear()
+
+
+class PhaseTimingMiddleware:
+    """纯 ASGI 中间件（比 BaseHTTPMiddleware 开销小），只对 paths 中的路径计时"""
+
+    def __init__(self, app, histograms: PhaseHistograms, paths: Iterable[str]):
+        self.app = app
+        self.histograms = histograms
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        timer = PhaseTimer()
+        scope["phase_timer"] = timer
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                # 处理函数返回后到这里是 FastAPI 的响应序列化
+                timer.mark("serialize")
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timer.server_timing().encode()))
+                message = {**message, "headers": headers}
+                self.histograms.observe_timer(timer)
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+class SamplingProfiler:
+    """定时栈采样，结果为 collapsed stack 文本（每行 "f1;f2;f3 次数"）
+
+    支持 setitimer 的平台上在主线程用 SIGPROF 按 CPU 时间采样，信号处理函数拿到的是
+    被打断的帧，没有 GIL 带来的偏差；否则退回到后台线程读取 sys._current_frames()，
+    这种方式更容易采到事件循环在 select 中等待的栈。
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self._interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: Dict[str, int] = defaultdict(int)
+        self._deadline = 0.0
+        self._signal_active = False
+        self._previous_handler = None
+        self.samples = 0
+        self.output_path: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._signal_active or (self._thread is not None and self._thread.is_alive())
+
+    def start(self, seconds: float, output_path: str, thread_id: Optional[int] = None):
+        """采样 seconds 秒后写出文件；thread_id 默认为调用方所在线程（事件循环线程）"""
+        if self.running:
+            raise RuntimeError("profiler already running")
+        self._stacks = defaultdict(int)
+        self.samples = 0
+        self.output_path = output_path
+        self._deadline = time.monotonic() + seconds
+
+        if hasattr(signal, "setitimer") and thread_id is None and threading.current_thread() is threading.main_thread():
+            self._signal_active = True
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+            # 进程空闲时不消耗 CPU，也就没有信号触发结束检查，由事件循环兜底
+            try:
+                asyncio.get_running_loop().call_later(seconds + self._interval, self._finish_signal)
+            except RuntimeError:
+                pass
+            return
+
+        target = thread_id if thread_id is not None else threading.get_ident()
+        self._thread = threading.Thread(target=self._run, args=(target,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _on_signal(self, signum, frame):
+        if frame is not None:
+            self._stacks[_collapse(frame)] += 1
+            self.samples += 1
+        if time.monotonic() >= self._deadline:
+            self._finish_signal()
+
+    def _finish_signal(self):
+        if not self._signal_active:
+            return
+        self._signal_active = False
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        # 写文件放到线程里，不阻塞事件循环
+        self._thread = threading.Thread(target=self.write, args=(self.output_path,), daemon=True)
+        self._thread.start()
+
+    def _run(self, target: int):
+        while time.monotonic() < self._deadline:
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                self._stacks[_collapse(frame)] += 1
+                self.samples += 1
+            time.sleep(self._interval)
+        self.write(self.output_path)
+
+    def write(self, output_path: str):
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self._stacks.items(), key=lambda x: -x[1]):
+                f.write(f"{stack} {count}\n")
+        print(f"🔥 采样完成: {self.samples} 个样本 -> {output_path}")
+
+    def stats(self) -> dict:
+        return {"running": self.running, "samples": self.samples, "output": self.output_path}
+
+
+def _collapse(frame) -> str:
+    """调用栈转为 root;...;leaf 形式，帧名为 文件名:函数名"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
@@ -0,0 +1,313 @@
+# app/redis_mux.py
+"""多路复用 + 自动流水线的 Redis 客户端（限流热路径专用）
+
+连接池模式下每个并发请求独占一条连接，节点数 × worker 数 × 并发量会变成成千上万条 Redis 连接。
+这里改为少量长连接（默认与 CPU 核数相同），所有协程共享：
+
+- 命令编码后追加到所选连接的发送缓冲区，同一轮事件循环内排队的命令在 call_soon 回调中
+  一次 write 发出（自动流水线），不需要调用方显式使用 pipeline
+- Redis 在单条连接上按顺序回复，回复按 FIFO 与等待中的 future 配对
+- 连接断开时所有等待中的命令以 ConnectionError 失败，下次使用时重新连接
+- 设置 timeout 后，有命令在等待而连接超过 timeout 秒没有收到任何回复时视为卡死：
+  断开连接，等待中的命令以 TimeoutError 失败（Redis 无响应或网络分区时延迟有上界）
+
+只实现限流路径需要的命令（EVALSHA / SCRIPT LOAD / PING / DELETE 及通用 execute_command），
+错误类型沿用 redis.exceptions，调用方的异常处理不需要区分两种客户端。
+"""
+import asyncio
+import hashlib
+import os
+from collections import deque
+from typing import List, Optional
+
+from redis.exceptions import ConnectionError, NoScriptError, ResponseError, TimeoutError
+
+CRLF = b"\r\n"
+
+
+class _Incomplete(Exception):
+    """缓冲区中的回复还不完整，等待更多数据"""
+
+
+def encode_command(args) -> bytes:
+    """按 RESP 数组编码一条命令"""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode()
+        elif isinstance(arg, float):
+            data = repr(arg).encode()
+        else:
+            data = str(arg).encode()
+        parts.append(b"$%d\r\n" % len(data))
+        parts.append(data)
+        parts.append(CRLF)
+    return b"".join(parts)
+
+
+def _error(message: str) -> ResponseError:
+    if message.startswith("NOSCRIPT"):
+        return NoScriptError(message)
+    return ResponseError(message)
+
+
+def parse_reply(buf, pos: int):
+    """从 pos 开始解析一个 RESP2 回复，返回 (value, new_pos)；不完整时抛出 _Incomplete
+
+    错误回复以异常对象作为值返回，由调用方决定抛出还是保留在数组中。
+    """
+    end = buf.find(CRLF, pos)
+    if end < 0:
+        raise _Incomplete
+    kind = buf[pos]
+    line = bytes(buf[pos + 1:end])
+    pos = end + 2
+    if kind == 0x2B:      # + 简单字符串
+        return line, pos
+    if kind == 0x3A:      # : 整数
+        return int(line), pos
+    if kind == 0x24:      # $ 批量字符串
+        length = int(line)
+        if length < 0:
+            return None, pos
+        if len(buf) < pos + length + 2:
+            raise _Incomplete
+        return bytes(buf[pos:pos + length]), pos + length + 2
+    if kind == 0x2A:      # * 数组
+        count = int(line)
+        if count < 0:
+            return None, pos
+        items = []
+        for _ in range(count):
+            item, pos = parse_reply(buf, pos)
+            items.append(item)
+        return items, pos
+    if kind == 0x2D:      # - 错误
+        return _error(line.decode(errors="replace")), pos
+    raise ResponseError(f"unexpected RESP type byte {kind!r}")
+
+
+class _MuxConnection(asyncio.Protocol):
+    """单条连接：发送缓冲区 + 按顺序等待回复的 future 队列"""
+
+    def __init__(self, owner: "MultiplexedRedis"):
+        self._owner = owner
+        self._loop = asyncio.get_running_loop()
+        self._transport = None
+        self._buffer: List[bytes] = []
+        self._pending = deque()
+        self._flush_scheduled = False
+        self._read_buf = bytearray()
+        self.closed = False
+        self._last_progress = 0.0     # 最近一次收到回复（或从空闲开始等待）的时刻
+        self._watchdog = None
+        self._timed_out = False
+
+    # ---------- asyncio.Protocol ----------
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        self._last_progress = self._loop.time()
+        buf = self._read_buf
+        buf += data
+        pos = 0
+        pending = self._pending
+        try:
+            while pos < len(buf):
+                value, pos = parse_reply(buf, pos)
+                future = pending.popleft()
+                # 调用方已取消的命令照常消费回复，保持顺序
+                if future.done():
+                    continue
+                if isinstance(value, ResponseError):
+                    future.set_exception(value)
+                else:
+                    future.set_result(value)
+        except _Incomplete:
+            pass
+        del buf[:pos]
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        if self._timed_out:
+            error = TimeoutError(f"Redis did not reply within {self._owner.timeout}s")
+        else:
+            error = ConnectionError(f"Redis connection lost: {exc}" if exc else "Redis connection closed")
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+        self._buffer.clear()
+
+    # ---------- 发送 ----------
+
+    def send(self, payload: bytes) -> asyncio.Future:
+        if self.closed:
+            raise ConnectionError("Redis connection closed")
+        future = self._loop.create_future()
+        if not self._pending:
+            self._last_progress = self._loop.time()
+        self._buffer.append(payload)
+        self._pending.append(future)
+        if self._watchdog is None and self._owner.timeout:
+            self._watchdog = self._loop.call_later(self._owner.timeout, self._check_stalled)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+        return future
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._buffer or self.closed:
+            return
+        data = b"".join(self._buffer)
+        self._owner.commands_sent += len(self._buffer)
+        self._owner.writes += 1
+        self._buffer.clear()
+        self._transport.write(data)
+
+    def _check_stalled(self):
+        """每个连接一个定时器，只在有命令等待时运行，热路径上不为每条命令建定时器"""
+        self._watchdog = None
+        if self.closed or not self._pending:
+            return
+        timeout = self._owner.timeout
+        stalled_for = self._loop.time() - self._last_progress
+        if stalled_for >= timeout:
+            self._timed_out = True
+            self._owner.timeouts += 1
+            self._transport.abort()
+            return
+        self._watchdog = self._loop.call_later(timeout - stalled_for, self._check_stalled)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+class MuxScript:
+    """与 redis.asyncio 的 AsyncScript 用法相同: await script(keys=[...], args=[...])"""
+
+    def __init__(self, client: "MultiplexedRedis", script: str):
+        self.client = client
+        self.script = script
+        self.sha = hashlib.sha1(script.encode()).hexdigest()
+
+    async def __call__(self, keys=(), args=(), client=None):
+        client = client or self.client
+        try:
+            return await client.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            # Redis 重启或 SCRIPT FLUSH 后重新加载
+            await client.script_load(self.script)
+            return await client.evalsha(self.sha, len(keys), *keys, *args)
+
+
+class MultiplexedRedis:
+    """固定数量的共享连接，命令轮流分配到各连接上"""
+
+    def __init__(self, host: str = "localhost", port: int = 6379, connections: Optional[int] = None,
+                 timeout: Optional[float] = None, connect_timeout: Optional[float] = None):
+        self._host = host
+        self._port = port
+        self._size = max(1, connections or os.cpu_count() or 1)
+        self.timeout = timeout
+        self._connect_timeout = connect_timeout
+        self._connections: List[Optional[_MuxConnection]] = [None] * self._size
+        self._connecting: List[Optional[asyncio.Future]] = [None] * self._size
+        self._next = 0
+        self.commands_sent = 0
+        self.writes = 0
+        self.reconnects = 0
+        self.timeouts = 0
+
+    async def _connect(self, index: int) -> _MuxConnection:
+        # 同一槽位的并发重连只建立一次连接
+        waiter = self._connecting[index]
+        if waiter is not None:
+            return await asyncio.shield(waiter)
+        loop = asyncio.get_running_loop()
+        waiter = self._connecting[index] = loop.create_future()
+        try:
+            _, conn = await asyncio.wait_for(
+                loop.create_connection(lambda: _MuxConnection(self), self._host, self._port),
+                self._connect_timeout,
+            )
+        except asyncio.TimeoutError:
+            error = TimeoutError(f"Timeout connecting to {self._host}:{self._port}")
+            waiter.set_exception(error)
+            waiter.exception()
+            raise error
+        except OSError as e:
+            error = ConnectionError(f"Error connecting to {self._host}:{self._port}: {e}")
+            waiter.set_exception(error)
+            waiter.exception()    # 标记已读取，避免无人等待时的警告
+            raise error from e
+        finally:
+            self._connecting[index] = None
+        if self._connections[index] is not None:
+            self.reconnects += 1
+        self._connections[index] = conn
+        waiter.set_result(conn)
+        return conn
+
+    async def connect(self):
+        """预先建立全部连接（预热用）"""
+        await asyncio.gather(*(self._connect(i) for i in range(self._size)
+                               if self._connections[i] is None or self._connections[i].closed))
+
+    async def execute_command(self, *args):
+        index = self._next
+        self._next = (index + 1) % self._size
+        conn = self._connections[index]
+        if conn is None or conn.closed:
+            conn = await self._connect(index)
+        return await conn.send(encode_command(args))
+
+    # ---------- 限流路径用到的命令 ----------
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args):
+        return await self.execute_command("EVALSHA", sha, numkeys, *keys_and_args)
+
+    async def script_load(self, script: str) -> str:
+        sha = await self.execute_command("SCRIPT", "LOAD", script)
+        return sha.decode() if isinstance(sha, bytes) else sha
+
+    async def ping(self) -> bool:
+        return await self.execute_command("PING") == b"PONG"
+
+    async def delete(self, *keys) -> int:
+        return await self.execute_command("DEL", *keys)
+
+    def register_script(self, script: str) -> MuxScript:
+        return MuxScript(self, script)
+
+    async def aclose(self):
+        for conn in self._connections:
+            if conn is not None:
+                conn.close()
+        self._connections = [None] * self._size
+
+    def stats(self) -> dict:
+        open_connections = [c for c in self._connections if c is not None and not c.closed]
+        return {
+            "connections": len(open_connections),
+            "max_connections": self._size,
+            "in_flight": sum(c.in_flight for c in open_connections),
+            "commands": self.commands_sent,
+            "writes": self.writes,
+            "commands_per_write": self.commands_sent / self.writes if self.writes else 0.0,
+            "reconnects": self.reconnects,
+            "timeouts": self.timeouts,
+        }
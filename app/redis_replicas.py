@@ -0,0 +1,136 @@
+# app/redis_replicas.py
+"""只读流量的副本路由：主节点只承担限流脚本与写入，用量查询等读操作走副本
+
+副本滞后用心跳测量：每个节点每 probe_interval 秒向主节点写入自己的心跳 key（本机时间戳），
+再从各副本读回。副本上看到的心跳越旧，说明复制越滞后：
+
+    staleness = 本机当前时间 - 副本上的心跳时间戳
+
+心跳由本节点写、本节点读，不受节点间时钟偏差影响；测量值最多偏大一个 probe_interval，宁可保守。
+距上次探测的时间也计入滞后，探测任务停滞时不会一直沿用旧的结论。
+
+读操作在滞后不超过 max_staleness 的副本之间轮询；所有副本超界或不可达时回退到主节点，
+单次读在副本上出现连接错误时立即在主节点重试，并把该副本标记为不可用直到下次探测。
+"""
+import asyncio
+import time
+from typing import List, Optional
+
+from redis.exceptions import ConnectionError, TimeoutError
+
+STALE = float("inf")
+
+
+class ReplicaRouter:
+    """primary + replicas；读方法（get / mget / hget）按滞后路由，其余操作直接使用 primary"""
+
+    def __init__(self, primary, replicas: List, heartbeat_key: str,
+                 max_staleness: float = 1.0, probe_interval: float = 0.1):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self._heartbeat_key = heartbeat_key
+        self._max_staleness = max_staleness
+        self._probe_interval = probe_interval
+        self._task = None
+        self.staleness = [STALE] * len(self.replicas)   # 每个副本最近一次测得的滞后（秒）
+        self._probed_at = 0.0
+        self._fresh: List[int] = []
+        self._next = 0
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.fallbacks = 0
+
+    # ---------- 滞后探测 ----------
+
+    def start(self):
+        if self._task is None and self.replicas:
+            self._task = asyncio.ensure_future(self._probe_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.probe()
+            except Exception as e:
+                # 主节点不可达时无法测量，全部视为超界，读操作回到主节点（同样会失败并由调用方处理）
+                self.staleness = [STALE] * len(self.replicas)
+                self._fresh = []
+                print(f"⚠️ 副本滞后探测失败: {e}")
+            await asyncio.sleep(self._probe_interval)
+
+    async def probe(self):
+        """写一次心跳，然后读回各副本上的心跳，更新滞后与可用副本列表"""
+        await self.primary.set(self._heartbeat_key, repr(time.time()), ex=60)
+        values = await asyncio.gather(
+            *(replica.get(self._heartbeat_key) for replica in self.replicas), return_exceptions=True
+        )
+        now = time.time()
+        self.staleness = [
+            STALE if value is None or isinstance(value, BaseException) else max(0.0, now - float(value))
+            for value in values
+        ]
+        self._probed_at = time.monotonic()
+        self._fresh = [i for i, lag in enumerate(self.staleness) if lag <= self._max_staleness]
+
+    # ---------- 读路由 ----------
+
+    def _pick(self) -> Optional[int]:
+        """选出滞后在界内的副本下标，没有时返回 None"""
+        fresh = self._fresh
+        if not fresh:
+            return None
+        age = time.monotonic() - self._probed_at
+        if age > self._max_staleness:
+            return None
+        self._next = (self._next + 1) % len(fresh)
+        index = fresh[self._next]
+        if self.staleness[index] + age > self._max_staleness:
+            return None
+        return index
+
+    async def _read(self, method: str, *args, **kwargs):
+        index = self._pick()
+        if index is not None:
+            try:
+                result = await getattr(self.replicas[index], method)(*args, **kwargs)
+                self.replica_reads += 1
+                return result
+            except (ConnectionError, TimeoutError):
+                self.staleness[index] = STALE
+                self._fresh = [i for i in self._fresh if i != index]
+                self.fallbacks += 1
+        self.primary_reads += 1
+        return await getattr(self.primary, method)(*args, **kwargs)
+
+    async def get(self, name):
+        return await self._read("get", name)
+
+    async def mget(self, keys, *args):
+        return await self._read("mget", keys, *args)
+
+    async def hget(self, name, key):
+        return await self._read("hget", name, key)
+
+    def reader(self):
+        """一次性操作（如键空间报告）使用的客户端：滞后在界内的副本，否则为主节点"""
+        index = self._pick()
+        return self.primary if index is None else self.replicas[index]
+
+    def stats(self) -> dict:
+        return {
+            "replicas": len(self.replicas),
+            "fresh": len(self._fresh),
+            "staleness_ms": [None if lag == STALE else round(lag * 1000, 1) for lag in self.staleness],
+            "max_staleness_ms": self._max_staleness * 1000,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,345 @@
+# app/replay.py
+"""按虚拟时钟回放捕获的流量，对比不同限流引擎
+
+    python -m app.replay traffic_1234.rltc --engine lua --engine local
+    python -m app.replay traffic_1234.rltc --engine lua --url redis://localhost:6379 --batch 200
+
+限额取自当前的 API_KEYS_CONFIG（可以先改配置再回放评估效果），捕获中未配置的 key 被跳过。
+每个请求以捕获时的时间戳作为 current_time 传给引擎，不做等待，因此回放远快于实际时间；
+--speed N 可按 N 倍速限速回放。所有引擎的判定都与精确的滑动窗口（oracle）逐条比较；
+oracle 不模拟突发额度与长周期预算，配置了这些字段的套餐只回放、不比较，单独报告为未验证。
+Lua 引擎另外与脚本自身的计数语义（ScriptModel）比较，两者应逐条一致。
+
+引擎:
+- lua:   限流 Lua 脚本，在独立的 replay:{run}: 前缀下运行，按批次流水线提交（保持顺序）
+- local: 进程内时间片计数（GossipLimiter 单节点模式）
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+
+from app.budgets import budget_limits, request_spend
+from app.config import API_KEYS_CONFIG, REDIS_HOST, REDIS_PORT, WINDOW_SECONDS
+from app.shadow_policy import shadow_limits
+from app.traffic_capture import CapturedRequest, read_capture
+
+ENGINES = ("lua", "local")
+
+
+# oracle 无法模拟的套餐字段：突发额度依赖累积历史，预算窗口为 24 小时 / 30 天，超出回放时长
+ORACLE_UNSUPPORTED_FIELDS = ("burst_ratio", "daily_tokens", "monthly_tokens", "daily_spend_usd", "monthly_spend_usd")
+
+
+# 限流脚本按精确记录校准计数器的间隔（LIMITER_SCRIPT 中的 30000000 微秒）
+SCRIPT_CALIBRATION_US = 30_000_000
+
+
+class ExactOracle:
+    """精确滑动窗口：保存窗口内每个已放行请求，按 rpm / tpm / user_rpm 判定
+
+    这是引擎要逼近的参考语义，不是 Lua 脚本的复刻：脚本在两次校准（30 秒）之间只累加计数器、
+    user_rpm 用 count-min sketch 近似，两者都只会多算，因此 Lua 引擎相对 oracle 偏向误拒绝。
+    不模拟突发额度与长周期预算（见 unsupported）；捕获中没有 Idempotency-Key，不涉及幂等重放。
+    """
+
+    @staticmethod
+    def unsupported(config: dict) -> Tuple[str, ...]:
+        """该套餐中 oracle 无法模拟的字段，非空时不应与 oracle 比较"""
+        return tuple(field for field in ORACLE_UNSUPPORTED_FIELDS if config.get(field))
+
+    def __init__(self, window_seconds: int = WINDOW_SECONDS):
+        self._window_us = window_seconds * 1_000_000
+        self._entries: Dict[str, deque] = defaultdict(deque)
+        self._sums: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        self._users: Dict[Tuple[str, str], deque] = defaultdict(deque)
+
+    def decide(self, r: CapturedRequest, config: dict) -> Tuple[bool, str]:
+        window_start = r.ts_us - self._window_us
+        requests, input_used, output_used = self._usage(r.api_key, r.ts_us, window_start)
+
+        if requests >= config["rpm"]:
+            return False, "RPM_EXCEEDED"
+        if input_used + r.input_tokens > config["input_tpm"]:
+            return False, "INPUT_TPM_EXCEEDED"
+        if output_used + r.output_tokens > config["output_tpm"]:
+            return False, "OUTPUT_TPM_EXCEEDED"
+
+        user_rpm = config.get("user_rpm", 0)
+        user_entries = None
+        if user_rpm and r.user:
+            user_entries = self._users[(r.api_key, r.user)]
+            while user_entries and user_entries[0] <= window_start:
+                user_entries.popleft()
+            if len(user_entries) >= user_rpm:
+                return False, "USER_RPM_EXCEEDED"
+
+        self._record(r)
+        if user_entries is not None:
+            user_entries.append(r.ts_us)
+        return True, "ALLOWED"
+
+    def _usage(self, api_key: str, ts_us: int, window_start: int) -> Tuple[int, int, int]:
+        """窗口内已放行的 (请求数, 输入 token, 输出 token)"""
+        entries = self._entries[api_key]
+        sums = self._sums[api_key]
+        while entries and entries[0][0] <= window_start:
+            _, input_tokens, output_tokens = entries.popleft()
+            sums[0] -= input_tokens
+            sums[1] -= output_tokens
+        return len(entries), sums[0], sums[1]
+
+    def _record(self, r: CapturedRequest):
+        self._entries[r.api_key].append((r.ts_us, r.input_tokens, r.output_tokens))
+        sums = self._sums[r.api_key]
+        sums[0] += r.input_tokens
+        sums[1] += r.output_tokens
+
+
+class ScriptModel(ExactOracle):
+    """Lua 脚本的计数语义：计数器只在放行时累加，距上次校准超过 30 秒时按精确记录重算
+
+    Lua 引擎与它逐条一致，说明回放管线与脚本都按设计工作；它与 ExactOracle 的差异就是计数器近似的代价。
+    user_rpm 按精确计数处理（脚本的 sketch 只在哈希冲突时多算），同样不模拟突发额度与预算。
+    """
+
+    def __init__(self, window_seconds: int = WINDOW_SECONDS):
+        super().__init__(window_seconds)
+        self._counters: Dict[str, List[int]] = {}
+        self._last_sync: Dict[str, int] = {}
+
+    def _usage(self, api_key: str, ts_us: int, window_start: int) -> Tuple[int, int, int]:
+        if ts_us - self._last_sync.get(api_key, 0) > SCRIPT_CALIBRATION_US:
+            self._counters[api_key] = list(super()._usage(api_key, ts_us, window_start))
+            self._last_sync[api_key] = ts_us
+        counters = self._counters[api_key]
+        return counters[0], counters[1], counters[2]
+
+    def _record(self, r: CapturedRequest):
+        super()._record(r)
+        counters = self._counters[r.api_key]
+        counters[0] += 1
+        counters[1] += r.input_tokens
+        counters[2] += r.output_tokens
+
+
+class LocalEngine:
+    """进程内时间片计数（与近似全局限流相同的数据结构，无对端）"""
+
+    name = "local"
+    model = None    # 时间片近似没有可逐条对照的模型
+
+    def __init__(self):
+        from app.gossip_limiter import GossipLimiter
+        self._limiter = GossipLimiter("replay", [], window_seconds=WINDOW_SECONDS)
+
+    async def setup(self):
+        pass
+
+    async def decide_batch(self, batch: List[Tuple[CapturedRequest, dict]]) -> List[Tuple[bool, str]]:
+        return [
+            self._limiter.admit(r.api_key, c["rpm"], c["input_tpm"], c["output_tpm"],
+                                r.input_tokens, r.output_tokens, r.ts_us / 1_000_000)
+            for r, c in batch
+        ]
+
+    async def redis_ops(self) -> Optional[int]:
+        return 0
+
+    async def cleanup(self):
+        pass
+
+
+class LuaEngine:
+    """限流 Lua 脚本，批量流水线提交；Redis 按顺序执行，结果与逐条调用一致"""
+
+    name = "lua"
+    model = ScriptModel
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        from app.limiter import LIMITER_SCRIPT, build_limiter_call
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(LIMITER_SCRIPT)
+        self._build = build_limiter_call
+        self._prefix = f"replay:{int(time.time())}"
+        self._seq = 0
+
+    async def setup(self):
+        await self._client.script_load(self._script.script)
+
+    async def decide_batch(self, batch: List[Tuple[CapturedRequest, dict]]) -> List[Tuple[bool, str]]:
+        pipe = self._client.pipeline(transaction=False)
+        for r, c in batch:
+            self._seq += 1
+            keys, args = self._build(
+                r.api_key, r.ts_us, c["rpm"], c["input_tpm"], c["output_tpm"],
+                r.input_tokens, r.output_tokens, f"{r.ts_us}:{self._seq}",
+                r.user if c.get("user_rpm") else None, c.get("user_rpm", 0), c.get("burst_ratio", 0.0),
+                # 捕获中没有模型名，花费按默认价格估算
+                budget_limits(c), request_spend("", r.input_tokens, r.output_tokens), shadow_limits(c),
+                key_prefix=self._prefix,
+            )
+            # 脚本已在 setup 中加载，直接 EVALSHA 入队
+            pipe.evalsha(self._script.sha, len(keys), *keys, *args)
+        decisions = []
+        for result in await pipe.execute():
+            reason = result[1].decode() if isinstance(result[1], bytes) else result[1]
+            decisions.append((result[0] == 1, reason))
+        return decisions
+
+    async def redis_ops(self) -> Optional[int]:
+        """INFO commandstats 中所有命令的调用总数（脚本内的 redis.call 也计入）"""
+        try:
+            stats = await self._client.info("commandstats")
+        except Exception:
+            return None
+        if not stats:
+            return None
+        return sum(v["calls"] for v in stats.values() if isinstance(v, dict) and "calls" in v)
+
+    async def cleanup(self):
+        keys = [k async for k in self._client.scan_iter(match=f"{self._prefix}:*", count=1000)]
+        for start in range(0, len(keys), 1000):
+            await self._client.delete(*keys[start:start + 1000])
+        await self._client.aclose()
+
+
+async def replay(requests: List[CapturedRequest], engine, batch_size: int = 100, speed: float = 0.0) -> dict:
+    """回放一个引擎，返回吞吐、Redis 命令数与相对 oracle 的差异"""
+    oracle = ExactOracle()
+    model = engine.model() if engine.model is not None else None
+    model_mismatch = 0
+    await engine.setup()
+    ops_before = await engine.redis_ops()
+
+    decisions = 0
+    compared = 0
+    allowed_total = 0
+    oracle_allowed = 0
+    false_allow = 0
+    false_reject = 0
+    reasons = defaultdict(int)
+    mismatched_keys = defaultdict(int)
+    unverified = defaultdict(int)
+    comparable = {name: not ExactOracle.unsupported(config) for name, config in API_KEYS_CONFIG.items()}
+    first_ts = requests[0].ts_us if requests else 0
+
+    started = time.perf_counter()
+    for start in range(0, len(requests), batch_size):
+        batch = [(r, API_KEYS_CONFIG[r.api_key]) for r in requests[start:start + batch_size]]
+        if speed > 0:
+            # 按 speed 倍速限速：等待到该批第一个请求的虚拟时刻
+            due = (batch[0][0].ts_us - first_ts) / 1_000_000 / speed
+            delay = due - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        results = await engine.decide_batch(batch)
+        for (r, config), (allowed, reason) in zip(batch, results):
+            decisions += 1
+            reasons[reason] += 1
+            if not comparable[r.api_key]:
+                unverified[r.api_key] += 1
+                continue
+            expected, _ = oracle.decide(r, config)
+            if model is not None:
+                model_mismatch += model.decide(r, config)[0] != allowed
+            compared += 1
+            allowed_total += allowed
+            oracle_allowed += expected
+            if allowed and not expected:
+                false_allow += 1
+                mismatched_keys[r.api_key] += 1
+            elif expected and not allowed:
+                false_reject += 1
+                mismatched_keys[r.api_key] += 1
+    duration = time.perf_counter() - started
+
+    ops_after = await engine.redis_ops()
+    await engine.cleanup()
+
+    span = (requests[-1].ts_us - first_ts) / 1_000_000 if requests else 0.0
+    redis_ops = ops_after - ops_before if ops_before is not None and ops_after is not None else None
+    return {
+        "engine": engine.name,
+        "decisions": decisions,
+        "duration_s": duration,
+        "decisions_per_sec": decisions / duration if duration else 0.0,
+        "traffic_span_s": span,
+        "speedup": span / duration if duration else 0.0,
+        "redis_ops_per_decision": redis_ops / decisions if redis_ops is not None and decisions else None,
+        # 以下统计只包含与 oracle 比较过的请求
+        "compared": compared,
+        "allowed": allowed_total,
+        "oracle_allowed": oracle_allowed,
+        "false_allow": false_allow,
+        "false_reject": false_reject,
+        "mismatch_rate": (false_allow + false_reject) / compared if compared else 0.0,
+        "model_mismatch_rate": model_mismatch / compared if model is not None and compared else None,
+        "unverified": {
+            key: {"requests": count, "fields": ExactOracle.unsupported(API_KEYS_CONFIG[key])}
+            for key, count in unverified.items()
+        },
+        "reasons": dict(reasons),
+        "top_mismatched_keys": sorted(mismatched_keys.items(), key=lambda x: -x[1])[:10],
+    }
+
+
+def load_requests(path: str) -> Tuple[List[CapturedRequest], int]:
+    """读取捕获文件并按时间排序（多 worker 捕获合并后可能乱序），返回 (请求, 跳过数)"""
+    requests = []
+    skipped = 0
+    for r in read_capture(path):
+        if r.api_key in API_KEYS_CONFIG:
+            requests.append(r)
+        else:
+            skipped += 1
+    requests.sort(key=lambda r: r.ts_us)
+    return requests, skipped
+
+
+def print_result(result: dict):
+    ops = result["redis_ops_per_decision"]
+    print(f"\n🔁 引擎: {result['engine']}")
+    print(f"  判定数: {result['decisions']}, 用时 {result['duration_s']:.2f}s, "
+          f"{result['decisions_per_sec']:.0f} 判定/秒, 加速 {result['speedup']:.1f}x")
+    print(f"  Redis 命令/判定: {ops:.2f}" if ops is not None else "  Redis 命令/判定: 不可用")
+    print(f"  与 oracle 比较 {result['compared']} 个请求，放行: {result['allowed']}，oracle 放行: {result['oracle_allowed']}")
+    print(f"  与 oracle 逐条不一致: {result['mismatch_rate']:.3%} "
+          f"(多放行 {result['false_allow']}, 误拒绝 {result['false_reject']})")
+    if result["model_mismatch_rate"] is not None:
+        print(f"  与引擎自身计数语义逐条不一致: {result['model_mismatch_rate']:.3%}")
+    print(f"  判定分布: {result['reasons']}")
+    for key, info in result["unverified"].items():
+        print(f"  ⚠️ 未验证 {key}: {info['requests']} 个请求（oracle 不模拟 {', '.join(info['fields'])}）")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="按虚拟时钟回放捕获的流量")
+    parser.add_argument("capture", help="traffic_capture 生成的 .rltc 文件")
+    parser.add_argument("--engine", action="append", choices=ENGINES, help="可重复指定，默认全部")
+    parser.add_argument("--url", default=f"redis://{REDIS_HOST}:{REDIS_PORT}")
+    parser.add_argument("--batch", type=int, default=100, help="每个流水线包含的判定数")
+    parser.add_argument("--speed", type=float, default=0.0, help="回放倍速，0 表示不等待")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    requests, skipped = load_requests(args.capture)
+    if not args.json:
+        print(f"📼 读取 {len(requests)} 个请求（跳过未配置的 key {skipped} 个）")
+
+    results = []
+    for name in args.engine or ENGINES:
+        engine = LuaEngine(args.url) if name == "lua" else LocalEngine()
+        result = await replay(requests, engine, args.batch, args.speed)
+        results.append(result)
+        if not args.json:
+            print_result(result)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+# app/response_cache.py
+"""确定性请求（temperature=0）的响应缓存与并发去重
+
+两级缓存：进程内带 TTL 的 LRU + 可选的 Redis 共享层。
+同一请求的并发调用只会触发一次上游调用（single-flight），其余调用等待同一结果。
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import orjson
+
+from app.models import ChatCompletionRequest
+
+# 不影响生成结果的字段，不参与缓存键计算
+_NON_SEMANTIC_FIELDS = {"user"}
+
+
+def is_cacheable(body: ChatCompletionRequest) -> bool:
+    """只有确定性、非流式、单候选的请求可以缓存"""
+    return body.temperature == 0 and not body.stream and (body.n or 1) == 1
+
+
+def request_cache_key(body: ChatCompletionRequest) -> str:
+    """ChatCompletionRequest 的规范化哈希（字段排序后序列化）"""
+    data = body.model_dump(exclude=_NON_SEMANTIC_FIELDS)
+    return hashlib.sha256(orjson.dumps(data, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class ResponseCache:
+    """本地 LRU + TTL，可选 Redis 共享层，附带 single-flight"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60.0,
+                 redis_client=None, redis_ttl: int = 300, redis_prefix: str = "respcache:"):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._redis = redis_client
+        self._redis_ttl = redis_ttl
+        self._redis_prefix = redis_prefix
+        self._local = OrderedDict()   # digest -> (expires_at, payload)
+        self._inflight = {}           # digest -> Task
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.collapsed = 0
+
+    async def lookup(self, digest: str) -> Optional[dict]:
+        """先查本地，再查 Redis 共享层；未命中返回 None"""
+        payload = self._get_local(digest)
+        if payload is not None:
+            self.hits += 1
+            return payload
+
+        if self._redis is not None:
+            try:
+                raw = await self._redis.get(self._redis_prefix + digest)
+            except Exception as e:
+                print(f"Response cache read error: {e}")
+                raw = None
+            if raw is not None:
+                payload = orjson.loads(raw)
+                self._store_local(digest, payload)
+                self.hits += 1
+                self.redis_hits += 1
+                return payload
+
+        self.misses += 1
+        return None
+
+    async def get_or_compute(self, digest: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+        """未命中时调用 compute，同一 digest 的并发调用共享一次上游调用
+
+        lookup 之后调用方可能等待过（限流检查），期间其他请求的计算可能已经完成并移出在途表，
+        所以先重新查一次本地缓存，避免再触发一次上游调用
+        """
+        payload = self._get_local(digest)
+        if payload is not None:
+            return payload
+        task = self._inflight.get(digest)
+        if task is not None:
+            return await self.join(task)
+
+        task = asyncio.ensure_future(self._compute_and_store(digest, compute))
+        self._inflight[digest] = task
+        task.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        return await asyncio.shield(task)
+
+    def inflight(self, digest: str) -> Optional[asyncio.Future]:
+        """该 digest 正在进行的计算；任务完成并移出在途表后，持有它的调用方仍可通过 join 取得结果"""
+        return self._inflight.get(digest)
+
+    async def join(self, task: asyncio.Future) -> dict:
+        """等待已有的计算，自身不触发上游调用"""
+        self.collapsed += 1
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, digest: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+        payload = await compute()
+        self._store_local(digest, payload)
+        if self._redis is not None:
+            try:
+                await self._redis.set(self._redis_prefix + digest, orjson.dumps(payload), ex=self._redis_ttl)
+            except Exception as e:
+                print(f"Response cache write error: {e}")
+        return payload
+
+    def _get_local(self, digest: str) -> Optional[dict]:
+        entry = self._local.get(digest)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._local[digest]
+            return None
+        self._local.move_to_end(digest)
+        return entry[1]
+
+    def _store_local(self, digest: str, payload: dict):
+        local = self._local
+        local[digest] = (time.monotonic() + self._ttl, payload)
+        local.move_to_end(digest)
+        while len(local) > self._max_entries:
+            local.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._local),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "collapsed": self.collapsed,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
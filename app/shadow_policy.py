@@ -0,0 +1,66 @@
+# app/shadow_policy.py
+"""影子策略（dry-run）：在同一次脚本调用中评估待上线的限额，只统计不执行
+
+套餐配置示例:
+    "shadow": {"rpm": 300, "input_tpm": 40000, "output_tpm": 15000}
+
+脚本用与正式策略相同的计数器评估影子限额，结论随判定结果一起返回，
+这里负责换算脚本参数并按套餐 / API Key 汇总影子结论。
+"""
+from collections import defaultdict
+from typing import Optional, Tuple
+
+NO_SHADOW = (0, 0, 0)
+
+
+def shadow_limits(config: dict, multiplier: float = 1.0) -> Tuple[int, int, int]:
+    """(rpm, input_tpm, output_tpm)，与正式限额一样按自适应倍率缩放；未配置时全为 0"""
+    shadow = config.get("shadow")
+    if not shadow:
+        return NO_SHADOW
+    return (
+        max(1, int(shadow.get("rpm", config["rpm"]) * multiplier)),
+        int(shadow.get("input_tpm", config["input_tpm"]) * multiplier),
+        int(shadow.get("output_tpm", config["output_tpm"]) * multiplier),
+    )
+
+
+class ShadowStats:
+    """按套餐汇总影子结论；会被影子策略拒绝的 API Key 单独计数（数量有上限）"""
+
+    def __init__(self, max_keys: int = 1000):
+        self._max_keys = max_keys
+        self._tiers = defaultdict(lambda: {
+            "evaluated": 0,
+            "would_reject": 0,
+            "newly_rejected": 0,       # 正式策略放行、影子策略会拒绝
+            "reasons": defaultdict(int),
+            "keys": defaultdict(int),
+        })
+
+    def observe(self, tier: str, api_key: str, enforced_reason: str, shadow_reason: Optional[str]):
+        if not shadow_reason:
+            return
+        stats = self._tiers[tier]
+        stats["evaluated"] += 1
+        if shadow_reason == "ALLOWED":
+            return
+        stats["would_reject"] += 1
+        stats["reasons"][shadow_reason] += 1
+        if enforced_reason == "ALLOWED":
+            stats["newly_rejected"] += 1
+            keys = stats["keys"]
+            if api_key in keys or len(keys) < self._max_keys:
+                keys[api_key] += 1
+
+    def stats(self, top: int = 20) -> dict:
+        return {
+            tier: {
+                "evaluated": s["evaluated"],
+                "would_reject": s["would_reject"],
+                "newly_rejected": s["newly_rejected"],
+                "reasons": dict(s["reasons"]),
+                "top_keys": sorted(s["keys"].items(), key=lambda x: -x[1])[:top],
+            }
+            for tier, s in self._tiers.items()
+        }
@@ -0,0 +1,140 @@
+# app/traffic_capture.py
+"""限流请求流量捕获（紧凑二进制日志），供 app.replay 离线回放
+
+文件格式:
+    文件头  MAGIC(4) + 版本(B)
+    每条记录 RECORD(!QIIHH) + api_key + user
+             ts_us, input_tokens, output_tokens, key_len, user_len
+
+热路径只把打包好的记录追加到进程内 bytearray，后台任务定期在线程池中写入文件；
+达到 max_bytes 后停止捕获，不影响请求处理。token 数超出 u32 时截断为上限（限流结论不变），
+key / user 超过 65535 字节的记录无法表示，计入 dropped 而不是让请求失败。
+"""
+import asyncio
+import struct
+from typing import Iterator, NamedTuple, Optional
+
+MAGIC = b"RLTC"
+VERSION = 1
+FILE_HEADER = struct.Struct("!4sB")
+RECORD = struct.Struct("!QIIHH")
+MAX_TOKENS = 0xFFFFFFFF
+
+
+class CapturedRequest(NamedTuple):
+    ts_us: int
+    api_key: str
+    input_tokens: int
+    output_tokens: int
+    user: Optional[str]
+
+
+class TrafficCapture:
+    """追加式二进制捕获，缓冲区满或文件达到上限时丢弃"""
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024,
+                 buffer_bytes: int = 1024 * 1024, flush_interval: float = 0.5):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._buffer_bytes = buffer_bytes
+        self._flush_interval = flush_interval
+        self._buffer = bytearray()
+        self._written = 0
+        self._task = None
+        self.captured = 0
+        self.dropped = 0
+
+    def record(self, ts_us: int, api_key: str, input_tokens: int, output_tokens: int, user: Optional[str] = None):
+        """热路径：打包后追加到缓冲区"""
+        if self._written + len(self._buffer) >= self._max_bytes or len(self._buffer) >= self._buffer_bytes:
+            self.dropped += 1
+            return
+        try:
+            key_bytes = api_key.encode()
+            user_bytes = user.encode() if user else b""
+            header = RECORD.pack(ts_us, min(input_tokens, MAX_TOKENS), min(output_tokens, MAX_TOKENS),
+                                 len(key_bytes), len(user_bytes))
+        except (struct.error, UnicodeEncodeError):
+            self.dropped += 1
+            return
+        self._buffer += header
+        self._buffer += key_bytes
+        self._buffer += user_bytes
+        self.captured += 1
+
+    def start(self):
+        if self._task is None:
+            # 新建文件并写入文件头
+            with open(self._path, "wb") as f:
+                f.write(FILE_HEADER.pack(MAGIC, VERSION))
+            self._written = FILE_HEADER.size
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        await asyncio.get_running_loop().run_in_executor(None, self._append, data)
+        self._written += len(data)
+
+    def _append(self, data: bytes):
+        with open(self._path, "ab") as f:
+            f.write(data)
+
+    def stats(self) -> dict:
+        return {
+            "path": self._path,
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "bytes": self._written + len(self._buffer),
+        }
+
+
+def write_capture(path: str, requests) -> int:
+    """把 CapturedRequest 序列直接写成捕获文件（用于生成合成流量），返回记录数"""
+    count = 0
+    with open(path, "wb") as f:
+        f.write(FILE_HEADER.pack(MAGIC, VERSION))
+        for r in requests:
+            key_bytes = r.api_key.encode()
+            user_bytes = r.user.encode() if r.user else b""
+            f.write(RECORD.pack(r.ts_us, r.input_tokens, r.output_tokens, len(key_bytes), len(user_bytes)))
+            f.write(key_bytes)
+            f.write(user_bytes)
+            count += 1
+    return count
+
+
+def read_capture(path: str) -> Iterator[CapturedRequest]:
+    """按写入顺序逐条读出捕获记录"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"not a traffic capture file: {path}")
+    offset = FILE_HEADER.size
+    end = len(data)
+    while offset + RECORD.size <= end:
+        ts_us, input_tokens, output_tokens, key_len, user_len = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        api_key = data[offset:offset + key_len].decode()
+        offset += key_len
+        user = data[offset:offset + user_len].decode() if user_len else None
+        offset += user_len
+        yield CapturedRequest(ts_us, api_key, input_tokens, output_tokens, user)
@@ -0,0 +1,134 @@
+# app/usage_events.py
+"""限流决策的异步用量事件流
+
+热路径只做一次有界缓冲区追加，后台任务按批次写入 Redis Streams
+或本地滚动文件。缓冲区满或写入失败时直接丢弃事件并计数，绝不阻塞请求。
+"""
+import asyncio
+import json
+import os
+from collections import deque
+from typing import List, Optional, Sequence
+
+# 事件元组字段顺序（热路径直接构造元组，避免字典开销；ts 为微秒时间戳）
+# shadow 为影子策略结论，未配置影子策略时为空串
+EVENT_FIELDS = ("ts", "key", "model", "input_tokens", "output_tokens", "reason", "latency_us", "shadow")
+
+
+class RedisStreamSink:
+    """批量 XADD 到 Redis Stream，单次流水线提交"""
+
+    def __init__(self, client, stream_key: str, maxlen: Optional[int] = None):
+        self._client = client
+        self._stream_key = stream_key
+        self._maxlen = maxlen
+
+    async def write(self, batch: Sequence[tuple], node_id: str):
+        pipe = self._client.pipeline(transaction=False)
+        for event in batch:
+            fields = dict(zip(EVENT_FIELDS, event))
+            fields["node"] = node_id
+            pipe.xadd(self._stream_key, fields, maxlen=self._maxlen, approximate=True)
+        await pipe.execute()
+
+
+class RotatingFileSink:
+    """按大小滚动的本地 JSON Lines 文件，写入放到线程池执行"""
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+
+    async def write(self, batch: Sequence[tuple], node_id: str):
+        lines = []
+        for event in batch:
+            fields = dict(zip(EVENT_FIELDS, event))
+            fields["node"] = node_id
+            lines.append(json.dumps(fields, ensure_ascii=False))
+        data = "\n".join(lines) + "\n"
+        await asyncio.get_running_loop().run_in_executor(None, self._append, data)
+
+    def _append(self, data: str):
+        try:
+            size = os.path.getsize(self._path)
+        except OSError:
+            size = 0
+        if size and size + len(data) > self._max_bytes:
+            self._rotate()
+        with open(self._path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    def _rotate(self):
+        for i in range(self._backup_count - 1, 0, -1):
+            src = f"{self._path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self._path}.{i + 1}")
+        if self._backup_count > 0:
+            os.replace(self._path, f"{self._path}.1")
+        else:
+            os.remove(self._path)
+
+
+class UsageEventRecorder:
+    """有界环形缓冲区 + 后台批量刷写"""
+
+    def __init__(self, sink, node_id: str, capacity: int = 100000,
+                 batch_size: int = 500, flush_interval: float = 0.2):
+        self._sink = sink
+        self._node_id = node_id
+        self._capacity = capacity
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._buffer = deque()
+        self._task = None
+        self.dropped = 0
+        self.flushed = 0
+
+    def record(self, event: tuple):
+        """热路径：一次追加，缓冲区满时丢弃"""
+        if len(self._buffer) >= self._capacity:
+            self.dropped += 1
+            return
+        self._buffer.append(event)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self):
+        """停止后台任务并尽量刷出剩余事件"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        buffer = self._buffer
+        while buffer:
+            count = min(self._batch_size, len(buffer))
+            batch: List[tuple] = [buffer.popleft() for _ in range(count)]
+            try:
+                await self._sink.write(batch, self._node_id)
+                self.flushed += count
+            except Exception as e:
+                # 下游不可用时丢弃本批，避免缓冲区无限积压
+                self.dropped += count
+                print(f"Usage event flush error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "capacity": self._capacity,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,79 @@
+# app/usage_query.py
+"""每个 API Key 的用量查询
+
+只读取限流脚本维护的计数器（一次 MGET），从不扫描有序集合；
+节点内使用短 TTL 缓存（app/key_state.py 的有界存储），并合并同一 key 的并发查询，
+仪表盘高频轮询时对 Redis 的压力与轮询方数量无关。
+"""
+import asyncio
+import time
+from typing import Optional
+
+from app.key_state import KeyStateStore
+
+
+class _CachedUsage:
+    __slots__ = ("expires_at", "payload")
+
+    def __init__(self, expires_at: float, payload: dict):
+        self.expires_at = expires_at
+        self.payload = payload
+
+
+class UsageQuery:
+    """计数器读取 + 节点级短 TTL 缓存"""
+
+    def __init__(self, client, window_seconds: int, ttl: float = 1.0, max_entries: int = 100000,
+                 memory_budget: Optional[int] = None, policy: str = "clock"):
+        self._client = client
+        self._window_seconds = window_seconds
+        self._ttl = ttl
+        self._cache = KeyStateStore(max_entries, memory_budget, policy)   # api_key -> _CachedUsage
+        self._inflight = {}           # api_key -> Task，合并并发查询
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, api_key: str, config: dict, scale: float = 1.0) -> dict:
+        """scale 为自适应限额的当前倍率，返回的 limit 为实际生效的限额"""
+        entry = self._cache.get(api_key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self.hits += 1
+            return entry.payload
+
+        task = self._inflight.get(api_key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(api_key, config, scale))
+            self._inflight[api_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(api_key, None))
+        return await task
+
+    async def _load(self, api_key: str, config: dict, scale: float) -> dict:
+        used_requests, used_input, used_output = await self._client.mget(
+            f"rl:{api_key}:req:counter",
+            f"rl:{api_key}:input:counter",
+            f"rl:{api_key}:output:counter",
+        )
+        payload = self.build_payload(config, scale, used_requests, used_input, used_output)
+        self._cache.put(api_key, _CachedUsage(time.monotonic() + self._ttl, payload))
+        return payload
+
+    def build_payload(self, config: dict, scale: float, used_requests, used_input, used_output) -> dict:
+        return {
+            "object": "usage",
+            "tier": config["name"],
+            "window_seconds": self._window_seconds,
+            "requests": _dimension(int(config["rpm"] * scale), used_requests),
+            "input_tokens": _dimension(int(config["input_tpm"] * scale), used_input),
+            "output_tokens": _dimension(int(config["output_tpm"] * scale), used_output),
+            "timestamp": time.time(),
+        }
+
+    def stats(self) -> dict:
+        return {"cached_keys": len(self._cache), "hits": self.hits, "misses": self.misses,
+                "evictions": self._cache.evictions}
+
+
+def _dimension(limit: int, used) -> dict:
+    used = int(used or 0)
+    return {"limit": limit, "used": used, "remaining": max(0, limit - used)}
@@ -0,0 +1,28 @@
+# app/user_sketch.py
+"""按 `user` 字段限流的 count-min sketch（不为每个终端用户建 key）
+
+每个 API Key 每个时间片一个定长字符串 rl:{api_key}:users:{slice_id}，
+按 BITFIELD u32 存放 depth x width 个计数器，占用 depth * width * 4 字节，
+与终端用户数量无关。窗口估计值为窗口内各时间片对应计数器之和，
+再在 depth 行之间取最小值（只会高估，不会低估）。
+
+哈希在 Python 侧计算，脚本只接收每行的列下标，读写都在限流脚本内完成。
+"""
+import hashlib
+from typing import List
+
+
+def sketch_offsets(user: str, depth: int, width: int) -> List[int]:
+    """返回 user 在每一行的计数器下标（BITFIELD 的 #offset，已包含行偏移）
+
+    使用双重哈希 h1 + i * h2 生成 depth 个独立列，只需一次 blake2b
+    """
+    digest = hashlib.blake2b(user.encode(), digest_size=8).digest()
+    h1 = int.from_bytes(digest[:4], "little")
+    h2 = int.from_bytes(digest[4:], "little") | 1
+    return [row * width + (h1 + row * h2) % width for row in range(depth)]
+
+
+def sketch_bytes(depth: int, width: int) -> int:
+    """单个时间片 sketch 的字节数"""
+    return depth * width * 4
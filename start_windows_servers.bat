@@ -15,6 +15,11 @@ timeout /t 3
 echo 启动第三个节点 (端口 8005)...
 start "Rate Limiter Node 3" cmd /c "uvicorn app.main:app --host 0.0.0.0 --port 8005 --workers 2 --no-access-log"
 
+timeout /t 3
+
+echo 启动前置负载均衡代理 (端口 8000)...
+start "Rate Limiter Front Proxy" cmd /c "python -m app.front_proxy --port 8000"
+
 echo.
 echo ✅ 所有节点启动完成！
 echo.
@@ -22,6 +27,7 @@ echo 测试URL:
 echo   - http://127.0.0.1:8003/health
 echo   - http://127.0.0.1:8004/health  
 echo   - http://127.0.0.1:8005/health
+echo   - http://127.0.0.1:8000/proxy/status
 echo.
 echo 按任意键继续...
 pause
\ No newline at end of file
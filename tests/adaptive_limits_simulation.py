@@ -0,0 +1,159 @@
+# adaptive_limits_simulation.py
+# 用一个“负载越高延迟越差”的模拟后端验证 AIMD 自适应限额控制器
+# 使用虚拟时钟，不需要启动节点或 Redis
+# 多节点部分让几个节点共享一个 RedisMultiplierStore，在 fakeredis 中执行 ADJUST_SCRIPT（需要 fakeredis[lua]）
+import asyncio
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.adaptive_limits import AIMDPolicy, LocalMultiplierStore, RedisMultiplierStore, AdaptiveLimitController
+
+BASE_LIMIT = 1000          # 套餐静态限额（每秒请求数，模拟中以秒为单位）
+BASE_LATENCY = 0.01        # 空闲时后端延迟（秒）
+TARGET_LATENCY = 0.05
+TIMEOUT = 1.0              # 超过该延迟视为错误
+
+
+class SimulatedBackend:
+    """容量有限的后端：超出容量的请求进入积压队列，延迟随积压线性增长"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.backlog = 0.0
+
+    def serve(self, admitted):
+        self.backlog = max(0.0, self.backlog + admitted - self.capacity)
+        mean_latency = BASE_LATENCY + self.backlog / self.capacity
+        return [mean_latency * random.uniform(0.5, 1.5) for _ in range(admitted)]
+
+
+async def run_phase(name, controller, backend, offered, seconds, adaptive=True):
+    admitted_history = []
+    latency_history = []
+    multiplier_history = []
+
+    for _ in range(seconds):
+        multiplier = controller.multiplier if adaptive else 1.0
+        admitted = min(offered, int(BASE_LIMIT * multiplier))
+        latencies = backend.serve(admitted)
+        for latency in latencies:
+            controller.observe(latency, latency > TIMEOUT)
+        if adaptive:
+            await controller.tick()
+
+        latencies.sort()
+        admitted_history.append(admitted)
+        latency_history.append(latencies[len(latencies) // 2] if latencies else 0)
+        multiplier_history.append(multiplier)
+
+    tail = seconds // 2
+    result = {
+        "name": name,
+        "avg_admitted": sum(admitted_history[-tail:]) / tail,
+        "avg_p50_latency": sum(latency_history[-tail:]) / tail,
+        "final_multiplier": controller.multiplier if adaptive else 1.0,
+        "min_multiplier": min(multiplier_history),
+    }
+    print(f"{name:<28} 准入:{result['avg_admitted']:>8.1f}/s  P50延迟:{result['avg_p50_latency']*1000:>9.1f}ms  "
+          f"最终倍率:{result['final_multiplier']:.2f}")
+    return result
+
+
+def new_policy():
+    return AIMDPolicy(increase_step=0.05, decrease_factor=0.7, min_multiplier=0.1, max_multiplier=1.0)
+
+
+def new_controller(store=None):
+    return AdaptiveLimitController(
+        store if store is not None else LocalMultiplierStore(new_policy()),
+        target_latency=TARGET_LATENCY,
+        slow_ratio=0.05,
+        max_error_rate=0.01,
+        min_samples=20,
+        interval=1.0,
+    )
+
+
+async def run_cluster():
+    """3 个节点共享一个倍率：两个空闲节点每个周期先发出“增加”，过载节点随后发出“减少”，
+    过载节点的信号不能被先到的“增加”挡掉。返回是否通过，没有 fakeredis 时返回 None"""
+    try:
+        from fakeredis import FakeAsyncRedis
+    except ImportError:
+        print("\n⚠️ 未安装 fakeredis，跳过多节点共享倍率部分")
+        return None
+
+    client = FakeAsyncRedis()
+    now = [1_000_000.0]
+    store = RedisMultiplierStore(client, "adaptive:sim", new_policy(), 1.0, clock=lambda: now[0])
+    # (容量, 压力, 本周期内的触发时刻)：空闲节点先于过载节点触发
+    nodes = [(2000, 300, 0.0), (2000, 300, 0.1), (200, 500, 0.2)]
+    controllers = [new_controller(store) for _ in nodes]
+    backends = [SimulatedBackend(capacity) for capacity, _, _ in nodes]
+    node_limit = BASE_LIMIT / len(nodes)
+    latencies = []
+    start = now[0]
+    for second in range(60):
+        for (_, offered, offset), controller, backend in zip(nodes, controllers, backends):
+            admitted = min(offered, int(node_limit * controller.multiplier))
+            node_latencies = backend.serve(admitted)
+            for latency in node_latencies:
+                controller.observe(latency, latency > TIMEOUT)
+            if backend is backends[-1] and second >= 30:
+                latencies.extend(node_latencies)
+            now[0] = start + second + offset
+            await controller.tick()
+    multiplier = await store.read()
+    await client.aclose()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    print(f"\n多节点共享倍率 (2 个空闲节点 + 1 个过载节点): 最终倍率 {multiplier:.2f}, "
+          f"过载节点后半段 P50 延迟 {p50 * 1000:.1f}ms")
+    checks = [
+        ("过载节点的“减少”没有被空闲节点的“增加”挡掉", multiplier < 0.8),
+        ("过载节点延迟受控", p50 < TARGET_LATENCY * 10),
+    ]
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+    return all(ok for _, ok in checks)
+
+
+async def run_simulation():
+    random.seed(42)
+    print("🔬 AIMD 自适应限额模拟")
+    print(f"静态限额 {BASE_LIMIT}/s，目标延迟 {TARGET_LATENCY*1000:.0f}ms")
+    print("=" * 80)
+
+    # 对照组：静态限额
+    static = await run_phase("静态限额 (容量600, 压力1500)", new_controller(), SimulatedBackend(600), 1500, 60, adaptive=False)
+
+    controller = new_controller()
+    backend = SimulatedBackend(600)
+    overload = await run_phase("AIMD (容量600, 压力1500)", controller, backend, 1500, 60)
+    idle = await run_phase("AIMD (容量600, 压力300)", controller, backend, 300, 60)
+    backend.capacity = 300
+    degraded = await run_phase("AIMD (后端退化到300, 压力1500)", controller, backend, 1500, 60)
+
+    checks = [
+        ("过载时准入量收敛到后端容量附近", 0.5 * 600 <= overload["avg_admitted"] <= 1.2 * 600),
+        ("过载时延迟远低于静态限额", overload["avg_p50_latency"] < static["avg_p50_latency"] / 10),
+        ("空闲时倍率恢复到上限", idle["final_multiplier"] == 1.0),
+        ("后端退化后倍率继续下降", degraded["avg_admitted"] < overload["avg_admitted"]),
+        ("后端退化后延迟仍受控", degraded["avg_p50_latency"] < TARGET_LATENCY * 10),
+    ]
+
+    print()
+    passed = True
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+        passed = passed and ok
+    cluster = await run_cluster()
+    return passed and cluster is not False
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_simulation())
+    sys.exit(0 if ok else 1)
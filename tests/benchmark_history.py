@@ -0,0 +1,39 @@
+# benchmark_history.py
+# 基准测试的历史记录：每次结果追加到一个 JSON 文件，新结果与最近几次运行的中位数对比判定回归
+# 单次运行的抖动只影响一个样本，不会让下一次运行因为和一个异常快/慢的上次结果比较而误报
+import json
+import statistics
+
+HISTORY_WINDOW = 5  # 取最近几次运行的中位数作为基线
+
+
+def load_history(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def append_history(path, history, current):
+    history.append(current)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=2, ensure_ascii=False)
+
+
+def compare_with_history(history, current, metrics, threshold, slack=lambda label: 0.0, window=HISTORY_WINDOW):
+    """metrics(run) 返回 {指标名: 数值}；逐项与最近 window 次运行的中位数对比
+
+    超过 中位数 × threshold 且差值大于 slack(指标名) 视为回归；返回 [(指标名, 基线, 当前, 是否回归)]，
+    历史中没有该指标的项跳过
+    """
+    recent = [metrics(run) for run in history[-window:]]
+    rows = []
+    for label, value in metrics(current).items():
+        samples = [run[label] for run in recent if run.get(label) is not None]
+        if not samples:
+            continue
+        baseline = statistics.median(samples)
+        regressed = value > baseline * threshold and value - baseline > slack(label)
+        rows.append((label, baseline, value, regressed))
+    return rows
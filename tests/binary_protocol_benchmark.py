@@ -0,0 +1,123 @@
+# binary_protocol_benchmark.py
+# 对比同一节点上 HTTP 路径与二进制协议路径的决策吞吐和延迟
+# 运行前需要在 app/config.py 中开启 BINARY_UNIX_SOCKET 或 BINARY_TCP_PORT 并启动节点
+import asyncio
+import aiohttp
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.binary_protocol import BinaryLimiterClient
+
+HTTP_NODE = "http://127.0.0.1:8003"
+BINARY_UNIX_SOCKET = "/tmp/rate_limiter.sock"   # 为 None 时使用 TCP
+BINARY_TCP = ("127.0.0.1", 9003)
+API_KEY = "unlimited-key"
+TOTAL_REQUESTS = 20000
+CONCURRENCY = 200
+
+
+def summarize(name, latencies, statuses, duration):
+    latencies.sort()
+    count = len(latencies)
+    allowed = sum(1 for s in statuses if s == "ALLOWED")
+    errors = sum(1 for s in statuses if s == "error")
+    return {
+        "name": name,
+        "decisions_per_sec": count / duration if duration > 0 else 0,
+        "allowed": allowed,
+        "errors": errors,
+        "avg_ms": sum(latencies) / count * 1000 if count else 0,
+        "p50_ms": latencies[int(count * 0.50)] * 1000 if count else 0,
+        "p99_ms": latencies[min(count - 1, int(count * 0.99))] * 1000 if count else 0,
+    }
+
+
+async def run_http_benchmark():
+    """HTTP路径：完整的 /v1/chat/completions 请求"""
+    connector = aiohttp.TCPConnector(limit=CONCURRENCY, keepalive_timeout=60)
+    latencies = []
+    statuses = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def send(i):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.post(
+                        f"{HTTP_NODE}/v1/chat/completions",
+                        json={
+                            "model": "gpt-4-turbo",
+                            "messages": [{"role": "user", "content": "x" * 200}]
+                        },
+                        headers={"Authorization": f"Bearer {API_KEY}"}
+                    ) as response:
+                        await response.read()
+                        statuses.append("ALLOWED" if response.status == 200 else str(response.status))
+                except Exception:
+                    statuses.append("error")
+                latencies.append(time.perf_counter() - start)
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(TOTAL_REQUESTS)))
+        duration = time.perf_counter() - start_time
+
+    return summarize("HTTP", latencies, statuses, duration)
+
+
+async def run_binary_benchmark():
+    """二进制协议路径：单连接流水线发送"""
+    if BINARY_UNIX_SOCKET:
+        client = await BinaryLimiterClient.connect_unix(BINARY_UNIX_SOCKET)
+    else:
+        client = await BinaryLimiterClient.connect_tcp(*BINARY_TCP)
+
+    latencies = []
+    statuses = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def send(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                is_blocked, reason = await client.check(API_KEY, 50, 50)
+                statuses.append(reason)
+            except Exception:
+                statuses.append("error")
+            latencies.append(time.perf_counter() - start)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(TOTAL_REQUESTS)))
+    duration = time.perf_counter() - start_time
+    await client.close()
+
+    return summarize("Binary", latencies, statuses, duration)
+
+
+async def run_benchmark():
+    print("🔬 HTTP vs 二进制协议 决策性能对比")
+    print(f"请求数: {TOTAL_REQUESTS}, 并发: {CONCURRENCY}, API Key: {API_KEY}")
+    print("=" * 60)
+
+    results = []
+    for runner in (run_http_benchmark, run_binary_benchmark):
+        try:
+            results.append(await runner())
+        except Exception as e:
+            print(f"❌ {runner.__name__} 失败: {e}")
+        await asyncio.sleep(1)
+
+    print(f"\n{'路径':<8}{'决策/秒':>12}{'允许':>8}{'错误':>8}{'平均ms':>10}{'P50ms':>10}{'P99ms':>10}")
+    for r in results:
+        print(f"{r['name']:<8}{r['decisions_per_sec']:>12.1f}{r['allowed']:>8}{r['errors']:>8}"
+              f"{r['avg_ms']:>10.2f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+    if len(results) == 2 and results[0]["decisions_per_sec"] > 0:
+        speedup = results[1]["decisions_per_sec"] / results[0]["decisions_per_sec"]
+        print(f"\n🚀 二进制协议吞吐为HTTP路径的 {speedup:.2f} 倍")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
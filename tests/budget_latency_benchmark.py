@@ -0,0 +1,89 @@
+# budget_latency_benchmark.py
+# 对比限流脚本开启/关闭长周期预算（日/月 token 与花费）时的调用延迟（需要本地 Redis）
+# 两种模式交替分轮运行，避免 Redis 状态或系统抖动偏向某一方
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.budgets import NO_BUDGETS
+from app.limiter import LIMITER_SCRIPT, build_limiter_call
+
+ROUNDS = 5
+CALLS_PER_ROUND = 2000
+CONCURRENCY = 50
+KEYS = 100
+BUDGETS = (10**12, 10**13, 10**12, 10**13)   # 足够大，只测开销不触发拒绝
+
+
+async def run_round(script, run_id, budgets, latencies):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def call(i):
+        async with semaphore:
+            now_us = int(time.time() * 1_000_000)
+            keys, args = build_limiter_call(
+                f"budget-bench-{run_id}-{i % KEYS}", now_us, 10**9, 10**12, 10**12, 100, 50,
+                f"{now_us}:{i}", budgets=budgets, spend=2500,
+            )
+            start = time.perf_counter()
+            await script(keys=keys, args=args)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(call(i) for i in range(CALLS_PER_ROUND)))
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1_000_000
+
+
+async def run_benchmark():
+    print("📅 长周期预算延迟基准")
+    print(f"轮数: {ROUNDS}, 每轮调用: {CALLS_PER_ROUND}, 并发: {CONCURRENCY}, key 数: {KEYS}")
+    print("=" * 70)
+
+    client = redis.Redis(host="localhost", port=6379, max_connections=CONCURRENCY)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"⚠️ 本地 Redis 不可用，跳过: {e}")
+        return True
+
+    script = client.register_script(LIMITER_SCRIPT)
+    run_id = int(time.time())
+    results = {"关闭预算": [], "开启预算": []}
+    for round_no in range(ROUNDS):
+        for name, budgets in (("关闭预算", NO_BUDGETS), ("开启预算", BUDGETS)):
+            await run_round(script, f"{run_id}-{name == '开启预算'}", budgets, results[name])
+
+    print(f"{'模式':<10}{'P50(us)':>10}{'P90(us)':>10}{'P99(us)':>10}{'平均(us)':>10}")
+    summary = {}
+    for name, latencies in results.items():
+        latencies.sort()
+        summary[name] = (percentile(latencies, 0.5), sum(latencies) / len(latencies) * 1_000_000)
+        print(f"{name:<10}{percentile(latencies, 0.5):>10.0f}{percentile(latencies, 0.9):>10.0f}"
+              f"{percentile(latencies, 0.99):>10.0f}{summary[name][1]:>10.0f}")
+
+    budget_key_sample = f"rl:budget-bench-{run_id}-True-0:budget"
+    fields = await client.hlen(budget_key_sample)
+    encoding = await client.object("encoding", budget_key_sample)
+    print(f"\n单个预算 hash: {fields} 个字段, 编码 {encoding.decode() if isinstance(encoding, bytes) else encoding}")
+
+    keys = [k async for k in client.scan_iter(match=f"rl:budget-bench-{run_id}-*")]
+    for start in range(0, len(keys), 1000):
+        await client.delete(*keys[start:start + 1000])
+    await client.aclose()
+
+    # 预算只多出几次 HMGET/HINCRBY，P50 增加应在 10% 以内（小于网络往返的抖动）
+    overhead = summary["开启预算"][0] / summary["关闭预算"][0] - 1
+    ok = overhead < 0.10
+    print(f"{'✅' if ok else '❌'} P50 增加 {overhead:+.1%}")
+    return ok
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
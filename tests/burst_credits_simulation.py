@@ -0,0 +1,85 @@
+# burst_credits_simulation.py
+# 用虚拟时钟直接调用限流脚本，对比有无突发额度时的放行情况（需要本地 Redis）
+# 场景 1: 安静数分钟后 10 秒内突发 1.5 倍 RPM 的请求 —— 突发额度应放行更多
+# 场景 2: 持续 3 倍 RPM 超用 5 分钟 —— 平均放行量仍应接近稳态限额
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.limiter import LIMITER_SCRIPT, build_limiter_call
+
+RPM = 100
+BURST_RATIO = 0.5
+START_US = 1_800_000_000_000_000
+
+
+async def drive(script, api_key, schedule, burst_ratio):
+    """schedule 为 (虚拟时间微秒) 列表，返回放行数"""
+    admitted = 0
+    for seq, ts in enumerate(schedule):
+        keys, args = build_limiter_call(api_key, ts, RPM, 10**9, 10**9, 1, 1, f"{ts}:{seq}", burst_ratio=burst_ratio)
+        result = await script(keys=keys, args=args)
+        admitted += result[0] == 1
+    return admitted
+
+
+def bursty_schedule():
+    """每 3 分钟一个周期：安静期每分钟 10 个请求，随后 10 秒内突发 1.5 倍 RPM 的请求"""
+    schedule = []
+    burst_requests = RPM * 3 // 2
+    for cycle in range(3):
+        base = START_US + cycle * 180_000_000
+        schedule.extend(base + i * 6_000_000 for i in range(20))
+        burst_start = base + 150_000_000
+        schedule.extend(burst_start + i * (10_000_000 // burst_requests) for i in range(burst_requests))
+    return schedule
+
+
+def sustained_schedule():
+    """持续 5 分钟以 3 倍 RPM 发送"""
+    spacing = 60_000_000 // (RPM * 3)
+    return [START_US + i * spacing for i in range(RPM * 3 * 5)]
+
+
+async def run_simulation():
+    print("💳 突发额度模拟（虚拟时钟）")
+    print(f"RPM: {RPM}, 突发额度上限: {BURST_RATIO:.0%}")
+    print("=" * 70)
+
+    client = redis.Redis(host="localhost", port=6379)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"⚠️ 本地 Redis 不可用，跳过: {e}")
+        return True
+
+    script = client.register_script(LIMITER_SCRIPT)
+    run = int(time.time())
+    results = {}
+    for name, schedule in (("突发", bursty_schedule()), ("持续超用", sustained_schedule())):
+        for ratio in (0.0, BURST_RATIO):
+            results[(name, ratio)] = await drive(script, f"burst-sim-{run}-{name}-{ratio}", schedule, ratio)
+        print(f"{name:<8} 请求 {len(schedule):>5}  无额度放行 {results[(name, 0.0)]:>5}  "
+              f"有额度放行 {results[(name, BURST_RATIO)]:>5}")
+
+    keys = [k async for k in client.scan_iter(match=f"rl:burst-sim-{run}-*")]
+    if keys:
+        await client.delete(*keys)
+    await client.aclose()
+
+    more_in_bursts = results[("突发", BURST_RATIO)] > results[("突发", 0.0)]
+    # 持续超用 5 分钟：有额度时最多多出一次满额度的突发量，外加校准周期带来的少量误差
+    sustained_cap = RPM * 5 * 1.1 + RPM * BURST_RATIO
+    sustained_ok = results[("持续超用", BURST_RATIO)] <= sustained_cap
+    print(f"\n{'✅' if more_in_bursts else '❌'} 突发额度让安静后的突发放行更多")
+    print(f"{'✅' if sustained_ok else '❌'} 持续超用时放行量不超过 {sustained_cap:.0f}")
+    return more_in_bursts and sustained_ok
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_simulation())
+    sys.exit(0 if ok else 1)
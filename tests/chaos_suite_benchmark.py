@@ -0,0 +1,267 @@
+# chaos_suite_benchmark.py
+# 混沌测试：本地 redis-server 与服务节点之间放一个故障注入代理（app/fault_proxy.py），
+# 持续负载下依次注入延迟、抖动、连接重置、拒绝连接、网络分区和 Redis 重启（切换到一个空的新主节点），
+# 统计每个场景故障期间的吞吐、P99、错误率与故障解除后的恢复时间
+# 超过场景阈值、或与 tests/chaos_history.json（可用 CHAOS_HISTORY_FILE 指定）中最近几次运行的中位数相比明显变差时以非零退出
+# 节点以子进程启动（REDIS_PORT 指向代理），连接池与多路复用两种客户端模式各跑一遍（需要 PATH 中有 redis-server）
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+import redis.asyncio as redis
+
+from app.config import REDIS_CONNECT_TIMEOUT, REDIS_SOCKET_TIMEOUT
+from app.fault_proxy import FaultProxy
+from tests.benchmark_history import HISTORY_WINDOW, append_history, compare_with_history, load_history
+
+REDIS_PORT = 6393
+NODE_PORTS = [8021, 8022]
+CLIENT_MODES = ["pool", "multiplexed"]
+API_KEY = "unlimited-key"
+CONCURRENCY_PER_NODE = 20
+WARM_SECONDS = 1.0          # 每个场景注入故障前的正常阶段
+FAULT_SECONDS = 2.0
+RECOVERY_SECONDS = 3.0      # 故障解除后观察的时长，最后 1 秒必须没有错误
+HISTORY_FILE = os.environ.get("CHAOS_HISTORY_FILE", os.path.join(ROOT_DIR, "tests", "chaos_history.json"))
+REGRESSION_THRESHOLD = 1.5  # P99 / 恢复时间比最近几次运行的中位数差 50% 以上（且超过下面的绝对余量）视为回归
+REGRESSION_SLACK = {"p99_ms": 50.0, "recovery_s": 0.5}
+
+# Redis 无响应时单次判定最长约为：连接池 socket_timeout × 2（retry_on_timeout 重试一次）+ 建连超时
+STALL_BOUND_MS = (2 * REDIS_SOCKET_TIMEOUT + REDIS_CONNECT_TIMEOUT) * 1000
+
+
+async def restart_redis(ctx):
+    """Redis 重启：进程被杀、1 秒后在同一端口起一个没有数据、没有脚本缓存的新实例"""
+    ctx["redis"].kill()
+    ctx["redis"].wait()
+    await asyncio.sleep(1.0)
+    ctx["redis"] = start_redis(ctx["workdir"])
+
+
+def reset_and_refuse(ctx):
+    ctx["proxy"].set_fault("refuse")
+    ctx["proxy"].reset_connections()
+
+
+# 名称, 注入（恢复时代理统一切回 pass）, 故障期间 P99 比基线多出的上限(ms), 故障期间错误率上限, 恢复时间上限(s)
+# 连接重置时多路复用连接上在途的命令会失败（不能安全重发，脚本可能已执行），错误数约为重置瞬间的并发数
+SCENARIOS = [
+    ("基线", None, None, 0.0, 0.0),
+    ("延迟 20ms", lambda ctx: ctx["proxy"].set_fault(latency=0.020), 60, 0.0, 0.0),
+    ("抖动 20±15ms", lambda ctx: ctx["proxy"].set_fault(latency=0.020, jitter=0.015), 80, 0.0, 0.0),
+    ("连接重置", lambda ctx: ctx["proxy"].reset_connections(), 200, 0.1, 0.5),
+    ("拒绝连接", reset_and_refuse, STALL_BOUND_MS + 100, 1.0, 1.0),
+    ("网络分区", lambda ctx: ctx["proxy"].set_fault("blackhole"), STALL_BOUND_MS + 200, 1.0, 2.0),
+    ("Redis 重启", restart_redis, STALL_BOUND_MS + 200, 1.0, 2.0),
+]
+
+
+def start_redis(workdir):
+    return subprocess.Popen(
+        ["redis-server", "--port", str(REDIS_PORT), "--save", "", "--appendonly", "no", "--dir", workdir],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def start_node(port, proxy_port, mode):
+    env = dict(os.environ, REDIS_PORT=str(proxy_port), REDIS_CLIENT_MODE=mode, NODE_ID=f"chaos-{port}")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--no-access-log"],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(session, port):
+    deadline = time.perf_counter() + 30
+    while time.perf_counter() < deadline:
+        try:
+            async with session.get(f"http://127.0.0.1:{port}/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"节点 {port} 30 秒内未就绪")
+
+
+class LoadGenerator:
+    """每个节点固定并发持续发请求，记录 (完成时刻, 延迟, 是否成功)"""
+
+    def __init__(self, session):
+        self._session = session
+        self._running = False
+        self._tasks = []
+        self.samples = []
+
+    def start(self):
+        self._running = True
+        self._tasks = [
+            asyncio.ensure_future(self._worker(port, w))
+            for port in NODE_PORTS for w in range(CONCURRENCY_PER_NODE)
+        ]
+
+    async def stop(self):
+        self._running = False
+        await asyncio.gather(*self._tasks)
+
+    async def _worker(self, port, worker):
+        url = f"http://127.0.0.1:{port}/v1/chat/completions"
+        headers = {"Authorization": f"Bearer {API_KEY}"}
+        i = 0
+        while self._running:
+            body = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": f"chaos {worker} {i}"}]}
+            i += 1
+            start = time.perf_counter()
+            try:
+                async with self._session.post(url, json=body, headers=headers) as response:
+                    await response.read()
+                    ok = response.status == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            end = time.perf_counter()
+            self.samples.append((end, end - start, ok))
+            if not ok:
+                await asyncio.sleep(0.01)   # 失败时稍作退避，避免空转压垮事件循环
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else 0.0
+
+
+def summarize(samples, fault_start, heal_at, end):
+    fault = [s for s in samples if fault_start <= s[0] < heal_at]
+    after = [s for s in samples if heal_at <= s[0] < end]
+    errors = sum(1 for s in fault if not s[2])
+    failed_after = [s[0] for s in after if not s[2]]
+    tail_errors = sum(1 for s in after if s[0] >= end - 1.0 and not s[2])
+    return {
+        "qps": sum(1 for s in fault if s[2]) / (heal_at - fault_start),
+        "p99_ms": percentile([s[1] for s in fault], 0.99),
+        "error_rate": errors / len(fault) if fault else 1.0,
+        "recovery_s": max(failed_after) - heal_at if failed_after else 0.0,
+        "recovered": tail_errors == 0 and any(s[2] for s in after),
+    }
+
+
+async def run_mode(mode, ctx):
+    print(f"\n客户端模式: {mode}")
+    print(f"{'场景':<14}{'QPS':>8}{'P99(ms)':>10}{'错误率':>9}{'恢复(s)':>9}  结论")
+    nodes = [start_node(port, ctx["proxy"].port, mode) for port in NODE_PORTS]
+    results = {}
+    ok = True
+    baseline_p99 = 0.0
+    try:
+        timeout = aiohttp.ClientTimeout(total=5)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            for port in NODE_PORTS:
+                await wait_ready(session, port)
+            load = LoadGenerator(session)
+            load.start()
+            for name, inject, max_p99, max_errors, max_recovery in SCENARIOS:
+                await asyncio.sleep(WARM_SECONDS)
+                fault_start = time.perf_counter()
+                if inject is not None:
+                    await inject(ctx) if asyncio.iscoroutinefunction(inject) else inject(ctx)
+                await asyncio.sleep(max(0.0, fault_start + FAULT_SECONDS - time.perf_counter()))
+                heal_at = time.perf_counter()
+                ctx["proxy"].set_fault("pass")
+                await asyncio.sleep(RECOVERY_SECONDS)
+                result = summarize(load.samples, fault_start, heal_at, time.perf_counter())
+                if inject is None:
+                    baseline_p99 = result["p99_ms"]
+                p99_ok = max_p99 is None or result["p99_ms"] <= baseline_p99 + max_p99
+                passed = (p99_ok and result["error_rate"] <= max_errors
+                          and result["recovery_s"] <= max_recovery and result["recovered"])
+                ok = ok and passed
+                results[name] = result
+                print(f"{name:<14}{result['qps']:>8.0f}{result['p99_ms']:>10.1f}{result['error_rate']:>8.1%}"
+                      f"{result['recovery_s']:>9.2f}  {'✅' if passed else '❌'}"
+                      f"{'' if result['recovered'] else ' 未恢复'}")
+            await load.stop()
+    finally:
+        for node in nodes:
+            node.terminate()
+            node.wait(timeout=10)
+    return ok, results
+
+
+def regression_metrics(run):
+    """{(模式, 场景, 指标): 数值}，逐项与历史对比 P99 与恢复时间"""
+    return {
+        (mode, name, metric): result[metric]
+        for mode, scenarios in run.get("modes", {}).items()
+        for name, result in scenarios.items()
+        for metric in REGRESSION_SLACK
+    }
+
+
+def compare_with_previous(history, current):
+    """与最近几次运行的中位数逐项对比，返回是否有回归"""
+    if not history:
+        return False
+    print(f"\n与最近 {min(len(history), HISTORY_WINDOW)} 次运行的中位数对比:")
+    rows = compare_with_history(history, current, regression_metrics, REGRESSION_THRESHOLD,
+                                lambda label: REGRESSION_SLACK[label[2]])
+    regressed = False
+    for (mode, name, metric), old, new, row_regressed in rows:
+        if row_regressed:
+            regressed = True
+            print(f"  ❌ {mode:<12}{name:<14}{metric:<12}{old:>8.2f} -> {new:>8.2f}")
+    if not regressed:
+        print("  ✅ 没有超过阈值的回归")
+    return regressed
+
+
+async def run_suite():
+    print("🌪️ Redis 故障注入测试")
+    print(f"{len(NODE_PORTS)} 个节点 × 并发 {CONCURRENCY_PER_NODE}, 每个场景故障 {FAULT_SECONDS}s、"
+          f"观察恢复 {RECOVERY_SECONDS}s, socket 超时 {REDIS_SOCKET_TIMEOUT}s")
+    print("=" * 70)
+    if shutil.which("redis-server") is None:
+        print("⚠️ 未找到 redis-server，跳过")
+        return True
+
+    workdir = tempfile.mkdtemp(prefix="chaos-")
+    ctx = {"workdir": workdir, "redis": start_redis(workdir), "proxy": FaultProxy("127.0.0.1", REDIS_PORT)}
+    monitor = redis.Redis(port=REDIS_PORT)
+    current = {"test_time": time.strftime('%Y-%m-%d %H:%M:%S'), "modes": {}}
+    ok = True
+    try:
+        for _ in range(100):
+            try:
+                await monitor.ping()
+                break
+            except Exception:
+                await asyncio.sleep(0.05)
+        await monitor.aclose()
+        await ctx["proxy"].start()
+        for mode in CLIENT_MODES:
+            mode_ok, current["modes"][mode] = await run_mode(mode, ctx)
+            ok = ok and mode_ok
+    finally:
+        await ctx["proxy"].stop()
+        ctx["redis"].kill()
+        ctx["redis"].wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    history = load_history(HISTORY_FILE)
+    regressed = compare_with_previous(history, current)
+    append_history(HISTORY_FILE, history, current)
+
+    print(f"\n{'✅' if ok else '❌'} 所有场景的 P99、错误率与恢复时间在阈值内")
+    return ok and not regressed
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_suite())
+    sys.exit(0 if ok else 1)
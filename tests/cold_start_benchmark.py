@@ -0,0 +1,155 @@
+# cold_start_benchmark.py
+# 冷启动基准：启动一个全新节点，记录就绪耗时与前几百个请求的延迟
+# 冷启动重复 COLD_START_RUNS 次取各指标的中位数，追加到 tests/cold_start_history.json，
+# 并与最近几次运行的中位数对比（tests/benchmark_history.py），便于追踪回归
+import asyncio
+import aiohttp
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+from tests.benchmark_history import HISTORY_WINDOW, append_history, compare_with_history, load_history
+
+PORT = 8013
+NODE_URL = f"http://127.0.0.1:{PORT}"
+API_KEY = "unlimited-key"
+FIRST_BURST = 300          # 冷启动后立即发送的请求数
+CONCURRENCY = 50
+# 与工作目录无关，固定放在 tests/ 下；可用环境变量改到别处
+HISTORY_FILE = os.environ.get("COLD_START_HISTORY_FILE", os.path.join(ROOT_DIR, "tests", "cold_start_history.json"))
+COLD_START_RUNS = int(os.environ.get("COLD_START_RUNS", "3"))
+REGRESSION_THRESHOLD = 1.2  # 比最近几次运行的中位数慢 20%（且超过下面的绝对余量）视为回归
+REGRESSION_SLACK = {"ready_s": 0.1, "first_burst_p99_ms": 20.0, "first_burst_max_ms": 20.0}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+async def send_burst(session, count):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+    errors = 0
+
+    async def send(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(
+                    f"{NODE_URL}/v1/chat/completions",
+                    json={
+                        "model": "gpt-4-turbo",
+                        "messages": [{"role": "user", "content": f"cold start {i}"}]
+                    },
+                    headers={"Authorization": f"Bearer {API_KEY}"}
+                ) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(send(i) for i in range(count)))
+    return latencies, errors
+
+
+async def measure_cold_start():
+    launch_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT), "--no-access-log"],
+        cwd=ROOT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            # 等待 /health 返回 200（预热完成）
+            listening_time = None
+            while True:
+                if time.perf_counter() - launch_time > 30:
+                    raise RuntimeError("节点30秒内未就绪")
+                try:
+                    async with session.get(f"{NODE_URL}/health") as response:
+                        if listening_time is None:
+                            listening_time = time.perf_counter() - launch_time
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.02)
+            ready_time = time.perf_counter() - launch_time
+
+            first_latencies, first_errors = await send_burst(session, FIRST_BURST)
+            steady_latencies, steady_errors = await send_burst(session, FIRST_BURST)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    return {
+        "test_time": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "listening_s": listening_time,
+        "ready_s": ready_time,
+        "first_burst_p50_ms": percentile(first_latencies, 0.50) * 1000,
+        "first_burst_p99_ms": percentile(first_latencies, 0.99) * 1000,
+        "first_burst_max_ms": max(first_latencies) * 1000,
+        "first_burst_errors": first_errors,
+        "steady_p50_ms": percentile(steady_latencies, 0.50) * 1000,
+        "steady_p99_ms": percentile(steady_latencies, 0.99) * 1000,
+        "steady_errors": steady_errors,
+    }
+
+
+def regression_metrics(run):
+    return {metric: run.get(metric) for metric in REGRESSION_SLACK}
+
+
+async def run_benchmark():
+    print("🧊 冷启动基准测试")
+    print("=" * 60)
+
+    runs = []
+    for i in range(COLD_START_RUNS):
+        runs.append(await measure_cold_start())
+        print(f"第 {i + 1}/{COLD_START_RUNS} 次: 就绪 {runs[-1]['ready_s']*1000:.0f}ms  "
+              f"首批 P99 {runs[-1]['first_burst_p99_ms']:.2f}ms")
+    # 单次冷启动受磁盘缓存、调度等影响较大，耗时取多次运行的中位数，错误数累加
+    result = {"test_time": runs[0]["test_time"], "runs": COLD_START_RUNS}
+    for metric in runs[0]:
+        if metric.endswith("_errors"):
+            result[metric] = sum(run[metric] for run in runs)
+        elif metric != "test_time":
+            result[metric] = statistics.median(run[metric] for run in runs)
+    print(f"\n{COLD_START_RUNS} 次运行的中位数:")
+    print(f"端口开始监听: {result['listening_s']*1000:.0f}ms")
+    print(f"/health 就绪: {result['ready_s']*1000:.0f}ms")
+    print(f"前 {FIRST_BURST} 个请求  P50: {result['first_burst_p50_ms']:.2f}ms  "
+          f"P99: {result['first_burst_p99_ms']:.2f}ms  最大: {result['first_burst_max_ms']:.2f}ms  "
+          f"错误: {result['first_burst_errors']}")
+    print(f"稳态 {FIRST_BURST} 个请求    P50: {result['steady_p50_ms']:.2f}ms  "
+          f"P99: {result['steady_p99_ms']:.2f}ms  错误: {result['steady_errors']}")
+
+    history = load_history(HISTORY_FILE)
+    rows = compare_with_history(history, result, regression_metrics, REGRESSION_THRESHOLD, REGRESSION_SLACK.get)
+    if rows:
+        print(f"\n与最近 {min(len(history), HISTORY_WINDOW)} 次运行的中位数对比:")
+    for metric, before, after, regressed in rows:
+        ratio = after / before if before else float("inf")
+        print(f"  {metric:<22}{before:>10.2f} -> {after:>10.2f}  ({ratio:.2f}x) {'❌ 回归' if regressed else '✅'}")
+    regressed = any(row[3] for row in rows)
+
+    append_history(HISTORY_FILE, history, result)
+    print(f"\n📄 结果已追加到: {HISTORY_FILE}")
+    return not regressed
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
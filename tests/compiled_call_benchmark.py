@@ -0,0 +1,160 @@
+# compiled_call_benchmark.py
+# 预编译调用与内联限额调用的对比
+# 1. 每次调用发往 Redis 的字节数、构造 KEYS/ARGV 时新分配的对象数与字节数、构造耗时（不需要 Redis）
+#    内联方式按改动前 check_rate_limit_fast 的做法：每次缩放限额、换算预算与影子限额，再拼 key 名
+# 2. 判定一致性（需要本地 Redis）：各套餐在相同请求序列（含自适应倍率、终端用户、幂等键）下两种方式的结论完全相同
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.budgets import budget_limits, request_spend
+from app.config import API_KEYS_CONFIG
+from app.limiter import LIMITER_SCRIPT, CompiledKey, build_compiled_call, build_limiter_call, publish_limits
+from app.redis_mux import encode_command
+from app.request_ids import RequestIdGenerator
+from app.shadow_policy import shadow_limits
+
+CALLS = 20000
+IDEMPOTENCY_TTL = 300
+SCRIPT_SHA = "0" * 40
+NOW_US = 1_800_000_000_000_000
+REQUESTS_PER_TIER = 400
+MULTIPLIERS = [1, 0.75]
+
+
+def legacy_call(api_key, config, now_us, multiplier, input_tokens, output_tokens, request_id, user, idempotency_key):
+    """改动前 check_rate_limit_fast + check_rate_limit_lua 中每次请求的参数构造"""
+    rpm_limit = int(config["rpm"] * multiplier)
+    input_tpm_limit = int(config["input_tpm"] * multiplier)
+    output_tpm_limit = int(config["output_tpm"] * multiplier)
+    user_rpm_limit = int(config.get("user_rpm", 0) * multiplier)
+    return build_limiter_call(
+        api_key, now_us, rpm_limit, input_tpm_limit, output_tpm_limit, input_tokens, output_tokens, request_id,
+        user if user_rpm_limit else None, user_rpm_limit, config.get("burst_ratio", 0.0),
+        budget_limits(config), request_spend("gpt-4", input_tokens, output_tokens),
+        shadow_limits(config, multiplier), idempotency_key, IDEMPOTENCY_TTL,
+    )
+
+
+def compiled_call(compiled, now_us, multiplier, input_tokens, output_tokens, request_id, user, idempotency_key):
+    return build_compiled_call(
+        compiled, now_us, multiplier, input_tokens, output_tokens, request_id,
+        request_spend("gpt-4", input_tokens, output_tokens), user, idempotency_key,
+    )
+
+
+def wire_bytes(keys, args):
+    return len(encode_command(["EVALSHA", SCRIPT_SHA, len(keys), *keys, *args]))
+
+
+def measure_build(build):
+    """返回 (每次调用新分配的对象数, 字节数, 耗时 ns)；构造结果全部保留，统计的是每个请求实际留下的分配"""
+    ids = RequestIdGenerator("bench")
+    request_ids = [ids.next() for _ in range(CALLS)]
+    retained = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for request_id in request_ids:
+        retained.append(build(request_id))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in diff) / CALLS
+    size = sum(stat.size_diff for stat in diff) / CALLS
+    retained.clear()
+
+    start = time.perf_counter()
+    for request_id in request_ids:
+        build(request_id)
+    elapsed = (time.perf_counter() - start) / CALLS * 1e9
+    return blocks, size, elapsed
+
+
+def measure_static(api_key, config, user):
+    compiled = CompiledKey(api_key, config, IDEMPOTENCY_TTL)
+    legacy = measure_build(lambda rid: legacy_call(api_key, config, NOW_US, 1, 100, 50, rid, user, None))
+    fast = measure_build(lambda rid: compiled_call(compiled, NOW_US, 1, 100, 50, rid, user, None))
+    legacy_bytes = wire_bytes(*legacy_call(api_key, config, NOW_US, 1, 100, 50, "a1b2c3-1f", user, None))
+    fast_bytes = wire_bytes(*compiled_call(compiled, NOW_US, 1, 100, 50, "a1b2c3-1f", user, None))
+    return legacy, fast, legacy_bytes, fast_bytes
+
+
+def decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def check_equivalence():
+    client = redis.Redis(host="localhost", port=6379)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"\n⚠️ 本地 Redis 不可用，跳过判定一致性部分: {e}")
+        return None
+
+    script = client.register_script(LIMITER_SCRIPT)
+    run = int(time.time())
+    mismatches = 0
+    total = 0
+    for tier_key, config in API_KEYS_CONFIG.items():
+        for multiplier in MULTIPLIERS:
+            legacy_key = f"compiled-bench-{run}-legacy-{tier_key}-{multiplier}"
+            compiled = CompiledKey(f"compiled-bench-{run}-compiled-{tier_key}-{multiplier}", config, IDEMPOTENCY_TTL)
+            await publish_limits(client, [compiled])
+            # 1 分钟内 400 个请求：两个终端用户交替，每 10 个请求重试一次上一个请求的幂等键
+            spacing = 60_000_000 // REQUESTS_PER_TIER
+            for seq in range(REQUESTS_PER_TIER):
+                now_us = NOW_US + seq * spacing
+                user = f"user-{seq % 2}"
+                idem = f"idem-{seq - 1}" if seq % 10 == 0 and seq else f"idem-{seq}"
+                input_tokens, output_tokens = 200 + seq % 7 * 100, 100
+                request_id = f"{seq:x}"
+                legacy = await script(*legacy_call(legacy_key, config, now_us, multiplier, input_tokens,
+                                                   output_tokens, request_id, user, idem))
+                fast = await script(*compiled_call(compiled, now_us, multiplier, input_tokens,
+                                                   output_tokens, request_id, user, idem))
+                total += 1
+                if [legacy[0], decode(legacy[1]), decode(legacy[2])] != [fast[0], decode(fast[1]), decode(fast[2])]:
+                    mismatches += 1
+    keys = [k async for k in client.scan_iter(match=f"rl:compiled-bench-{run}-*")]
+    keys += [k async for k in client.scan_iter(match="rl:limits:*")]
+    for start in range(0, len(keys), 1000):
+        await client.delete(*keys[start:start + 1000])
+    await client.aclose()
+    print(f"\n判定一致性: {total} 次判定, 不一致 {mismatches} 次（{len(API_KEYS_CONFIG)} 个套餐 × 倍率 {MULTIPLIERS}）")
+    return mismatches == 0
+
+
+async def run_benchmark():
+    print("🧩 预编译限流调用压测")
+    print(f"每种构造方式 {CALLS} 次")
+    print("=" * 70)
+    print(f"{'套餐':<24}{'方式':<8}{'线上字节':>10}{'对象/次':>10}{'字节/次':>10}{'构造(ns)':>10}")
+
+    rows = []
+    for tier_key, config in API_KEYS_CONFIG.items():
+        user = "end-user-1" if config.get("user_rpm") else None
+        legacy, fast, legacy_bytes, fast_bytes = measure_static(tier_key, config, user)
+        rows.append((legacy, fast, legacy_bytes, fast_bytes))
+        for name, (blocks, size, elapsed), wire in (("内联", legacy, legacy_bytes), ("预编译", fast, fast_bytes)):
+            print(f"{config['name']:<24}{name:<8}{wire:>10}{blocks:>10.1f}{size:>10.0f}{elapsed:>10.0f}")
+
+    wire_ok = all(fast_bytes < legacy_bytes for _, _, legacy_bytes, fast_bytes in rows)
+    alloc_ok = all(fast[0] < legacy[0] for legacy, fast, _, _ in rows)
+    saved = sum(l - f for _, _, l, f in rows) / len(rows)
+    print(f"\n{'✅' if wire_ok else '❌'} 所有套餐的预编译调用发送字节更少（平均每次少 {saved:.0f} 字节）")
+    print(f"{'✅' if alloc_ok else '❌'} 所有套餐的预编译调用每次新分配的对象更少")
+
+    equivalent = await check_equivalence()
+    if equivalent is not None:
+        print(f"{'✅' if equivalent else '❌'} 两种方式的判定结论完全一致")
+    return wire_ok and alloc_ok and equivalent is not False
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
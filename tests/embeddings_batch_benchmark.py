@@ -0,0 +1,134 @@
+# embeddings_batch_benchmark.py
+# 批量 embeddings 请求的 token 计数开销与计费正确性
+# 1. 计数开销（不需要 Redis）：100-2000 条输入的请求体，对比 Pydantic 逐条校验 + Python 循环计数
+#    与 app/limiter.py 的 orjson 一次解析 + join / map 计数
+# 2. 输入校验（不需要 Redis）：max_tokens / n 的边界值，字符串与 token 数组混用的 prompt
+# 3. 计费（需要本地 Redis）：一个批量请求在 Redis 中只记一次请求，input token 为整批之和
+import asyncio
+import os
+import sys
+import time
+from typing import List, Optional, Union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import orjson
+import redis.asyncio as redis
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from app.limiter import LIMITER_SCRIPT, build_limiter_call, count_completion_tokens, count_embedding_tokens
+
+BATCH_SIZES = [100, 500, 1000, 2000]
+ITEM_CHARS = 200
+ITERATIONS = 200
+
+
+class EmbeddingRequest(BaseModel):
+    """对照组：按 chat 端点的方式用 Pydantic 模型解析"""
+    model: str
+    input: Union[str, List[str]]
+    user: Optional[str] = None
+
+
+def pydantic_count(raw: bytes) -> int:
+    body = EmbeddingRequest.model_validate_json(raw)
+    items = [body.input] if isinstance(body.input, str) else body.input
+    return sum(max(1, len(item) // 4) for item in items)
+
+
+def measure(func, raw: bytes) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func(raw)
+    return (time.perf_counter() - start) / ITERATIONS * 1_000_000
+
+
+# (说明, 请求体, 期望的 output token 数；None 表示应返回 400)
+COMPLETION_CASES = [
+    ("max_tokens 为 0", {"prompt": "hello", "max_tokens": 0}, 0),
+    ("未指定 max_tokens", {"prompt": "hello"}, 16),
+    ("max_tokens 为 null", {"prompt": "hello", "max_tokens": None}, 16),
+    ("max_tokens × 条数 × n", {"prompt": ["a", "b"], "max_tokens": 10, "n": 3}, 60),
+    ("max_tokens 为 true", {"prompt": "hello", "max_tokens": True}, None),
+    ("max_tokens 为 false", {"prompt": "hello", "max_tokens": False}, None),
+    ("n 为 true", {"prompt": "hello", "n": True}, None),
+    ("n 为 0", {"prompt": "hello", "n": 0}, None),
+    ("字符串数组混入 token 数组", {"prompt": ["abcd", [1, 2, 3]]}, None),
+    ("token 数组的数组混入字符串", {"prompt": [[1, 2, 3], "abcd"]}, None),
+    ("字符串数组混入数字", {"prompt": ["abcd", 1]}, None),
+    ("字符串数组混入 null", {"prompt": ["abcd", None]}, None),
+]
+
+
+def check_validation() -> bool:
+    print(f"\n{'输入校验':<24}{'期望':>10}{'实际':>10}")
+    ok = True
+    for name, body, expected in COMPLETION_CASES:
+        raw = orjson.dumps({"model": "gpt-3.5-turbo-instruct", **body})
+        try:
+            actual = count_completion_tokens(raw).output_tokens
+        except HTTPException as e:
+            actual = None if e.status_code == 400 else f"HTTP {e.status_code}"
+        passed = actual == expected
+        ok &= passed
+        print(f"{name:<24}{'400' if expected is None else expected:>10}{'400' if actual is None else actual:>10}"
+              f"  {'✅' if passed else '❌'}")
+    return ok
+
+
+async def check_billing(batch: int) -> Optional[bool]:
+    client = redis.Redis(host="localhost", port=6379)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"\n⚠️ 本地 Redis 不可用，跳过计费部分: {e}")
+        return None
+
+    raw = orjson.dumps({"model": "text-embedding-3-small", "input": ["x" * ITEM_CHARS] * batch})
+    tokens = count_embedding_tokens(raw)
+    api_key = f"embed-bench-{int(time.time())}"
+    script = client.register_script(LIMITER_SCRIPT)
+    now_us = int(time.time() * 1_000_000)
+    keys, args = build_limiter_call(api_key, now_us, 10**6, 10**9, 10**9, tokens.input_tokens,
+                                    tokens.output_tokens, f"{now_us}:0")
+    await script(keys=keys, args=args)
+    requests = await client.zcard(f"rl:{api_key}:req")
+    charged = sum(int(m.rsplit(b":", 1)[1]) for m in await client.zrange(f"rl:{api_key}:input", 0, -1))
+    await client.delete(*[k async for k in client.scan_iter(match=f"rl:{api_key}:*")])
+    await client.aclose()
+    print(f"\n批量 {batch} 条: 记录请求 {requests} 次, 计入 input token {charged} (期望 {tokens.input_tokens})")
+    return requests == 1 and charged == tokens.input_tokens
+
+
+async def run_benchmark():
+    print("📦 批量 embeddings 计数压测")
+    print(f"每条输入 {ITEM_CHARS} 字符, 每档 {ITERATIONS} 次")
+    print("=" * 70)
+    print(f"{'条数':>6}{'Pydantic(us)':>16}{'orjson+map(us)':>18}{'加速':>8}")
+
+    speedups = []
+    counts_match = True
+    for batch in BATCH_SIZES:
+        raw = orjson.dumps({"model": "text-embedding-3-small", "input": ["x" * ITEM_CHARS] * batch})
+        counts_match &= pydantic_count(raw) == count_embedding_tokens(raw).input_tokens
+        baseline = measure(pydantic_count, raw)
+        fast = measure(count_embedding_tokens, raw)
+        speedups.append(baseline / fast)
+        print(f"{batch:>6}{baseline:>16.1f}{fast:>18.1f}{baseline / fast:>7.1f}x")
+
+    speed_ok = min(speedups) > 1.0
+    print(f"\n{'✅' if counts_match else '❌'} 两种方式计出的 token 数一致")
+    print(f"{'✅' if speed_ok else '❌'} 所有批量大小下 orjson + join / map 更快（最小加速 {min(speedups):.1f}x）")
+
+    validation_ok = check_validation()
+    print(f"{'✅' if validation_ok else '❌'} max_tokens / n 的边界值与混用类型的输入按预期计数或返回 400")
+
+    billing_ok = await check_billing(BATCH_SIZES[-1])
+    if billing_ok is not None:
+        print(f"{'✅' if billing_ok else '❌'} 整批只计一次请求，input token 为各条之和")
+    return counts_match and speed_ok and validation_ok and billing_ok is not False
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
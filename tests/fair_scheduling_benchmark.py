@@ -0,0 +1,193 @@
+# fair_scheduling_benchmark.py
+# 多租户公平调度压测：一个重度租户以大量并发压满节点，5 个轻量租户以固定速率发请求，
+# 比较限流调用直接排队（FIFO）与经过 FairScheduler（DRR）时轻量租户的延迟和重度租户的吞吐
+# 1. 模拟后端（不需要 Redis）：后端同时处理 BACKEND_PARALLELISM 个调用、每个耗时 SERVICE_TIME，代表饱和的连接池 / Redis
+# 2. 真实脚本（需要本地 Redis）：按 app/main.py 的配置调用限流 Lua 脚本
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.config import FAIR_MAX_CONCURRENCY, FAIR_MAX_QUEUE_PER_TENANT, FAIR_QUANTUM, REDIS_POOL_MAX_CONNECTIONS
+from app.fair_scheduler import FairScheduler
+from app.limiter import LIMITER_SCRIPT, build_limiter_call
+
+DURATION = 3.0
+HEAVY_WORKERS = 400
+LIGHT_TENANTS = 5
+LIGHT_RPS = 100                 # 每个轻量租户
+REJECT_BACKOFF = 0.1            # 被拒绝的请求按 Retry-After 稍后重试（缩短到 0.1s 以保持压力）
+BACKEND_PARALLELISM = 16
+SERVICE_TIME = 0.002
+REDIS_HEAVY_WORKERS = 300
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else float("nan")
+
+
+class SimulatedBackend:
+    """同时最多 parallelism 个调用，超出部分按到达顺序排队（与连接池、Redis 单线程的行为相同）"""
+
+    def __init__(self, parallelism, service_time):
+        self._semaphore = asyncio.Semaphore(parallelism)
+        self._service_time = service_time
+
+    async def call(self, tenant):
+        async with self._semaphore:
+            await asyncio.sleep(self._service_time)
+
+
+async def run_scenario(call, scheduler, heavy_workers, light_tenants=LIGHT_TENANTS):
+    """返回 (轻量租户延迟列表, 轻量租户失败次数, 重度租户完成数/秒, 重度租户失败次数)
+
+    失败包括排队位置满被拒绝，以及 FIFO 下积压过多时连接池报 Too many connections
+    """
+    stop = time.perf_counter() + DURATION
+    light_latencies = []
+    light_failed = 0
+    heavy_done = 0
+    heavy_failed = 0
+
+    async def limited(tenant):
+        if scheduler is None:
+            await call(tenant)
+            return
+        await scheduler.acquire(tenant)
+        try:
+            await call(tenant)
+        finally:
+            scheduler.release()
+
+    async def heavy_worker():
+        nonlocal heavy_done, heavy_failed
+        while time.perf_counter() < stop:
+            try:
+                await limited("heavy")
+                heavy_done += 1
+            except Exception:
+                heavy_failed += 1
+                await asyncio.sleep(REJECT_BACKOFF)
+
+    async def light_request(tenant):
+        nonlocal light_failed
+        start = time.perf_counter()
+        try:
+            await limited(tenant)
+        except Exception:
+            light_failed += 1
+            return
+        light_latencies.append(time.perf_counter() - start)
+
+    async def light_tenant(index):
+        tenant = f"light-{index}"
+        requests = []
+        next_at = time.perf_counter() + index / (LIGHT_RPS * LIGHT_TENANTS)
+        while next_at < stop:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            requests.append(asyncio.ensure_future(light_request(tenant)))
+            next_at += 1 / LIGHT_RPS
+        await asyncio.gather(*requests)
+
+    workers = [heavy_worker() for _ in range(heavy_workers)]
+    await asyncio.gather(*workers, *(light_tenant(i) for i in range(light_tenants)))
+    return light_latencies, light_failed, heavy_done / DURATION, heavy_failed
+
+
+def report(name, result):
+    latencies, failed, heavy_qps, _ = result
+    print(f"{name:<20}{percentile(latencies, 0.5):>10.2f}{percentile(latencies, 0.99):>10.2f}"
+          f"{failed:>8}{heavy_qps:>12.0f}")
+
+
+async def run_simulated():
+    print(f"\n1. 模拟后端: 并行 {BACKEND_PARALLELISM}, 每次 {SERVICE_TIME * 1000:.0f}ms "
+          f"(容量 {BACKEND_PARALLELISM / SERVICE_TIME:.0f}/s), 重度租户 {HEAVY_WORKERS} 并发, "
+          f"轻量租户 {LIGHT_TENANTS} × {LIGHT_RPS} rps")
+    print(f"{'场景':<20}{'轻P50(ms)':>10}{'轻P99(ms)':>10}{'轻失败':>8}{'重度QPS':>12}")
+
+    def fair():
+        return FairScheduler(BACKEND_PARALLELISM, FAIR_MAX_QUEUE_PER_TENANT, FAIR_QUANTUM)
+
+    alone = await run_scenario(SimulatedBackend(BACKEND_PARALLELISM, SERVICE_TIME).call, fair(), 0)
+    report("仅轻量租户 (DRR)", alone)
+    fifo = await run_scenario(SimulatedBackend(BACKEND_PARALLELISM, SERVICE_TIME).call, None, HEAVY_WORKERS)
+    report("重度租户 + FIFO", fifo)
+    drr = await run_scenario(SimulatedBackend(BACKEND_PARALLELISM, SERVICE_TIME).call, fair(), HEAVY_WORKERS)
+    report("重度租户 + DRR", drr)
+    # 只有一个租户时不限排队长度：并发远超闸门与排队位置之和也不应被拒绝
+    lone = await run_scenario(SimulatedBackend(BACKEND_PARALLELISM, SERVICE_TIME).call, fair(), HEAVY_WORKERS, 0)
+    report("仅重度租户 (DRR)", lone)
+
+    # 轻量租户每个请求最多等一轮 DRR（每个有排队的租户各放行一个），外加一次服务时间的排队
+    bound = percentile(alone[0], 0.99) + (LIGHT_TENANTS + 2) * SERVICE_TIME * 1000
+    flat = percentile(drr[0], 0.99) <= bound
+    improved = percentile(drr[0], 0.99) * 5 <= percentile(fifo[0], 0.99)
+    no_light_failures = drr[1] == 0
+    throughput_kept = drr[2] >= fifo[2] * 0.9
+    lone_unrejected = lone[3] == 0
+    print(f"\n{'✅' if flat else '❌'} 重度租户压满时轻量租户 P99 {percentile(drr[0], 0.99):.2f}ms ≤ {bound:.2f}ms（单独运行时 + 一轮 DRR）")
+    print(f"{'✅' if improved else '❌'} 轻量租户 P99 比 FIFO ({percentile(fifo[0], 0.99):.2f}ms) 低 5 倍以上")
+    print(f"{'✅' if no_light_failures else '❌'} 轻量租户没有请求失败（排队位置满或其他错误）")
+    print(f"{'✅' if throughput_kept else '❌'} 重度租户吞吐 {drr[2]:.0f}/s ≥ FIFO 的 90% ({fifo[2]:.0f}/s)，后端容量没有浪费")
+    print(f"{'✅' if lone_unrejected else '❌'} 单个租户 {HEAVY_WORKERS} 并发时没有请求被拒绝（拒绝 {lone[3]} 次）")
+    return flat and improved and no_light_failures and throughput_kept and lone_unrejected
+
+
+async def run_redis():
+    client = redis.Redis(host="localhost", port=6379, max_connections=REDIS_POOL_MAX_CONNECTIONS)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"\n⚠️ 本地 Redis 不可用，跳过真实脚本部分: {e}")
+        return None
+
+    script = client.register_script(LIMITER_SCRIPT)
+    await client.script_load(LIMITER_SCRIPT)
+    run_id = int(time.time())
+    counter = iter(range(10**9))
+
+    async def call(tenant):
+        now_us = int(time.time() * 1_000_000)
+        keys, args = build_limiter_call(f"fair-bench-{run_id}-{tenant}", now_us, 10**9, 10**12, 10**12,
+                                        100, 50, f"{now_us}:{next(counter)}")
+        await script(keys=keys, args=args)
+
+    print(f"\n2. 真实脚本: 连接池上限 {REDIS_POOL_MAX_CONNECTIONS}, 重度租户 {REDIS_HEAVY_WORKERS} 并发, "
+          f"闸门 {FAIR_MAX_CONCURRENCY}")
+    print(f"{'场景':<20}{'轻P50(ms)':>10}{'轻P99(ms)':>10}{'轻失败':>8}{'重度QPS':>12}")
+    try:
+        fifo = await run_scenario(call, None, REDIS_HEAVY_WORKERS)
+        report("重度租户 + FIFO", fifo)
+        drr = await run_scenario(call, FairScheduler(FAIR_MAX_CONCURRENCY, FAIR_MAX_QUEUE_PER_TENANT, FAIR_QUANTUM),
+                                 REDIS_HEAVY_WORKERS)
+        report("重度租户 + DRR", drr)
+    finally:
+        keys = [k async for k in client.scan_iter(match=f"rl:fair-bench-{run_id}-*")]
+        for start in range(0, len(keys), 1000):
+            await client.delete(*keys[start:start + 1000])
+        await client.aclose()
+
+    improved = percentile(drr[0], 0.99) < percentile(fifo[0], 0.99)
+    print(f"\n{'✅' if improved else '❌'} 真实脚本下轻量租户 P99 {percentile(drr[0], 0.99):.2f}ms "
+          f"< FIFO {percentile(fifo[0], 0.99):.2f}ms")
+    print(f"{'✅' if drr[1] == 0 else '❌'} 真实脚本下轻量租户没有请求失败（FIFO 失败 {fifo[1]} 次）")
+    return improved and drr[1] == 0
+
+
+async def run_benchmark():
+    print("⚖️ 多租户公平调度压测")
+    print(f"每个场景 {DURATION}s, 每个租户排队位置 {FAIR_MAX_QUEUE_PER_TENANT}")
+    print("=" * 70)
+    simulated = await run_simulated()
+    real = await run_redis()
+    return simulated and real is not False
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
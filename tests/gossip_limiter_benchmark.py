@@ -0,0 +1,139 @@
+# gossip_limiter_benchmark.py
+# 对比节点间 gossip 近似限流与 Lua 精确路径的判定吞吐与超发比例
+# gossip 部分在进程内启动多个节点（UDP 本机通信）；Lua 部分需要本地 Redis，不可用时跳过
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.gossip_limiter import GossipLimiter
+
+NODES = 3
+BASE_PORT = 9203
+RPM_LIMIT = 20000
+TOTAL_REQUESTS = 60000         # 远超限额，观察最终准入数与限额的偏差
+CONCURRENCY = 300
+INPUT_TOKENS = 10
+OUTPUT_TOKENS = 10
+OVERSHOOT = 0.05
+GOSSIP_INTERVAL = 0.05
+LOAD_SECONDS = 3.0             # 请求在该时长内匀速发出，使多个 gossip 周期参与
+
+
+async def run_gossip_benchmark():
+    ports = [BASE_PORT + i for i in range(NODES)]
+    nodes = []
+    for i, port in enumerate(ports):
+        peers = [("127.0.0.1", p) for p in ports if p != port]
+        node = GossipLimiter(f"bench-{i}", peers, overshoot=OVERSHOOT, interval=GOSSIP_INTERVAL)
+        await node.start("127.0.0.1", port)
+        nodes.append(node)
+
+    api_key = f"gossip-bench-{int(time.time())}"
+    admitted = 0
+    latencies = []
+
+    async def worker(worker_id):
+        nonlocal admitted
+        # 每个 worker 固定到一个节点，模拟负载均衡后的流量
+        node = nodes[worker_id % NODES]
+        per_worker = TOTAL_REQUESTS // CONCURRENCY
+        pause = LOAD_SECONDS / per_worker
+        for _ in range(per_worker):
+            start = time.perf_counter()
+            allowed, _ = node.admit(api_key, RPM_LIMIT, 10**12, 10**12, INPUT_TOKENS, OUTPUT_TOKENS)
+            latencies.append(time.perf_counter() - start)
+            if allowed:
+                admitted += 1
+            # 让出事件循环，使 gossip 消息得以收发
+            await asyncio.sleep(pause)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(CONCURRENCY)))
+    duration = time.perf_counter() - start_time
+
+    await asyncio.sleep(GOSSIP_INTERVAL * 3)
+    sent = sum(n.messages_sent for n in nodes)
+    for node in nodes:
+        await node.stop()
+
+    return summarize("Gossip", admitted, latencies, duration, extra=f"gossip消息: {sent}")
+
+
+async def run_lua_benchmark():
+    import redis.asyncio as redis
+    from app.limiter import LIMITER_SCRIPT
+
+    client = redis.Redis(host="localhost", port=6379)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"⚠️ 本地 Redis 不可用，跳过 Lua 路径: {e}")
+        return None
+
+    script = client.register_script(LIMITER_SCRIPT)
+    api_key = f"gossip-bench-lua-{int(time.time())}"
+    keys = [f"rl:{api_key}:req", f"rl:{api_key}:input", f"rl:{api_key}:output"]
+    admitted = 0
+    latencies = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def send(i):
+        nonlocal admitted
+        async with semaphore:
+            now_us = int(time.time() * 1_000_000)
+            start = time.perf_counter()
+            result = await script(keys=keys, args=[
+                now_us, now_us - 60_000_000, RPM_LIMIT, 10**12, 10**12,
+                INPUT_TOKENS, OUTPUT_TOKENS, f"{now_us}{i}",
+            ])
+            latencies.append(time.perf_counter() - start)
+            if result[0] == 1:
+                admitted += 1
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(TOTAL_REQUESTS)))
+    duration = time.perf_counter() - start_time
+
+    await client.delete(*keys, *(f"{k}:counter" for k in keys), f"{keys[0]}:last_sync")
+    await client.aclose()
+    return summarize("Lua", admitted, latencies, duration)
+
+
+def summarize(name, admitted, latencies, duration, extra=""):
+    latencies.sort()
+    return {
+        "name": name,
+        "decisions_per_sec": len(latencies) / duration,
+        "admitted": admitted,
+        "overshoot": (admitted - RPM_LIMIT) / RPM_LIMIT,
+        "p99_us": latencies[int(len(latencies) * 0.99)] * 1_000_000,
+        "extra": extra,
+    }
+
+
+async def run_benchmark():
+    print("🛰️ Gossip 近似限流 vs Lua 精确限流")
+    print(f"节点: {NODES}, 限额: {RPM_LIMIT} RPM, 请求: {TOTAL_REQUESTS}, 允许超发: {OVERSHOOT:.0%}")
+    print("=" * 70)
+
+    results = [await run_gossip_benchmark()]
+    lua = await run_lua_benchmark()
+    if lua:
+        results.append(lua)
+
+    print(f"{'路径':<8}{'判定/秒':>12}{'准入':>10}{'超发':>10}{'P99(us)':>12}")
+    for r in results:
+        print(f"{r['name']:<8}{r['decisions_per_sec']:>12.0f}{r['admitted']:>10}{r['overshoot']:>10.2%}"
+              f"{r['p99_us']:>12.1f}  {r['extra']}")
+
+    gossip = results[0]
+    ok = gossip["overshoot"] <= OVERSHOOT
+    print(f"\n{'✅' if ok else '❌'} Gossip 超发 {gossip['overshoot']:.2%}（上限 {OVERSHOOT:.0%}）")
+    return ok
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
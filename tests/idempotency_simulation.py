@@ -0,0 +1,88 @@
+# idempotency_simulation.py
+# 模拟客户端超时重试：每个逻辑请求带同一个 Idempotency-Key 发送多次
+# 1. 进程内 LRU：同一节点上的重复重试直接命中，测量单次查询开销（不需要 Redis）
+# 2. 限流脚本：重试分散到不同节点（没有本地缓存）时仍只计费一次（需要本地 Redis）
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.idempotency import IdempotencyCache
+from app.limiter import LIMITER_SCRIPT, build_limiter_call
+
+LOGICAL_REQUESTS = 200
+ATTEMPTS = 3                 # 首次请求 + 2 次重试
+RPM = 250                    # 不带幂等键时 600 次尝试会超过限额
+LOOKUPS = 200000
+
+
+def measure_local_cache():
+    cache = IdempotencyCache(max_entries=LOGICAL_REQUESTS, ttl=300)
+    for i in range(LOGICAL_REQUESTS):
+        cache.remember("key", f"idem-{i}")
+    start = time.perf_counter()
+    hits = sum(cache.seen("key", f"idem-{i % LOGICAL_REQUESTS}") for i in range(LOOKUPS))
+    per_lookup_ns = (time.perf_counter() - start) / LOOKUPS * 1e9
+    return hits, per_lookup_ns
+
+
+async def drive(script, api_key, use_idempotency):
+    """按 首次请求、重试、重试 的顺序发送，返回 (放行的尝试数, 重放数, 实际计费的请求数)"""
+    allowed = 0
+    replays = 0
+    now_us = int(time.time() * 1_000_000)
+    for attempt in range(ATTEMPTS):
+        for i in range(LOGICAL_REQUESTS):
+            ts = now_us + attempt * 1000 + i
+            keys, args = build_limiter_call(
+                api_key, ts, RPM, 10**9, 10**9, 10, 10, f"{ts}:{attempt}:{i}",
+                idempotency_key=f"idem-{i}" if use_idempotency else None, idempotency_ttl=300,
+            )
+            result = await script(keys=keys, args=args)
+            allowed += result[0] == 1
+            replays += result[1] in (b"IDEMPOTENT_REPLAY", "IDEMPOTENT_REPLAY")
+    return allowed, replays, allowed - replays
+
+
+async def run_simulation():
+    print("🔁 Idempotency-Key 重试模拟")
+    print(f"逻辑请求: {LOGICAL_REQUESTS}, 每个发送 {ATTEMPTS} 次, RPM: {RPM}")
+    print("=" * 70)
+
+    hits, per_lookup_ns = measure_local_cache()
+    local_ok = hits == LOOKUPS
+    print(f"{'✅' if local_ok else '❌'} 进程内缓存命中 {hits}/{LOOKUPS}，{per_lookup_ns:.0f} ns/次")
+
+    client = redis.Redis(host="localhost", port=6379)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"⚠️ 本地 Redis 不可用，跳过脚本部分: {e}")
+        return local_ok
+
+    script = client.register_script(LIMITER_SCRIPT)
+    run = int(time.time())
+    plain = await drive(script, f"idem-sim-{run}-plain", False)
+    idem = await drive(script, f"idem-sim-{run}-idem", True)
+    keys = [k async for k in client.scan_iter(match=f"rl:idem-sim-{run}-*")]
+    if keys:
+        await client.delete(*keys)
+    await client.aclose()
+
+    print(f"\n{'模式':<10}{'放行':>8}{'重放':>8}{'计费':>8}")
+    print(f"{'无幂等键':<10}{plain[0]:>8}{plain[1]:>8}{plain[2]:>8}")
+    print(f"{'幂等键':<10}{idem[0]:>8}{idem[1]:>8}{idem[2]:>8}")
+
+    charged_once = idem[2] == LOGICAL_REQUESTS and idem[1] == LOGICAL_REQUESTS * (ATTEMPTS - 1)
+    double_charged = plain[2] > LOGICAL_REQUESTS
+    print(f"\n{'✅' if charged_once else '❌'} 带幂等键时每个逻辑请求只计费一次，其余重试全部重放")
+    print(f"{'✅' if double_charged else '❌'} 不带幂等键时重试被重复计费（{plain[2]} 次）")
+    return local_ok and charged_once and double_charged
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_simulation())
+    sys.exit(0 if ok else 1)
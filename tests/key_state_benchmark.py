@@ -0,0 +1,141 @@
+# key_state_benchmark.py
+# 节点内按 key 的本地状态：10k / 100k / 1M 个 key 时的内存占用、查找开销与淘汰命中率（不需要 Redis）
+# 对照组为原先的写法：OrderedDict[api_key] -> dict 记录，命中时 move_to_end
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.key_state import KeyStateStore
+
+KEY_COUNTS = [10_000, 100_000, 1_000_000]
+LOOKUPS = 500_000
+LOOKUP_REPEATS = 3                  # 取最快一轮，排除冷缓存与调度抖动
+EVICTION_KEYSPACE = 100_000
+EVICTION_CAPACITY = 10_000
+EVICTION_LOOKUPS = 1_000_000
+ZIPF_S = 1.1
+
+
+class KeyRecord:
+    """典型的按 key 本地状态：过期时间 + 两个计数"""
+    __slots__ = ("expires_at", "tokens", "hits")
+
+    def __init__(self, expires_at, tokens, hits):
+        self.expires_at = expires_at
+        self.tokens = tokens
+        self.hits = hits
+
+
+class DictOfDicts:
+    """对照组"""
+
+    def __init__(self, max_entries):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, record):
+        self._entries[key] = record
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+VARIANTS = {
+    "dict-of-dicts": (lambda n: DictOfDicts(n), lambda i: {"expires_at": 1e9 + i, "tokens": 1000 + i, "hits": 0}),
+    "slots+lru": (lambda n: KeyStateStore(n, policy="lru"), lambda i: KeyRecord(1e9 + i, 1000 + i, 0)),
+    "slots+clock": (lambda n: KeyStateStore(n, policy="clock"), lambda i: KeyRecord(1e9 + i, 1000 + i, 0)),
+}
+
+
+def measure_memory(make_store, make_record, keys):
+    """key 字符串事先创建，不计入；返回每个 key 的平均字节数"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = make_store(len(keys))
+    for i, key in enumerate(keys):
+        store.put(key, make_record(i))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return store, used / len(keys)
+
+
+def measure_lookup(store, lookups):
+    get = store.get
+    best = float("inf")
+    for _ in range(LOOKUP_REPEATS):
+        start = time.perf_counter()
+        for key in lookups:
+            get(key)
+        best = min(best, time.perf_counter() - start)
+    return best / len(lookups) * 1e9
+
+
+def zipf_sequence(keys, count, seed):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) ** ZIPF_S for rank in range(len(keys))]
+    return rng.choices(keys, weights=weights, k=count)
+
+
+def measure_hit_rate(make_store, make_record, sequence):
+    store = make_store(EVICTION_CAPACITY)
+    hits = 0
+    for i, key in enumerate(sequence):
+        if store.get(key) is not None:
+            hits += 1
+        else:
+            store.put(key, make_record(i))
+    return hits / len(sequence)
+
+
+def run_benchmark():
+    print("🗂️ 节点内 key 状态存储压测")
+    print(f"每档随机查找 {LOOKUPS} 次 × {LOOKUP_REPEATS} 轮")
+    print("=" * 70)
+    print(f"{'key 数':>10}  {'实现':<16}{'字节/key':>10}{'查找(ns)':>10}")
+
+    results = {}
+    for count in KEY_COUNTS:
+        keys = [f"sk-{i:012d}" for i in range(count)]
+        rng = random.Random(count)
+        lookups = [keys[rng.randrange(count)] for _ in range(LOOKUPS)]
+        for name, (make_store, make_record) in VARIANTS.items():
+            store, per_key = measure_memory(make_store, make_record, keys)
+            per_lookup = measure_lookup(store, lookups)
+            results[(name, count)] = (per_key, per_lookup)
+            print(f"{count:>10}  {name:<16}{per_key:>10.0f}{per_lookup:>10.0f}")
+            del store
+
+    keys = [f"sk-{i:012d}" for i in range(EVICTION_KEYSPACE)]
+    sequence = zipf_sequence(keys, EVICTION_LOOKUPS, 7)
+    print(f"\n淘汰命中率（{EVICTION_KEYSPACE} 个 key 的 Zipf({ZIPF_S}) 访问，容量 {EVICTION_CAPACITY}）:")
+    hit_rates = {}
+    for name, (make_store, make_record) in VARIANTS.items():
+        hit_rates[name] = measure_hit_rate(make_store, make_record, sequence)
+        print(f"  {name:<16}{hit_rates[name]:>8.2%}")
+
+    memory_ok = all(results[("slots+clock", c)][0] < results[("dict-of-dicts", c)][0] * 0.6 for c in KEY_COUNTS)
+    # 存储多做了命中 / 未命中计数，小规模时与对照组基本持平；规模越大，CLOCK 不移动链表的优势越明显
+    lookup_ok = all(results[("slots+clock", c)][1] < results[("dict-of-dicts", c)][1] * 1.25 for c in KEY_COUNTS)
+    hit_rate_ok = hit_rates["slots+clock"] >= hit_rates["dict-of-dicts"] - 0.02
+    top = KEY_COUNTS[-1]
+    print(f"\n{'✅' if memory_ok else '❌'} 所有规模下 slots+clock 的内存低于对照组的 60% "
+          f"({top} 个 key: {results[('slots+clock', top)][0]:.0f} vs {results[('dict-of-dicts', top)][0]:.0f} 字节/key)")
+    print(f"{'✅' if lookup_ok else '❌'} 所有规模下 slots+clock 的查找开销不超过对照组的 1.25 倍 "
+          f"({top} 个 key: {results[('slots+clock', top)][1]:.0f} vs {results[('dict-of-dicts', top)][1]:.0f} ns)")
+    print(f"{'✅' if hit_rate_ok else '❌'} CLOCK 命中率 {hit_rates['slots+clock']:.2%} 与 LRU "
+          f"{hit_rates['dict-of-dicts']:.2%} 相差不超过 2 个百分点")
+    return memory_ok and lookup_ok and hit_rate_ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_benchmark() else 1)
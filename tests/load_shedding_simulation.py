@@ -0,0 +1,111 @@
+# load_shedding_simulation.py
+# 进程内模拟节点过载：两个套餐以相同速率发送 CPU 密集请求，总负载超过节点处理能力
+# 对比开启/关闭过载保护时付费套餐的延迟，以及两个套餐各自被拒绝的比例（不需要 Redis）
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.load_shedding import LoadShedder, LoadSheddingMiddleware
+
+HANDLER_CPU_SECONDS = 0.002            # 每个请求的 CPU 时间，节点处理能力约 500 请求/秒
+RATE_PER_TIER = 300                    # 每个套餐每秒请求数，总负载约为处理能力的 1.2 倍
+DURATION = 4.0
+TIERS = {"free-key": ("Free Tier", 1), "paid-key": ("Paid Tier", 4)}
+
+
+async def backend(scope, receive, send):
+    """模拟处理函数：读取请求体、等待一次下游往返后做一段 CPU 计算"""
+    await receive()
+    await asyncio.sleep(0.005)
+    deadline = time.perf_counter() + HANDLER_CPU_SECONDS
+    while time.perf_counter() < deadline:
+        pass
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def classify(api_key):
+    return TIERS.get(api_key, ("invalid", 1))
+
+
+async def call(app, api_key, arrival, results):
+    scope = {
+        "type": "http",
+        "path": "/v1/chat/completions",
+        "headers": [(b"authorization", b"Bearer " + api_key.encode())],
+    }
+    body_read = False
+    status = None
+
+    async def receive():
+        nonlocal body_read
+        body_read = True
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    # 延迟从计划到达时刻算起，包含在事件循环中排队的时间
+    results[api_key].append((status, time.perf_counter() - arrival, body_read))
+
+
+async def run_load(shedder):
+    app = LoadSheddingMiddleware(backend, shedder, ["/v1/chat/completions"], classify)
+    shedder.start()
+    results = {key: [] for key in TIERS}
+    tasks = []
+    interval = 1 / (RATE_PER_TIER * len(TIERS))
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - started < DURATION:
+        # 开环发送：按时间表补足应发的请求，不受处理速度影响
+        due = int((time.perf_counter() - started) / interval)
+        while sent < due:
+            key = "free-key" if sent % 2 == 0 else "paid-key"
+            tasks.append(asyncio.ensure_future(call(app, key, started + sent * interval, results)))
+            sent += 1
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*tasks)
+    await shedder.stop()
+    return results
+
+
+def summarize(name, results):
+    print(f"\n{name}")
+    summary = {}
+    for key, items in results.items():
+        ok = sorted(latency for status, latency, _ in items if status == 200)
+        shed = sum(1 for status, _, _ in items if status == 503)
+        p99 = ok[min(len(ok) - 1, int(len(ok) * 0.99))] * 1000 if ok else float("nan")
+        summary[key] = (shed / len(items), p99)
+        print(f"  {TIERS[key][0]:<10} 请求 {len(items):>5}  拒绝 {shed / len(items):>6.1%}  成功 P99 {p99:>8.1f}ms")
+    return summary
+
+
+async def run_simulation():
+    print("🛡️ 节点过载保护模拟")
+    print(f"处理能力约 {1 / HANDLER_CPU_SECONDS:.0f} 请求/秒, 负载 {RATE_PER_TIER * len(TIERS)} 请求/秒, 持续 {DURATION}s")
+    print("=" * 70)
+
+    baseline = summarize("关闭过载保护", await run_load(LoadShedder(max_in_flight=10**9, max_lag=10**9)))
+    results = await run_load(LoadShedder(max_in_flight=100, max_lag=0.05))
+    shedding = summarize("开启过载保护", results)
+
+    free_first = shedding["free-key"][0] > shedding["paid-key"][0]
+    latency_ok = shedding["paid-key"][1] < baseline["paid-key"][1] / 2
+    no_body_read = all(not body_read for items in results.values() for status, _, body_read in items if status == 503)
+    print(f"\n{'✅' if free_first else '❌'} 免费套餐先被拒绝")
+    print(f"{'✅' if latency_ok else '❌'} 付费套餐 P99 {shedding['paid-key'][1]:.1f}ms < 关闭时的一半 "
+          f"({baseline['paid-key'][1]:.1f}ms)")
+    print(f"{'✅' if no_body_read else '❌'} 被拒绝的请求没有读取请求体")
+    return free_first and latency_ok and no_body_read
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_simulation())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,197 @@
+# multi_node_accuracy_benchmark.py
+# 多节点精度压测：节点时钟偏差与请求 ID 冲突对滑动窗口精确记录的影响，以及 Redis 时钟的吞吐代价
+# 1. 请求 ID 冲突（不需要 Redis）：4 个节点合计 2 万 QPS，时钟精度 1ms / 15.6ms（Windows）时旧格式的重复数
+# 2. 时钟来源（需要本地 Redis）：4 个节点分别带 -S..+S 的时钟偏差并发调用脚本，
+#    同步突发时比较 ZSET 中记录的时间戳与真实发出时间在 1 秒窗口上的计数误差和被合并的成员数，
+#    另外交替多轮测量两种时钟来源的吞吐
+import asyncio
+import bisect
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.limiter import LIMITER_SCRIPT, build_limiter_call
+from app.request_ids import RequestIdGenerator
+
+NODES = 4
+SKEW_SECONDS = 0.5                  # 节点时钟偏差在 [-S, +S] 内均匀分布
+COLLISION_QPS = 20000
+COLLISION_SECONDS = 5
+CLOCK_RESOLUTIONS_US = [1, 1000, 15600]
+BURST_PERIOD = 2.0                  # 所有节点在真实时间上同步突发：每 2 秒突发 0.5 秒
+BURST_SECONDS = 0.5
+ACCURACY_SECONDS = 6.0
+CONCURRENCY_PER_NODE = 2            # 低并发，排队延迟远小于时钟偏差
+EVAL_WINDOW_SECONDS = 1.0
+EVAL_STEP_SECONDS = 0.1
+THROUGHPUT_ROUNDS = 3
+THROUGHPUT_CALLS = 4000
+THROUGHPUT_CONCURRENCY = 50
+
+
+def legacy_request_id(ts_us: int) -> str:
+    """原先的格式：时间戳微秒 + 3 位随机数"""
+    return f"{ts_us}{random.randint(100, 999)}"
+
+
+def measure_collisions():
+    """虚拟时钟下生成请求 ID，返回 {时钟精度: 重复数}，以及两种格式的生成开销"""
+    random.seed(7)
+    total = COLLISION_QPS * COLLISION_SECONDS
+    arrivals = sorted(random.randrange(COLLISION_SECONDS * 1_000_000) for _ in range(total))
+    duplicates = {}
+    for resolution in CLOCK_RESOLUTIONS_US:
+        ids = {legacy_request_id(t // resolution * resolution) for t in arrivals}
+        duplicates[resolution] = total - len(ids)
+
+    generators = [RequestIdGenerator(f"node-{n}") for n in range(NODES)]
+    new_ids = {generators[i % NODES].next() for i in range(total)}
+    duplicates["node_scoped"] = total - len(new_ids)
+
+    start = time.perf_counter()
+    for t in arrivals:
+        legacy_request_id(t)
+    legacy_ns = (time.perf_counter() - start) / total * 1e9
+    generator = generators[0]
+    start = time.perf_counter()
+    for _ in range(total):
+        generator.next()
+    new_ns = (time.perf_counter() - start) / total * 1e9
+    return duplicates, legacy_ns, new_ns
+
+
+async def run_bursty_nodes(script, api_key, server_clock, legacy_ids):
+    """NODES 个节点按同步的突发节奏调用脚本，返回每个请求发出时的真实时间"""
+    skews = [SKEW_SECONDS * (2 * n / (NODES - 1) - 1) for n in range(NODES)]
+    arrivals = []
+    started = time.time()
+
+    async def worker(index, generator):
+        while True:
+            now = time.time()
+            elapsed = now - started
+            if elapsed >= ACCURACY_SECONDS:
+                return
+            phase = elapsed % BURST_PERIOD
+            if phase >= BURST_SECONDS:
+                await asyncio.sleep(BURST_PERIOD - phase)
+                continue
+            node_time_us = int((now + skews[index]) * 1_000_000)
+            request_id = legacy_request_id(node_time_us) if legacy_ids else generator.next()
+            keys, args = build_limiter_call(api_key, node_time_us, 10**9, 10**12, 10**12, 1, 1, request_id,
+                                            server_clock=server_clock)
+            await script(keys=keys, args=args)
+            arrivals.append(now)
+
+    generators = [RequestIdGenerator(f"node-{n}") for n in range(NODES)]
+    await asyncio.gather(*(worker(n, generators[n]) for n in range(NODES) for _ in range(CONCURRENCY_PER_NODE)))
+    return arrivals
+
+
+async def measure_throughput(script, api_key, server_clock):
+    generator = RequestIdGenerator("throughput")
+    remaining = iter(range(THROUGHPUT_CALLS))
+
+    async def worker():
+        for _ in remaining:
+            now_us = int(time.time() * 1_000_000)
+            keys, args = build_limiter_call(api_key, now_us, 10**9, 10**12, 10**12, 1, 1, generator.next(),
+                                            server_clock=server_clock)
+            await script(keys=keys, args=args)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(THROUGHPUT_CONCURRENCY)))
+    return THROUGHPUT_CALLS / (time.perf_counter() - started)
+
+
+def window_error(true_times, recorded_times):
+    """沿时间轴滑动 EVAL_WINDOW_SECONDS 窗口，记录时间戳计数与真实计数之差的总和 / 真实计数总和"""
+    true_times = sorted(true_times)
+    recorded_times = sorted(recorded_times)
+    t = true_times[0]
+    end = true_times[-1] + EVAL_WINDOW_SECONDS
+    error = 0
+    total = 0
+    while t <= end:
+        true_count = bisect.bisect_right(true_times, t) - bisect.bisect_right(true_times, t - EVAL_WINDOW_SECONDS)
+        recorded_count = (bisect.bisect_right(recorded_times, t)
+                          - bisect.bisect_right(recorded_times, t - EVAL_WINDOW_SECONDS))
+        error += abs(recorded_count - true_count)
+        total += true_count
+        t += EVAL_STEP_SECONDS
+    return error / total if total else 0.0
+
+
+async def run_benchmark():
+    print("🕰️ 多节点精度压测")
+    print(f"节点数: {NODES}, 时钟偏差: ±{SKEW_SECONDS}s")
+    print("=" * 70)
+
+    duplicates, legacy_ns, new_ns = measure_collisions()
+    total = COLLISION_QPS * COLLISION_SECONDS
+    print(f"请求 ID 冲突（{total} 个请求, {COLLISION_QPS} QPS）:")
+    for resolution in CLOCK_RESOLUTIONS_US:
+        print(f"  旧格式, 时钟精度 {resolution / 1000:>6.3f}ms: 重复 {duplicates[resolution]:>6}")
+    print(f"  节点单调 ID:                重复 {duplicates['node_scoped']:>6}")
+    print(f"生成开销: 旧格式 {legacy_ns:.0f} ns/个, 节点单调 ID {new_ns:.0f} ns/个")
+    ids_ok = duplicates["node_scoped"] == 0
+    print(f"{'✅' if ids_ok else '❌'} 节点单调 ID 没有重复")
+
+    client = redis.Redis(host="localhost", port=6379, max_connections=THROUGHPUT_CONCURRENCY)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"\n⚠️ 本地 Redis 不可用，跳过时钟来源部分: {e}")
+        return ids_ok
+
+    script = client.register_script(LIMITER_SCRIPT)
+    # 本机 Redis 与 time.time() 之间的偏移，用于把 Redis 时间戳换算到本地时间轴
+    seconds, micros = await client.time()
+    offset = seconds + micros / 1_000_000 - time.time()
+
+    run = int(time.time())
+    modes = [
+        ("本地时钟 + 旧 ID", False, True),
+        ("Redis 时钟 + 节点 ID", True, False),
+    ]
+    print(f"\n{'模式':<22}{'请求数':>8}{'合并成员':>10}{'窗口计数误差':>14}")
+    results = {}
+    for name, server_clock, legacy_ids in modes:
+        api_key = f"clock-bench-{run}-{int(server_clock)}"
+        arrivals = await run_bursty_nodes(script, api_key, server_clock, legacy_ids)
+        members = await client.zrange(f"rl:{api_key}:req", 0, -1, withscores=True)
+        recorded = [score / 1_000_000 - (offset if server_clock else 0.0) for _, score in members]
+        merged = len(arrivals) - len(members)
+        error = window_error(arrivals, recorded)
+        results[name] = (merged, error)
+        print(f"{name:<22}{len(arrivals):>8}{merged:>10}{error:>14.2%}")
+
+    throughput = {False: [], True: []}
+    for round_no in range(THROUGHPUT_ROUNDS):
+        for server_clock in (False, True):
+            throughput[server_clock].append(
+                await measure_throughput(script, f"clock-bench-{run}-tp-{int(server_clock)}", server_clock))
+    local_qps = sum(throughput[False]) / THROUGHPUT_ROUNDS
+    server_qps = sum(throughput[True]) / THROUGHPUT_ROUNDS
+    print(f"\n吞吐（并发 {THROUGHPUT_CONCURRENCY}）: 本地时钟 {local_qps:.0f} QPS, Redis 时钟 {server_qps:.0f} QPS")
+
+    keys = [k async for k in client.scan_iter(match=f"rl:clock-bench-{run}-*")]
+    if keys:
+        await client.delete(*keys)
+    await client.aclose()
+
+    local, server = results["本地时钟 + 旧 ID"], results["Redis 时钟 + 节点 ID"]
+    accuracy_ok = server[1] < local[1] and server[0] == 0
+    cost = 1 - server_qps / local_qps
+    cost_ok = cost < 0.10
+    print(f"\n{'✅' if accuracy_ok else '❌'} Redis 时钟的窗口计数误差 {server[1]:.2%} < 本地时钟 {local[1]:.2%}，且没有成员被合并")
+    print(f"{'✅' if cost_ok else '❌'} Redis 时钟吞吐代价 {cost:+.1%}（< 10%，脚本内多一次 TIME）")
+    return ids_ok and accuracy_ok and cost_ok
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
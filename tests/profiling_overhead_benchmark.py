@@ -0,0 +1,88 @@
+# profiling_overhead_benchmark.py
+# 测量按阶段计时与采样分析器的开销：
+# 1. 每个请求 PhaseTimer + 直方图汇总的耗时
+# 2. 采样分析器开启/关闭时同一段 CPU 密集协程负载的吞吐差异，并检查输出的 collapsed stack
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.profiling import PhaseHistograms, PhaseTimer, SamplingProfiler
+
+TIMER_ITERATIONS = 100000
+PHASES = ("parse", "auth", "tokens", "cache", "limiter", "generate", "serialize")
+WORKLOAD_SECONDS = 2.0
+
+
+def measure_timer_overhead():
+    histograms = PhaseHistograms()
+    start = time.perf_counter()
+    for _ in range(TIMER_ITERATIONS):
+        timer = PhaseTimer()
+        for phase in PHASES:
+            timer.mark(phase)
+        timer.server_timing()
+        histograms.observe_timer(timer)
+    per_request_us = (time.perf_counter() - start) / TIMER_ITERATIONS * 1_000_000
+    return per_request_us, histograms.snapshot()
+
+
+async def handler_like_workload():
+    """模拟处理函数：少量计算 + 让出事件循环"""
+    total = 0
+    for i in range(200):
+        total += i * i
+    await asyncio.sleep(0)
+    return total
+
+
+async def run_workload(seconds):
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        await asyncio.gather(*(handler_like_workload() for _ in range(100)))
+        done += 100
+    return done / seconds
+
+
+async def run_benchmark():
+    print("🔬 诊断功能开销测试")
+    print("=" * 70)
+
+    per_request_us, snapshot = measure_timer_overhead()
+    print(f"PhaseTimer + 直方图: {per_request_us:.2f} us/请求（{len(PHASES)} 个阶段）")
+    print(f"直方图阶段: {', '.join(snapshot)}")
+
+    baseline = await run_workload(WORKLOAD_SECONDS)
+
+    profiler = SamplingProfiler(interval=0.005)
+    output_path = os.path.join(tempfile.gettempdir(), f"profile-bench-{os.getpid()}.folded")
+    profiler.start(WORKLOAD_SECONDS, output_path)
+    profiled = await run_workload(WORKLOAD_SECONDS)
+    while profiler.running:
+        await asyncio.sleep(0.05)
+
+    with open(output_path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    os.remove(output_path)
+
+    slowdown = 1 - profiled / baseline
+    print(f"\n{'模式':<12}{'协程/秒':>14}")
+    print(f"{'关闭':<12}{baseline:>14.0f}")
+    print(f"{'采样中':<12}{profiled:>14.0f}")
+    print(f"采样开销: {slowdown:.1%}, 样本数: {profiler.samples}, 不同调用栈: {len(lines)}")
+
+    found = any("handler_like_workload" in line for line in lines)
+    valid = all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    ok = found and valid and per_request_us < 50
+    print(f"\n{'✅' if found else '❌'} 采样结果包含热点函数")
+    print(f"{'✅' if valid else '❌'} 输出为 collapsed stack 格式")
+    print(f"{'✅' if per_request_us < 50 else '❌'} 计时开销低于 50us/请求")
+    return ok
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,107 @@
+# redis_mux_benchmark.py
+# 对比连接池与多路复用客户端在 100-2000 并发下调用限流脚本的吞吐、延迟与 Redis 连接数（需要本地 Redis）
+# 连接池按 app/main.py 的配置（REDIS_POOL_MAX_CONNECTIONS）创建，并发超过上限时会报 Too many connections
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.config import REDIS_MUX_CONNECTIONS, REDIS_POOL_MAX_CONNECTIONS
+from app.limiter import LIMITER_SCRIPT, build_limiter_call
+from app.redis_mux import MultiplexedRedis
+
+CONCURRENCY_LEVELS = [100, 500, 1000, 2000]
+CALLS_PER_LEVEL = 20000
+KEYS = 1000
+
+
+async def run_level(client, concurrency, run_id):
+    """以固定并发持续调用脚本，返回 (耗时, 延迟列表, 错误数, 运行结束时的 Redis 客户端连接数)"""
+    script = client.register_script(LIMITER_SCRIPT)
+    await client.script_load(LIMITER_SCRIPT)
+    latencies = []
+    errors = 0
+    counter = iter(range(CALLS_PER_LEVEL))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            now_us = int(time.time() * 1_000_000)
+            keys, args = build_limiter_call(
+                f"mux-bench-{run_id}-{i % KEYS}", now_us, 10**9, 10**12, 10**12, 100, 50, f"{now_us}:{i}",
+            )
+            start = time.perf_counter()
+            try:
+                await script(keys=keys, args=args)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+async def connected_clients(monitor):
+    return (await monitor.info("clients"))["connected_clients"]
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else float("nan")
+
+
+async def run_benchmark():
+    print("🔌 连接池 vs 多路复用客户端")
+    print(f"每档调用: {CALLS_PER_LEVEL}, 连接池上限: {REDIS_POOL_MAX_CONNECTIONS}, 多路复用连接数: {REDIS_MUX_CONNECTIONS}")
+    print("=" * 70)
+
+    monitor = redis.Redis(host="localhost", port=6379)
+    try:
+        await monitor.ping()
+    except Exception as e:
+        print(f"⚠️ 本地 Redis 不可用，跳过: {e}")
+        return True
+
+    run_id = int(time.time())
+    print(f"{'模式':<8}{'并发':>6}{'QPS':>10}{'P50(ms)':>10}{'P99(ms)':>10}{'错误':>8}{'连接数':>8}")
+    results = {}
+    for concurrency in CONCURRENCY_LEVELS:
+        for mode in ("pool", "mux"):
+            baseline = await connected_clients(monitor)
+            if mode == "pool":
+                client = redis.Redis(host="localhost", port=6379, max_connections=REDIS_POOL_MAX_CONNECTIONS)
+            else:
+                client = MultiplexedRedis("localhost", 6379, REDIS_MUX_CONNECTIONS)
+            duration, latencies, errors = await run_level(client, concurrency, run_id)
+            connections = await connected_clients(monitor) - baseline
+            await client.aclose()
+
+            latencies.sort()
+            qps = len(latencies) / duration
+            results[(mode, concurrency)] = (qps, errors, connections)
+            print(f"{mode:<8}{concurrency:>6}{qps:>10.0f}{percentile(latencies, 0.5):>10.2f}"
+                  f"{percentile(latencies, 0.99):>10.2f}{errors:>8}{connections:>8}")
+
+    keys = [k async for k in monitor.scan_iter(match=f"rl:mux-bench-{run_id}-*", count=1000)]
+    for start in range(0, len(keys), 1000):
+        await monitor.delete(*keys[start:start + 1000])
+    await monitor.aclose()
+
+    top = CONCURRENCY_LEVELS[-1]
+    mux_connections_ok = all(results[("mux", c)][2] <= REDIS_MUX_CONNECTIONS for c in CONCURRENCY_LEVELS)
+    mux_errors_ok = all(results[("mux", c)][1] == 0 for c in CONCURRENCY_LEVELS)
+    throughput_ok = results[("mux", top)][0] >= results[("pool", top)][0]
+    print(f"\n{'✅' if mux_connections_ok else '❌'} 多路复用连接数不随并发增长（≤ {REDIS_MUX_CONNECTIONS}）")
+    print(f"{'✅' if mux_errors_ok else '❌'} 多路复用在所有并发档位无错误")
+    print(f"{'✅' if throughput_ok else '❌'} 并发 {top} 时多路复用吞吐 {results[('mux', top)][0]:.0f} "
+          f"≥ 连接池 {results[('pool', top)][0]:.0f}")
+    return mux_connections_ok and mux_errors_ok and throughput_ok
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)
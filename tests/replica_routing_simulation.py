@@ -0,0 +1,154 @@
+# replica_routing_simulation.py
+# 只读副本路由：本地启动 1 主 2 从的 redis-server，验证用量查询走副本、主节点只承担限流脚本，
+# 副本滞后（断开复制）或宕机时回退，恢复后重新使用副本（需要 PATH 中有 redis-server）
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.limiter import LIMITER_SCRIPT, build_limiter_call
+from app.redis_replicas import ReplicaRouter
+from app.usage_query import UsageQuery
+
+PRIMARY_PORT = 6390
+REPLICA_PORTS = [6391, 6392]
+MAX_STALENESS = 0.5
+PROBE_INTERVAL = 0.05
+PHASE_SECONDS = 2.0
+USAGE_QPS = 500
+LIMITER_CONCURRENCY = 20
+API_KEYS = 100
+HEARTBEAT_KEY = "replica:heartbeat:replica-sim"
+USAGE_CONFIG = {"name": "sim", "rpm": 1, "input_tpm": 1, "output_tpm": 1}
+
+
+def start_server(port, workdir, primary_port=None):
+    args = ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no", "--dir", workdir]
+    if primary_port is not None:
+        args += ["--replicaof", "127.0.0.1", str(primary_port)]
+    return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client):
+    for _ in range(100):
+        try:
+            await client.ping()
+            return
+        except Exception:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("redis-server 未能启动")
+
+
+async def command_calls(client, command):
+    stats = await client.info("commandstats")
+    return stats.get(f"cmdstat_{command}", {}).get("calls", 0)
+
+
+async def run_phase(router, usage, script, name):
+    """限流脚本持续写主节点，同时以 USAGE_QPS 查询用量，统计读路由与读取到的数据滞后"""
+    before = (router.replica_reads, router.primary_reads, router.fallbacks)
+    errors = 0
+    max_lag = 0.0
+    stop = time.perf_counter() + PHASE_SECONDS
+
+    async def limiter_worker(worker):
+        i = 0
+        while time.perf_counter() < stop:
+            now_us = int(time.time() * 1_000_000)
+            keys, args = build_limiter_call(f"replica-sim-{(worker + i) % API_KEYS}", now_us,
+                                            10**9, 10**12, 10**12, 10, 5, f"{now_us}:{worker}:{i}")
+            await script(keys=keys, args=args)
+            i += 1
+
+    async def usage_reader():
+        nonlocal errors, max_lag
+        while time.perf_counter() < stop:
+            read_started = time.time()
+            try:
+                # 主节点上的心跳是最新的写入时刻，读到的心跳与发起时刻之差即本次读取的数据滞后
+                heartbeat = await router.get(HEARTBEAT_KEY)
+                await usage.get("replica-sim-0", USAGE_CONFIG)
+                if heartbeat is not None:
+                    max_lag = max(max_lag, read_started - float(heartbeat) - PROBE_INTERVAL)
+            except Exception:
+                errors += 1
+            await asyncio.sleep(1 / USAGE_QPS)
+
+    await asyncio.gather(*(limiter_worker(w) for w in range(LIMITER_CONCURRENCY)), usage_reader())
+    replica_reads = router.replica_reads - before[0]
+    primary_reads = router.primary_reads - before[1]
+    fallbacks = router.fallbacks - before[2]
+    lags = ", ".join("∞" if lag == float("inf") else f"{lag * 1000:.0f}ms" for lag in router.staleness)
+    print(f"{name:<16}{replica_reads:>8}{primary_reads:>8}{fallbacks:>8}{errors:>6}{max(0.0, max_lag) * 1000:>10.0f}  [{lags}]")
+    return replica_reads, primary_reads, errors, max_lag
+
+
+async def run_simulation():
+    print("🔁 只读副本路由模拟")
+    print(f"1 主 {len(REPLICA_PORTS)} 从, 最大滞后 {MAX_STALENESS}s, 探测间隔 {PROBE_INTERVAL}s")
+    print("=" * 70)
+    if shutil.which("redis-server") is None:
+        print("⚠️ 未找到 redis-server，跳过")
+        return True
+
+    workdir = tempfile.mkdtemp(prefix="replica-sim-")
+    processes = [start_server(PRIMARY_PORT, workdir)]
+    processes += [start_server(port, workdir, PRIMARY_PORT) for port in REPLICA_PORTS]
+    primary = redis.Redis(port=PRIMARY_PORT)
+    replicas = [redis.Redis(port=port) for port in REPLICA_PORTS]
+    try:
+        for client in [primary, *replicas]:
+            await wait_ready(client)
+        router = ReplicaRouter(primary, replicas, HEARTBEAT_KEY,
+                               max_staleness=MAX_STALENESS, probe_interval=PROBE_INTERVAL)
+        usage = UsageQuery(router, 60, ttl=0)   # 不使用节点缓存，每次查询都访问 Redis
+        script = primary.register_script(LIMITER_SCRIPT)
+        router.start()
+        await asyncio.sleep(0.5)
+
+        print(f"{'阶段':<16}{'副本读':>8}{'主节点读':>8}{'回退':>8}{'错误':>6}{'滞后(ms)':>10}")
+        mget_before = await command_calls(primary, "mget")
+        healthy = await run_phase(router, usage, script, "副本正常")
+        primary_mget = await command_calls(primary, "mget") - mget_before
+
+        # 断开两个副本的复制：心跳不再前进，超过滞后上限后回到主节点
+        for replica in replicas:
+            await replica.replicaof("NO", "ONE")
+        lagging = await run_phase(router, usage, script, "副本滞后")
+
+        # 恢复复制，其中一个副本随后宕机：读操作只落在剩下的副本上
+        for replica in replicas:
+            await replica.replicaof("127.0.0.1", PRIMARY_PORT)
+        await asyncio.sleep(1.0)
+        processes[2].kill()
+        processes[2].wait()
+        one_down = await run_phase(router, usage, script, "一个副本宕机")
+        await router.stop()
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    offloaded = healthy[1] == 0 and primary_mget == 0 and healthy[0] > 0
+    bounded = healthy[3] <= MAX_STALENESS and one_down[3] <= MAX_STALENESS
+    fallback_ok = lagging[1] > 0 and lagging[3] <= MAX_STALENESS + PROBE_INTERVAL
+    recovered = one_down[0] > 0
+    no_errors = healthy[2] == lagging[2] == one_down[2] == 0
+    print(f"\n{'✅' if offloaded else '❌'} 副本正常时主节点没有收到用量查询 (MGET {primary_mget} 次)")
+    print(f"{'✅' if bounded else '❌'} 从副本读到的数据滞后不超过 {MAX_STALENESS * 1000:.0f}ms")
+    print(f"{'✅' if fallback_ok else '❌'} 副本滞后超界后回退到主节点")
+    print(f"{'✅' if recovered else '❌'} 复制恢复后重新使用副本")
+    print(f"{'✅' if no_errors else '❌'} 副本滞后或宕机期间用量查询没有失败")
+    return offloaded and bounded and fallback_ok and recovered and no_errors
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_simulation())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,99 @@
+# response_cache_benchmark.py
+# 回放一段包含重复 temperature=0 请求的工作负载，对比有无响应缓存时的命中率、上游调用数与延迟
+# 在进程内运行，上游以固定延迟模拟，不需要启动节点
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.models import ChatCompletionRequest
+from app.response_cache import ResponseCache, is_cacheable, request_cache_key
+
+TOTAL_REQUESTS = 5000
+DISTINCT_PROMPTS = 500
+ZIPF_EXPONENT = 1.1          # 越大重复越集中（评测集、重试）
+DETERMINISTIC_RATIO = 0.7    # temperature=0 的请求比例
+UPSTREAM_LATENCY = 0.05      # 模拟上游生成耗时（秒）
+CONCURRENCY = 100
+
+
+def build_workload():
+    """按 Zipf 分布生成请求序列，模拟评测与重试中的重复 prompt"""
+    random.seed(7)
+    weights = [1 / (rank ** ZIPF_EXPONENT) for rank in range(1, DISTINCT_PROMPTS + 1)]
+    prompts = random.choices(range(DISTINCT_PROMPTS), weights=weights, k=TOTAL_REQUESTS)
+    workload = []
+    for prompt_id in prompts:
+        temperature = 0 if random.random() < DETERMINISTIC_RATIO else 0.7
+        workload.append(ChatCompletionRequest.model_validate({
+            "model": "gpt-4-turbo",
+            "temperature": temperature,
+            "messages": [{"role": "user", "content": f"eval prompt #{prompt_id}"}],
+        }))
+    return workload
+
+
+async def replay(workload, cache):
+    upstream_calls = 0
+    latencies = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def upstream(body):
+        nonlocal upstream_calls
+        upstream_calls += 1
+        await asyncio.sleep(UPSTREAM_LATENCY)
+        return {"model": body.model, "choices": [{"message": {"content": "ok"}}]}
+
+    async def handle(body):
+        async with semaphore:
+            start = time.perf_counter()
+            if cache is not None and is_cacheable(body):
+                key = request_cache_key(body)
+                payload = await cache.lookup(key)
+                if payload is None:
+                    await cache.get_or_compute(key, lambda: upstream(body))
+            else:
+                await upstream(body)
+            latencies.append(time.perf_counter() - start)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(handle(body) for body in workload))
+    duration = time.perf_counter() - start_time
+
+    latencies.sort()
+    return {
+        "duration": duration,
+        "upstream_calls": upstream_calls,
+        "avg_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+async def run_benchmark():
+    print("🗄️ 响应缓存回放基准")
+    print(f"请求数: {TOTAL_REQUESTS}, 不同 prompt: {DISTINCT_PROMPTS}, 确定性比例: {DETERMINISTIC_RATIO:.0%}, "
+          f"上游延迟: {UPSTREAM_LATENCY*1000:.0f}ms")
+    print("=" * 70)
+
+    workload = build_workload()
+    baseline = await replay(workload, None)
+    cache = ResponseCache(max_entries=10000, ttl=300)
+    cached = await replay(workload, cache)
+    stats = cache.stats()
+
+    print(f"{'模式':<10}{'上游调用':>10}{'平均ms':>10}{'P50ms':>10}{'P99ms':>10}{'耗时s':>10}")
+    for name, r in (("无缓存", baseline), ("缓存", cached)):
+        print(f"{name:<10}{r['upstream_calls']:>10}{r['avg_ms']:>10.2f}{r['p50_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['duration']:>10.2f}")
+
+    print(f"\n命中率: {stats['hit_rate']:.1%} (命中 {stats['hits']}, 未命中 {stats['misses']}, "
+          f"并发合并 {stats['collapsed']})")
+    saved = 1 - cached["upstream_calls"] / baseline["upstream_calls"]
+    print(f"上游调用减少: {saved:.1%}, 平均延迟降低: {1 - cached['avg_ms'] / baseline['avg_ms']:.1%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
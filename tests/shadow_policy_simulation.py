@@ -0,0 +1,88 @@
+# shadow_policy_simulation.py
+# 用虚拟时钟直接调用限流脚本，验证影子策略（dry-run）在同一次调用中评估（需要本地 Redis）
+# 1. 影子策略不改变正式判定：开启前后放行序列完全相同
+# 2. 影子策略的首次拒绝位置与按影子限额单独执行一遍的结果一致
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import redis.asyncio as redis
+
+from app.limiter import LIMITER_SCRIPT, build_limiter_call
+from app.shadow_policy import NO_SHADOW, ShadowStats
+
+RPM = 100
+SHADOW_RPM = 60
+START_US = 1_800_000_000_000_000
+REQUESTS = 300                       # 1 分钟内均匀发送 3 倍 RPM
+
+
+def schedule():
+    spacing = 60_000_000 // REQUESTS
+    return [START_US + i * spacing for i in range(REQUESTS)]
+
+
+def decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def drive(script, api_key, rpm, shadow):
+    """返回 [(allowed, reason, shadow_reason)]"""
+    results = []
+    for seq, ts in enumerate(schedule()):
+        keys, args = build_limiter_call(api_key, ts, rpm, 10**9, 10**9, 1, 1, f"{ts}:{seq}", shadow=shadow)
+        result = await script(keys=keys, args=args)
+        results.append((result[0] == 1, decode(result[1]), decode(result[2])))
+    return results
+
+
+async def run_simulation():
+    print("🕶️ 影子策略模拟（虚拟时钟）")
+    print(f"正式 RPM: {RPM}, 影子 RPM: {SHADOW_RPM}, 请求数: {REQUESTS}")
+    print("=" * 70)
+
+    client = redis.Redis(host="localhost", port=6379)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"⚠️ 本地 Redis 不可用，跳过: {e}")
+        return True
+
+    script = client.register_script(LIMITER_SCRIPT)
+    run = int(time.time())
+    baseline = await drive(script, f"shadow-sim-{run}-base", RPM, NO_SHADOW)
+    with_shadow = await drive(script, f"shadow-sim-{run}-shadow", RPM, (SHADOW_RPM, 10**9, 10**9))
+    enforced = await drive(script, f"shadow-sim-{run}-enforced", SHADOW_RPM, NO_SHADOW)
+
+    keys = [k async for k in client.scan_iter(match=f"rl:shadow-sim-{run}-*")]
+    if keys:
+        await client.delete(*keys)
+    await client.aclose()
+
+    stats = ShadowStats()
+    for allowed, reason, shadow in with_shadow:
+        stats.observe("sim", "shadow-sim", reason, shadow)
+    summary = stats.stats()["sim"]
+    print(f"正式放行: {sum(r[0] for r in with_shadow)}, 影子会拒绝: {summary['would_reject']}, "
+          f"其中正式放行的: {summary['newly_rejected']}")
+
+    unchanged = [r[:2] for r in baseline] == [r[:2] for r in with_shadow]
+    no_shadow_empty = all(r[2] == "" for r in baseline)
+    print(f"{'✅' if unchanged else '❌'} 开启影子策略不改变正式判定")
+    print(f"{'✅' if no_shadow_empty else '❌'} 未配置影子策略时结论为空")
+
+    # 影子策略基于正式策略的计数器评估：在正式放行量不超过影子限额之前，
+    # 影子结论应与“按影子限额正式执行”一致
+    shadow_first_reject = next(i for i, r in enumerate(with_shadow) if r[2] != "ALLOWED")
+    enforced_first_reject = next(i for i, r in enumerate(enforced) if not r[0])
+    matches = shadow_first_reject == enforced_first_reject
+    print(f"{'✅' if matches else '❌'} 影子策略首次拒绝位置 {shadow_first_reject} "
+          f"与单独执行的 {enforced_first_reject} 一致")
+    return unchanged and no_shadow_empty and matches
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_simulation())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,138 @@
+# user_sketch_benchmark.py
+# 终端用户（user 字段）count-min sketch 限流的精度与内存测试
+# 第一部分在进程内模拟 sketch，对比精确计数；第二部分需要本地 Redis，验证脚本内限流与内存恒定
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.config import USER_SKETCH_DEPTH, USER_SKETCH_WIDTH, USER_SKETCH_SLICE_SECONDS, WINDOW_SECONDS
+from app.user_sketch import sketch_offsets, sketch_bytes
+
+USER_RPM = 100
+HEAVY_USERS = 10              # 每个发送 2 * USER_RPM 次请求
+LIGHT_USERS = 20000           # 长尾用户，每个只发少量请求
+LIGHT_REQUESTS = 5000         # 一个窗口内 API Key 总请求数约 7000，对应高配额套餐
+
+
+def build_workload():
+    random.seed(11)
+    workload = []
+    for i in range(HEAVY_USERS):
+        workload.extend([f"heavy-{i}"] * (USER_RPM * 2))
+    workload.extend(f"light-{random.randrange(LIGHT_USERS)}" for _ in range(LIGHT_REQUESTS))
+    random.shuffle(workload)
+    return workload
+
+
+def simulate_sketch(workload):
+    """与脚本相同的判定逻辑：估计值达到限额即拒绝，只有放行的请求计入 sketch"""
+    counters = [0] * (USER_SKETCH_DEPTH * USER_SKETCH_WIDTH)
+    offsets_cache = {}
+    admitted = Counter()
+    rejected = Counter()
+    for user in workload:
+        offsets = offsets_cache.get(user)
+        if offsets is None:
+            offsets = offsets_cache[user] = sketch_offsets(user, USER_SKETCH_DEPTH, USER_SKETCH_WIDTH)
+        if min(counters[o] for o in offsets) >= USER_RPM:
+            rejected[user] += 1
+            continue
+        for o in offsets:
+            counters[o] += 1
+        admitted[user] += 1
+
+    # 精确值：每个用户本应放行 min(发送数, USER_RPM)
+    sent = Counter(workload)
+    wrongly_rejected = sum(min(n, USER_RPM) - admitted[u] for u, n in sent.items() if admitted[u] < min(n, USER_RPM))
+    affected_users = sum(1 for u, n in sent.items() if admitted[u] < min(n, USER_RPM))
+    heavy_admitted = [admitted[f"heavy-{i}"] for i in range(HEAVY_USERS)]
+    return {
+        "distinct_users": len(sent),
+        "heavy_max_admitted": max(heavy_admitted),
+        "wrongly_rejected": wrongly_rejected,
+        "affected_users": affected_users,
+        "rejected": sum(rejected.values()),
+    }
+
+
+async def run_redis_check():
+    import redis.asyncio as redis
+    from app.limiter import LIMITER_SCRIPT, build_limiter_call
+
+    client = redis.Redis(host="localhost", port=6379)
+    try:
+        await client.ping()
+    except Exception as e:
+        print(f"⚠️ 本地 Redis 不可用，跳过脚本测试: {e}")
+        return True
+
+    script = client.register_script(LIMITER_SCRIPT)
+    api_key = f"sketch-bench-{int(time.time())}"
+    ok = True
+
+    async def check(user, now_us, seq):
+        keys, args = build_limiter_call(api_key, now_us, 10**9, 10**12, 10**12, 1, 1, f"{now_us}{seq}", user, USER_RPM)
+        result = await script(keys=keys, args=args)
+        return result[0] == 1
+
+    # 单个重度用户超过限额后被拒绝
+    now_us = int(time.time() * 1_000_000)
+    admitted = 0
+    for i in range(USER_RPM + 20):
+        admitted += await check("abuser", now_us + i, i)
+    passed = admitted == USER_RPM
+    ok &= passed
+    print(f"{'✅' if passed else '❌'} 重度用户放行 {admitted}/{USER_RPM + 20}（限额 {USER_RPM}）")
+
+    # 用户数量增长时 sketch 占用保持不变
+    users_key = f"rl:{api_key}:users:{now_us // (USER_SKETCH_SLICE_SECONDS * 1_000_000)}"
+    sizes = []
+    for batch in range(3):
+        await asyncio.gather(*(check(f"u-{batch}-{i}", now_us + 1000 + i, 1000 + batch * 10000 + i)
+                               for i in range(5000)))
+        sizes.append(await client.memory_usage(users_key))
+    passed = max(sizes) <= sketch_bytes(USER_SKETCH_DEPTH, USER_SKETCH_WIDTH) + 128
+    ok &= passed
+    print(f"{'✅' if passed else '❌'} 5k/10k/15k 个用户后 sketch 占用: {sizes} 字节")
+
+    keys = [k async for k in client.scan_iter(match=f"rl:{api_key}:*")]
+    if keys:
+        await client.delete(*keys)
+    await client.aclose()
+    return ok
+
+
+async def run_benchmark():
+    print("👥 终端用户 count-min sketch 限流测试")
+    per_slice = sketch_bytes(USER_SKETCH_DEPTH, USER_SKETCH_WIDTH)
+    slices = WINDOW_SECONDS // USER_SKETCH_SLICE_SECONDS
+    print(f"sketch: {USER_SKETCH_DEPTH} x {USER_SKETCH_WIDTH}, 每个时间片 {per_slice / 1024:.0f} KB, "
+          f"每个 API Key 最多 {per_slice * slices / 1024:.0f} KB")
+    print("=" * 70)
+
+    workload = build_workload()
+    # count-min 高估上界：以 1 - e^-depth 的概率不超过 e / width * 窗口内总请求数
+    bound = 2.718 / USER_SKETCH_WIDTH * len(workload)
+    print(f"理论高估上界: {bound:.1f} 次请求（置信度 {1 - 2.718 ** -USER_SKETCH_DEPTH:.1%}）")
+    start = time.perf_counter()
+    result = simulate_sketch(workload)
+    elapsed = time.perf_counter() - start
+    print(f"模拟 {len(workload)} 个请求，{result['distinct_users']} 个不同用户，用时 {elapsed:.2f}s")
+    print(f"重度用户最多放行: {result['heavy_max_admitted']}（限额 {USER_RPM}）")
+    print(f"误伤: {result['affected_users']} 个用户共 {result['wrongly_rejected']} 次请求 "
+          f"（占全部请求 {result['wrongly_rejected'] / len(workload):.3%}）")
+
+    ok = result["heavy_max_admitted"] <= USER_RPM
+    print(f"{'✅' if ok else '❌'} sketch 只会高估，重度用户不会超过限额")
+
+    ok &= await run_redis_check()
+    return ok
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark())
+    sys.exit(0 if ok else 1)